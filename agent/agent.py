@@ -1,137 +1,367 @@
+import importlib.resources
+import sys
+from typing import Iterator
+
+import yaml
+
 from smolagents import LiteLLMModel
 from smolagents import CodeAgent
-from tools import *
-
-from phoenix.otel import register
-from openinference.instrumentation.smolagents import SmolagentsInstrumentor
-
-# telemetry
-register()
-SmolagentsInstrumentor().instrument()
-
-
-# External Models
-# model_id = "o4-mini"
-# model_id = "gpt-4.1"
-# model_id = "o3-mini"
-# model_id = "gpt-4.1-mini"
-# model_id = "gpt-4.1-nano"
-
-# Local Models
-model_id = "ollama_chat/gemma3:27b-it-qat"
-# model_id = "ollama_chat/magistral:24b"
-# model_id = "ollama_chat/devstral:24b"
-# model_id = "ollama_chat/qwen3:8b"
-# model_id = "ollama_chat/hf.co/unsloth/GLM-4-32B-0414-GGUF:Q4_K_M"
-
-# 
-if any(substring in model_id for substring in ["o3", "o4"]):
-    # reasoning openai models
-    model = LiteLLMModel(
-        model_id=model_id,
-    )
-elif any(substring in model_id for substring in ["4.1"]):
-    # non-reasoning openai models 
-    model = LiteLLMModel(
-        model_id=model_id,
-        temperature=0.3,
-        top_p=0.9,
-    )
-else:
-    # local models
-    model = LiteLLMModel(
-        model_id=model_id,
-        temperature=0.3,
-        top_p=0.9,
-        api_base="http://192.168.8.116:11434",
+from smolagents.memory import ActionStep, FinalAnswerStep, PlanningStep
+from smolagents.models import ChatMessageStreamDelta
+from smolagents.utils import AgentMaxStepsError
+from tools import (
+    approx_sql_query_to_str,
+    count_entities_within_radius,
+    detect_volume_drops,
+    estimate_query_cost,
+    get_column_profile,
+    get_list_of_databases_in_catalog,
+    get_list_of_tables_in_database,
+    get_table_columns_and_types_as_list,
+    metadata_cache,
+    open_cursor,
+    read_cursor,
+    result_cache,
+    search_schema,
+    sql_query_to_str,
+)
+from tool_metrics import begin_run, run_calls, tool_metrics
+
+from config import (
+    CONVERSATION_RECENT_TURNS,
+    CONVERSATION_SUMMARY_TIER,
+    CONVERSATION_TOKEN_BUDGET,
+    MODEL_TIER,
+    MODEL_TIERS,
+    PLAN_CACHE_ENABLED,
+    PLAN_CACHE_MAX_FAILURES,
+    PLAN_CACHE_MIN_SUCCESSES,
+    PLAN_CACHE_PATH,
+    ROUTER_COST_BUDGET,
+    ROUTER_ENABLED,
+    ROUTER_LATENCY_BUDGET_SECONDS,
+)
+from conversation import ConversationMemory, extractive_summary
+from model_usage import begin_model_calls, model_calls
+from plan_cache import PlanCache
+from router import ModelRouter
+
+from telemetry import setup_telemetry
+
+# telemetry, see ORACLE_TELEMETRY_* in config.py
+setup_telemetry()
+
+
+# Models are configured as tiers in config.py (ORACLE_MODEL_TIERS), eg.
+# external: "o4-mini", "gpt-4.1", "o3-mini", "gpt-4.1-mini", "gpt-4.1-nano"
+# local: "ollama_chat/gemma3:27b-it-qat", "ollama_chat/magistral:24b", "ollama_chat/devstral:24b",
+#        "ollama_chat/qwen3:8b", "ollama_chat/hf.co/unsloth/GLM-4-32B-0414-GGUF:Q4_K_M"
+
+def run_tier(question: str, tier: dict, tier_model: LiteLLMModel):
+    """One fresh agent run of `question` on `tier_model`, returning the smolagents RunResult."""
+    begin_run()
+    begin_model_calls()
+    run_agent = build_agent(tier_model, max_steps=tier.get("max_steps", 5), return_full_result=True)
+    return run_agent.run(build_prompt(question, tier_model.model_id))
+
+# classifies each question and escalates through the tiers, see router.py
+router = ModelRouter(
+    MODEL_TIERS,
+    run_tier,
+    latency_budget_seconds=ROUTER_LATENCY_BUDGET_SECONDS,
+    cost_budget=ROUTER_COST_BUDGET,
+)
+default_tier = next(tier for tier in MODEL_TIERS if tier["name"] == MODEL_TIER)
+model_id = default_tier["model_id"]
+model = router.model(default_tier)
+
+# Tools in the order they are described in the system prompt; keep it fixed so the prompt prefix stays cacheable
+AGENT_TOOLS = [
+    search_schema,
+    get_list_of_tables_in_database,
+    get_list_of_databases_in_catalog,
+    get_table_columns_and_types_as_list,
+    get_column_profile,
+    # get_table_description_as_str,
+    # get_column_sample_as_list,
+    # sql_query_to_pandas_df,
+    # get_table_ddl_as_str, 
+    sql_query_to_str,
+    open_cursor,
+    read_cursor,
+    estimate_query_cost,
+    approx_sql_query_to_str,
+    count_entities_within_radius,
+    detect_volume_drops,
+    # sample_table_data,
+    # get_table_history,
+]
+
+# Persona, environment and SQL rules. They are the same for every question, so they go at the end of the
+# system prompt (after the tool descriptions) instead of around each query: every run and every step then
+# starts with the same prefix, which Ollama's KV cache and the OpenAI prompt cache can reuse.
+INSTRUCTIONS = """
+Persona
+------------------
+You are an expert data engineer with expertise in SQL and data analysis.
+You are working with a Spark SQL environment querying an AWS Glue catalog.
+Use the available tools to answer the query.
+
+DB Environment
+------------------
+- typical notation is '<catalog_name>.<database_name>.<table_name>'
+- default catalog is 'prod_catalog'
+- default database is 'adtech_db'
+- default table is 'base'
+
+SQL Query Rules
+------------------
+- User MUST provide full catalog.database.table in the query if asking questions about a specific table.
+    - If table is not provided and query requires a table, return ERROR :: Brief description of error!
+    - If only table name provided, check for table in:
+        - catalog_name == 'prod_catalog' or 'test_catalog'
+        - database_name == 'adtech_db' or 'orbat_db'
+- Use search_schema to find which tables have a column, or a table's columns and partitioning, in one call.
+- Use the provided tools to get table schema and validate before running queries.
+- Use get_column_profile to check a column's values (eg. exact provider spellings) before filtering on them.
+- For "within X km of a point" questions use the count_entities_within_radius tool.
+    - Otherwise use Haversine formula or Spherical Law of Cosines to calculate distance.
+- For "data drop" / missing data / volume change questions use the detect_volume_drops tool first.
+- When a result has more rows than sql_query_to_str shows, use open_cursor and page with read_cursor instead of rerunning the query with OFFSET.
+- Use Spark SQL syntax for all queries.
+- When doing string comparisons, use case-insensitive matching.
+"""
+
+# smolagents' own templates for a CodeAgent with structured outputs, with INSTRUCTIONS added to the system prompt
+PROMPT_TEMPLATES = yaml.safe_load(
+    importlib.resources.files("smolagents.prompts").joinpath("structured_code_agent.yaml").read_text()
+)
+PROMPT_TEMPLATES["system_prompt"] += "\n" + INSTRUCTIONS
+
+def build_agent(
+    model: LiteLLMModel = model, max_steps: int = 5, return_full_result: bool = False, stream_outputs: bool = False
+) -> CodeAgent:
+    """
+    New CodeAgent with its own memory.
+    Agents are not thread safe; concurrent runs each build one and share the model.
+    With `stream_outputs`, run(stream=True) also yields the model's output as it is generated.
+    """
+    return CodeAgent(
+        tools=AGENT_TOOLS,
+        model=model,
+        prompt_templates=PROMPT_TEMPLATES,
+        # additional_authorized_imports=["pandas", "numpy"],
+        max_steps=max_steps,
+        return_full_result=return_full_result,
+        stream_outputs=stream_outputs,
+        # verbosity_level=2,
+        planning_interval=3,
+        use_structured_outputs_internally=True,
+        
     )
 
-agent = CodeAgent(
-    tools=[
-        get_list_of_tables_in_database,
-        get_list_of_databases_in_catalog,
-        get_table_columns_and_types_as_list,
-        # get_table_description_as_str,
-        # get_column_sample_as_list,
-        # sql_query_to_pandas_df,
-        # get_table_ddl_as_str, 
-        sql_query_to_str,
-        # sample_table_data,
-        # get_table_history,
-    ],
-    model=model,
-    # additional_authorized_imports=["pandas", "numpy"],
-    max_steps=5,
-    # verbosity_level=2,
-    planning_interval=3,
-    use_structured_outputs_internally=True,
-    
+agent = build_agent()
+
+def build_prompt(query: str, model_id: str = model_id, context: str = "") -> str:
+    """
+    The task sent for `query`: only what changes between questions, the static
+    instructions are in the system prompt (see INSTRUCTIONS).
+    """
+    # turn off thinking for Qwen3 local models; a soft switch anywhere in the user message works
+    no_think = "\n/no_think" if "qwen3" in model_id else ""
+    # earlier turns of the conversation, see ConversationMemory.context()
+    conversation = f"Conversation so far\n------------------\n{context}\n\n" if context else ""
+    return f"{conversation}QUERY :: {query}{no_think}"
+
+# SQL templates learned from the final sql_query_to_str call of successful runs
+plan_cache = PlanCache(
+    min_successes=PLAN_CACHE_MIN_SUCCESSES,
+    max_failures=PLAN_CACHE_MAX_FAILURES,
+    path=PLAN_CACHE_PATH or None,
 )
 
-def query_agent(query: str):
-    result = agent.run(query)
+def answer_query(question: str, model: LiteLLMModel | None = None) -> str:
+    """
+    Answer `question` from the plan cache when it matches a learned SQL template,
+    otherwise with a fresh agent, learning the run's final sql_query_to_str query
+    when the run succeeds. The agent runs on `model` when given, else on the
+    tier picked by the router (or the default tier when routing is off).
+    """
+    if PLAN_CACHE_ENABLED:
+        plan = plan_cache.lookup(question)
+        if plan is not None:
+            result = sql_query_to_str(plan["sql"])
+            if not result.startswith("Error:"):
+                plan_cache.hit(plan["key"])
+                return f"{result}\n-- answered from a cached plan"
+            # fall back to the full agent loop
+            plan_cache.miss(plan["key"])
+
+    if model is None and ROUTER_ENABLED:
+        result = router.run(question)
+    else:
+        result = run_tier(question, default_tier, model or router.model(default_tier))
+
+    learn_plan(question, result.state == "success")
+    return result.output
+
+def learn_plan(question: str, succeeded: bool) -> None:
+    """Learn the current run's final sql_query_to_str query as the SQL template of `question`, if the run succeeded."""
+    queries = [call for call in run_calls() if call["tool"] == "sql_query_to_str"]
+    if PLAN_CACHE_ENABLED and succeeded and queries and not queries[-1]["error"] and "sql" in queries[-1]:
+        plan_cache.learn(question, queries[-1]["sql"])
+
+def stream_answer(question: str, tier_name: str | None = None, context: str = "") -> Iterator[dict]:
+    """
+    Answer `question` like answer_query, yielding what happens as it happens (for the UI):
+    - {"type": "token", "text"}: model output, as it is generated
+    - {"type": "plan", "text"}: the agent's plan
+    - {"type": "step", "step", "code", "tools": [tool calls with their sql/rows], "observations", "error"}: after each step
+    - {"type": "final", "output", "tier", "cached", "succeeded", "sql", "prompt_tokens", "completion_tokens",
+       "cached_tokens" (prompt tokens the provider served from its prefix cache), "ttft_s" (first model call)}: last
+    Runs on the tier named `tier_name`, else on the one the router picks. Streamed runs are not escalated.
+    `context` (earlier turns of the conversation) is added to the prompt; a question asked with
+    context can depend on it, so its SQL is not learned by the plan cache.
+    """
+    if PLAN_CACHE_ENABLED:
+        plan = plan_cache.lookup(question)
+        if plan is not None:
+            result = sql_query_to_str(plan["sql"])
+            if not result.startswith("Error:"):
+                plan_cache.hit(plan["key"])
+                yield {
+                    "type": "final", "output": result, "tier": None, "cached": True, "succeeded": True,
+                    "sql": plan["sql"], "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "ttft_s": None,
+                }
+                return
+            plan_cache.miss(plan["key"])
+
+    if tier_name is not None:
+        tier = next(tier for tier in MODEL_TIERS if tier["name"] == tier_name)
+    else:
+        tier = router.tiers[router.route(question)] if ROUTER_ENABLED else default_tier
+    tier_model = router.model(tier)
+    begin_run()
+    begin_model_calls()
+    run_agent = build_agent(tier_model, max_steps=tier.get("max_steps", 5), stream_outputs=True)
+    reported, last_step = 0, 0
+    for event in run_agent.run(build_prompt(question, tier_model.model_id, context), stream=True):
+        if isinstance(event, ChatMessageStreamDelta):
+            if event.content:
+                yield {"type": "token", "text": event.content}
+        elif isinstance(event, PlanningStep):
+            yield {"type": "plan", "text": event.plan}
+        # the last step is yielded a second time when the run hits max_steps
+        elif isinstance(event, ActionStep) and event.step_number > last_step:
+            calls = run_calls()
+            yield {
+                "type": "step",
+                "step": event.step_number,
+                "code": event.tool_calls[0].arguments if event.tool_calls else None,
+                "tools": calls[reported:],
+                "observations": event.observations,
+                "error": str(event.error) if event.error else None,
+            }
+            reported, last_step = len(calls), event.step_number
+        elif isinstance(event, FinalAnswerStep):
+            succeeded = not isinstance(getattr(run_agent.memory.steps[-1], "error", None), AgentMaxStepsError)
+            if not context:
+                learn_plan(question, succeeded)
+            queries = [call for call in run_calls() if call["tool"] == "sql_query_to_str" and not call["error"] and "sql" in call]
+            usage = [
+                step.token_usage for step in run_agent.memory.steps
+                if isinstance(step, (ActionStep, PlanningStep)) and step.token_usage
+            ]
+            prompt_tokens = sum(u.input_tokens for u in usage)
+            completion_tokens = sum(u.output_tokens for u in usage)
+            cached_tokens = sum(call["cached_tokens"] for call in model_calls())
+            yield {
+                "type": "final", "output": event.output, "tier": tier["name"], "cached": False, "succeeded": succeeded,
+                "sql": queries[-1]["sql"] if queries else None,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached_tokens": cached_tokens,
+                "ttft_s": model_calls()[0]["ttft_s"] if model_calls() else None,
+            }
+
+def summarize_turn(summary: str, turn: dict) -> str:
+    """
+    `summary` rewritten to take in `turn`, by the CONVERSATION_SUMMARY_TIER model,
+    or one more line per turn without a model call when no tier is set.
+    """
+    if not CONVERSATION_SUMMARY_TIER:
+        return extractive_summary(summary, turn)
+    tier = next(tier for tier in MODEL_TIERS if tier["name"] == CONVERSATION_SUMMARY_TIER)
+    prompt = (
+        "Update the summary of a data investigation with its next turn. Keep table names, filters, "
+        "dates, numbers and conclusions; drop everything else. Answer with the new summary only, "
+        "at most 10 short lines.\n\n"
+        f"Summary so far:\n{summary or '(empty)'}\n\n"
+        f"Next turn:\nUser: {turn['question']}\nAgent: {str(turn['answer'])[:2000]}\nSQL: {turn['sql'] or '(none)'}"
+    )
+    response = router.model(tier).generate([{"role": "user", "content": [{"type": "text", "text": prompt}]}])
+    return response.content.strip() or extractive_summary(summary, turn)
+
+def new_conversation() -> ConversationMemory:
+    """Memory for a new conversation, budgeted by ORACLE_CONVERSATION_* (see config.py)."""
+    return ConversationMemory(
+        budget_tokens=CONVERSATION_TOKEN_BUDGET,
+        recent_turns=CONVERSATION_RECENT_TURNS,
+        summarize=summarize_turn,
+    )
+
+def query_agent(question: str):
+    caches = {"metadata cache": metadata_cache, "result cache": result_cache}
+    before = {name: cache.stats() for name, cache in caches.items()}
+    result = answer_query(question)
     print(result)
 
-if __name__ == "__main__":
-    
-    # example queries
-    query1 = "does EntityId='2E1EF0B6328770FA94ABED6B63FA273A' exist in prod_catalog.adtech_db.base on Jan 31st 2025 to Feb 1st 2025, for isocode = 'RU' ??"
-    query2 = "How many records for EntityId='2E1EF0B6328770FA94ABED6B63FA273A' exist in prod_catalog.adtech_db.base on Jan 31st 2025 to Feb 1st 2025, for isocode = 'RU' ??"
-    query3 = """
+    # every cache hit is a spark round trip we didn't make
+    for name, cache in caches.items():
+        hits = cache.stats()["hits"] - before[name]["hits"]
+        misses = cache.stats()["misses"] - before[name]["misses"]
+        print(f"{name} :: {hits} hits / {misses} misses ({hits} spark round trips saved)")
+
+    print(f"plan cache :: {plan_cache.stats()}")
+
+    for name, totals in router.stats().items():
+        if totals["runs"]:
+            print(
+                f"{name} tier :: {totals['routed']} routed, {totals['runs']} runs, {totals['escalation_rate']:.0%} escalated, "
+                f"p50 {totals['latency_p50_s']}s / p95 {totals['latency_p95_s']}s, {totals['tokens']} tokens, ${totals['cost']}"
+            )
+
+    for name, totals in tool_metrics.summary().items():
+        print(
+            f"{name} :: {totals['calls']} calls, {totals['seconds']}s ({totals['spark_seconds']}s spark), "
+            f"{totals['rows_scanned']:,} rows / {totals['bytes_scanned']:,} bytes scanned, {totals['output_tokens']} output tokens"
+        )
+
+# example queries, also replayed by bench.py
+EXAMPLE_QUERIES = {
+    "query1": "does EntityId='2E1EF0B6328770FA94ABED6B63FA273A' exist in prod_catalog.adtech_db.base on Jan 31st 2025 to Feb 1st 2025, for isocode = 'RU' ??",
+    "query2": "How many records for EntityId='2E1EF0B6328770FA94ABED6B63FA273A' exist in prod_catalog.adtech_db.base on Jan 31st 2025 to Feb 1st 2025, for isocode = 'RU' ??",
+    "query3": """
     I would like to know how many unique EntityId were within 10km of the following latitude and longitude 52.22862088327653, 104.23769255915738 on Jan 31st 2025 in isocode RU.
     use prod_catalog.adtech_db.base table.
-    """
-    query4 = "what unique values do we have for the 'provider' field in prod_catalog.adtech_db.base table on April 13th 2025 in isocode RU.?"
-    query5 = "Explain the data drop in the 3rd week of Jan 2025 for pickwell provider in prod_catalog.adtech_db.base table."
+    """,
+    "query4": "what unique values do we have for the 'provider' field in prod_catalog.adtech_db.base table on April 13th 2025 in isocode RU.?",
+    "query5": "Explain the data drop in the 3rd week of Jan 2025 for pickwell provider in prod_catalog.adtech_db.base table.",
+}
+
+if __name__ == "__main__":
 
     # run query 
     if len(sys.argv) > 1:
         query = sys.argv[1]
     else:
-        query = query1
-
-
-    # turn off thinking for Qwen3 local models
-    no_think = "/no_think" if "qwen3" in model_id else ""
+        query = EXAMPLE_QUERIES["query1"]
 
-    prompt = f"""
-    {no_think}
 
-    Persona
-    ------------------
-    You are an expert data engineer with expertise in SQL and data analysis.
-    You are working with a Spark SQL environment querying an AWS Glue catalog.
-    Use the available tools to answer the query.
-    
-    DB Environment
-    ------------------
-    - typical notation is '<catalog_name>.<database_name>.<table_name>'
-    - default catalog is 'prod_catalog'
-    - default database is 'adtech_db'
-    - default table is 'base'
-
-    SQL Query Rules
-    ------------------
-    - User MUST provide full catalog.database.table in the query if asking questions about a specific table.
-        - If table is not provided and query requires a table, return ERROR :: Brief description of error!
-        - If only table name provided, check for table in:
-            - catalog_name == 'prod_catalog' or 'test_catalog'
-            - database_name == 'adtech_db' or 'orbat_db'
-    - Use the provided tools to get table schema and validate before running queries.
-    - Use Haversine formula or Spherical Law of Cosines to calculate distance.
-    - Use Spark SQL syntax for all queries.
-    - When doing string comparisons, use case-insensitive matching.
-
-    ------------------
-    ------------------
-    
-    QUERY :: {query}
-    """
+    query_agent(query)
     
-    query_agent(prompt)
 
     ## TODO: query refinement! Make sure all pieces are in query and give a second pass at making it more clear for the coding agent. 
     # TODO: add verifier function for the tool 
     # TODO: a bot that can write and read files from disk 
     # TODO: a bot that can write spark sql  (dangerous, but useful)
-    # TODO: move agent persona + rules + env to the system_prompt 
\ No newline at end of file
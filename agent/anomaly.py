@@ -0,0 +1,106 @@
+import numpy as np
+
+# MAD to standard deviation for normally distributed data
+_MAD_SCALE = 1.4826
+STEPS = {"day": np.timedelta64(1, "D"), "hour": np.timedelta64(1, "h")}
+
+
+def volume_matrix(
+    buckets: np.ndarray,
+    keys: dict[str, np.ndarray],
+    counts: np.ndarray,
+    start: np.datetime64,
+    end: np.datetime64,
+    step: np.timedelta64,
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Turn the rows of a `bucket, <dimensions...>, count` aggregation into one
+    dense series per dimension combination, per single dimension value (when
+    there are several dimensions) and for the total, over every bucket from
+    `start` to `end` (exclusive). Missing buckets count 0.
+    Returns (series labels, bucket grid, matrix of shape [series, buckets]).
+    """
+    grid = np.arange(start, end, step)
+    position = ((buckets - start) // step).astype(np.int64)
+    inside = (position >= 0) & (position < len(grid))
+    position, counts = position[inside], counts[inside].astype(np.float64)
+    keys = {name: values[inside] for name, values in keys.items()}
+
+    labels, blocks = [], []
+    if keys:
+        names = list(keys)
+        combos, combo_index = np.unique(np.stack([keys[name] for name in names], axis=1), axis=0, return_inverse=True)
+        blocks.append(_accumulate(combo_index.reshape(-1), len(combos), position, counts, len(grid)))
+        labels += [", ".join(f"{name}={value}" for name, value in zip(names, combo)) for combo in combos]
+        if len(names) > 1:
+            for name in names:
+                values, value_index = np.unique(keys[name], return_inverse=True)
+                blocks.append(_accumulate(value_index, len(values), position, counts, len(grid)))
+                labels += [f"{name}={value}" for value in values]
+    blocks.append(np.bincount(position, weights=counts, minlength=len(grid))[None, :])
+    labels.append("all")
+    return labels, grid, np.vstack(blocks)
+
+
+def find_drops(matrix: np.ndarray, z_threshold: float = 3.5, min_drop: float = 0.3) -> list[dict]:
+    """
+    Volume drops in every series (row) of `matrix` at once.
+
+    - 'dip': a run of buckets at least `min_drop` below the series median and
+      `z_threshold` robust standard deviations (MAD, floored at the Poisson
+      noise of the median count) under it.
+    - 'level shift': the single split with the largest drop in mean from the
+      buckets before it to the buckets after it, when the drop is at least
+      `min_drop` and `z_threshold` standard errors, and the median after it
+      is `min_drop` below the median before it too. Not reported for a
+      series whose dip already runs to the last bucket.
+
+    Returns one dict per drop, largest loss first: {"series", "kind", "start",
+    "end" (inclusive bucket indexes), "baseline", "observed" (mean per
+    bucket), "change" (relative), "lost" (records below the baseline)}.
+    """
+    series_count, length = matrix.shape
+    if length < 3:
+        return []
+    baseline = np.median(matrix, axis=1, keepdims=True)
+    mad = np.median(np.abs(matrix - baseline), axis=1, keepdims=True) * _MAD_SCALE
+    scale = np.maximum(mad, np.sqrt(np.maximum(baseline, 1.0)))
+
+    low = ((matrix - baseline) / scale <= -z_threshold) & (matrix <= (1 - min_drop) * baseline)
+    edges = np.diff(np.pad(low, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    totals = np.pad(np.cumsum(matrix, axis=1), ((0, 0), (1, 0)))
+    observed = (totals[rows, ends] - totals[rows, starts]) / (ends - starts)
+    base = baseline[rows, 0]
+    drops = [
+        {"series": int(row), "kind": "dip", "start": int(start), "end": int(end) - 1, "baseline": float(b),
+         "observed": float(o), "change": float(o / b - 1), "lost": float((b - o) * (end - start))}
+        for row, start, end, b, o in zip(rows, starts, ends, base, observed)
+    ]
+
+    # mean shift at every split of every series, vectorized over both
+    left = np.arange(1, length)
+    left_mean = totals[:, 1:-1] / left
+    right_mean = (totals[:, -1:] - totals[:, 1:-1]) / (length - left)
+    stat = (left_mean - right_mean) / scale * np.sqrt(left * (length - left) / length)
+    split = np.argmax(stat, axis=1)
+    best = np.arange(series_count)
+    before, after = left_mean[best, split], right_mean[best, split]
+    shifted = (stat[best, split] >= z_threshold) & (after <= (1 - min_drop) * before) & (length - 1 - split >= 2)
+    shifted[rows[ends == length]] = False
+    for row in np.nonzero(shifted)[0]:
+        first = int(split[row]) + 1
+        # a dip that recovered also lowers the mean after the split; the level must stay down
+        if np.median(matrix[row, first:]) > (1 - min_drop) * np.median(matrix[row, :first]):
+            continue
+        b, o = float(before[row]), float(after[row])
+        drops.append({"series": int(row), "kind": "level shift", "start": first, "end": length - 1, "baseline": b,
+                      "observed": o, "change": o / b - 1 if b else 0.0, "lost": (b - o) * (length - first)})
+    return sorted(drops, key=lambda drop: drop["lost"], reverse=True)
+
+
+def _accumulate(index: np.ndarray, size: int, position: np.ndarray, counts: np.ndarray, length: int) -> np.ndarray:
+    matrix = np.zeros((size, length))
+    np.add.at(matrix, (index, position), counts)
+    return matrix
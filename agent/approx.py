@@ -0,0 +1,112 @@
+import re
+
+from sqlglot import exp
+
+from sql_utils import DIALECT
+
+# two-sided z value for the ~95% bounds reported next to approximate answers
+Z95 = 1.96
+
+
+def approximate_query(expression: exp.Query, sample_percent: float = 0.0, rsd: float = 0.05) -> list[str]:
+    """
+    Rewrite a parsed query in place into a cheaper, approximate one.
+
+    - COUNT(DISTINCT x) -> approx_count_distinct(x, rsd)
+    - percentile(x, p) / median(x) -> percentile_approx(x, p)
+    - with `sample_percent`, the (single) table is read with TABLESAMPLE and
+      top level COUNT/SUM columns are scaled up by 100 / sample_percent
+
+    Every approximated top level column gets a `<column>_err95` column,
+    appended after the original columns, holding its ~95% error bound where
+    one can be computed.
+    Returns notes describing the approximations for the agent; none when
+    nothing was approximated (see exact_reason).
+    """
+    notes = []
+    if isinstance(expression, exp.Select):
+        # name columns after the original expressions before rewriting them
+        expression.set("expressions", [
+            projection if isinstance(projection, (exp.Alias, exp.Column, exp.Star)) else exp.alias_(projection, _column_name(projection))
+            for projection in expression.expressions
+        ])
+
+    rewritten = 0
+    for node in list(expression.find_all(exp.Count)):
+        distinct = node.this
+        if isinstance(distinct, exp.Distinct) and len(distinct.expressions) == 1:
+            node.replace(exp.ApproxDistinct(this=distinct.expressions[0], accuracy=exp.Literal.number(rsd)))
+            rewritten += 1
+    for node in list(expression.find_all(exp.Quantile, exp.Median)):
+        quantile = node.args.get("quantile") or exp.Literal.number(0.5)
+        node.replace(exp.ApproxQuantile(this=node.this, quantile=quantile))
+        rewritten += 1
+    # rewrites below the top level columns get no note of their own
+    nested = "approx_count_distinct / percentile_approx inside the query, no error bound available"
+
+    fraction = None
+    if sample_percent and 0 < sample_percent < 100:
+        tables = list(expression.find_all(exp.Table))
+        if len(tables) != 1:
+            raise ValueError("Sampling is only supported for queries over a single table.")
+        tables[0].set("sample", exp.TableSample(percent=exp.Literal.number(sample_percent)))
+        fraction = sample_percent / 100
+        notes.append(f"read a {sample_percent}% TABLESAMPLE; counts and sums are scaled by {100 / sample_percent:g}")
+        if isinstance(expression, exp.Select) and expression.args.get("distinct"):
+            notes.append("SELECT DISTINCT over the sample: values missing from the sample are missing from the list")
+
+    if not isinstance(expression, exp.Select):
+        return notes or ([nested] if rewritten else [])
+
+    projections, bounds = [], []
+    for projection in expression.expressions:
+        if not isinstance(projection, exp.Alias):
+            projections.append(projection)
+            continue
+        inner, name = projection.this, projection.alias
+        bound = None
+        if isinstance(inner, exp.ApproxDistinct):
+            # approx_count_distinct's rsd is one standard error
+            bound = exp.Round(this=exp.Mul(this=exp.Literal.number(2 * rsd), expression=inner.copy()))
+            if fraction is not None:
+                notes.append(f"{name}: distinct count over the sample only, a lower bound of the true value")
+            else:
+                notes.append(f"{name}: approx_count_distinct, relative standard error {rsd:g}")
+        elif isinstance(inner, exp.ApproxQuantile):
+            notes.append(f"{name}: percentile_approx, rank error about 1/10000 of the rows")
+        elif fraction is not None and isinstance(inner, (exp.Count, exp.Sum)):
+            scaled = exp.Round(this=exp.Mul(this=inner.copy(), expression=exp.Literal.number(round(1 / fraction, 6))))
+            if isinstance(inner, exp.Count):
+                # binomial sampling error of a count scaled up from a `fraction` sample
+                bound = exp.Round(this=exp.Div(
+                    this=exp.Mul(
+                        this=exp.Literal.number(Z95),
+                        expression=exp.Sqrt(this=exp.Mul(this=inner.copy(), expression=exp.Literal.number(round(1 - fraction, 6)))),
+                    ),
+                    expression=exp.Literal.number(fraction),
+                ))
+            else:
+                notes.append(f"{name}: scaled sum, no error bound available")
+            inner = scaled
+        projections.append(exp.alias_(inner, name, quoted=projection.args["alias"].quoted))
+        if bound is not None:
+            bounds.append(exp.alias_(bound, f"{name}_err95"))
+    # bounds go last so GROUP BY / ORDER BY ordinals keep pointing at the same columns
+    expression.set("expressions", projections + bounds)
+    return notes or ([nested] if rewritten else [])
+
+
+def exact_reason(expression: exp.Query) -> str:
+    """Why approximate_query left `expression` exact, for the agent."""
+    if isinstance(expression, exp.Select) and expression.args.get("distinct"):
+        return (
+            "SELECT DISTINCT lists every value exactly, nothing was approximated; "
+            "to estimate how many unique values there are, use COUNT(DISTINCT ...)"
+        )
+    return "nothing in this query could be approximated, the result is exact"
+
+
+def _column_name(expression: exp.Expression) -> str:
+    if isinstance(expression, exp.Column):
+        return expression.name
+    return re.sub(r"\W+", "_", expression.sql(dialect=DIALECT)).strip("_").lower()
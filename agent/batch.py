@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from agent import answer_query, plan_cache, router
+from percentiles import percentile
+from spark_session import get_pool, reset_spark_time, spark_time
+from tools import metadata_cache, query_flights
+
+
+def load_queries(path: str) -> list[dict]:
+    """
+    Read queries from a JSONL file, one object per line.
+    The question is taken from 'query' (or 'body'), the id from 'id' or 'request_id',
+    falling back to the line number.
+    """
+    queries = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            queries.append({
+                "id": str(record.get("id", record.get("request_id", line_number))),
+                "query": record.get("query") or record["body"],
+            })
+    return queries
+
+
+def completed_ids(path: str) -> set[str]:
+    """Ids already answered successfully in an earlier (possibly crashed) run."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of a run that crashed mid-write
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def run_one(item: dict) -> dict:
+    reset_spark_time()
+    start = time.perf_counter()
+    try:
+        answer = answer_query(item["query"])
+        status, error = "ok", None
+    except Exception as e:
+        answer, status, error = None, "error", f"{type(e).__name__}: {e}"
+    return {
+        "id": item["id"],
+        "query": item["query"],
+        "status": status,
+        "answer": None if answer is None else str(answer),
+        "error": error,
+        "latency_s": round(time.perf_counter() - start, 3),
+        "spark_s": round(spark_time(), 3),
+    }
+
+
+def run_batch(queries: list[dict], output_path: str, workers: int) -> list[dict]:
+    """
+    Answer `queries` with `workers` concurrent agents, appending each result to
+    `output_path` as soon as it completes. Queries already answered in the
+    output file are skipped, so a crashed run can simply be restarted.
+    """
+    done = completed_ids(output_path)
+    pending = [item for item in queries if item["id"] not in done]
+    print(f"{len(pending)} queries to run ({len(done)} already done), {workers} workers")
+
+    # a crash mid-write leaves a partial last line; start on a fresh one
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(output_path, "a") as out:
+                out.write("\n")
+
+    results = []
+    lock = threading.Lock()
+    with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, item) for item in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            with lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                results.append(result)
+            print(f"[{len(results)}/{len(pending)}] {result['id']} {result['status']} {result['latency_s']}s")
+    return results
+
+
+def summarize(results: list[dict], wall_s: float) -> dict:
+    latencies = [r["latency_s"] for r in results]
+    spark = [r["spark_s"] for r in results]
+    return {
+        "queries": len(results),
+        "errors": sum(r["status"] != "ok" for r in results),
+        "wall_s": round(wall_s, 3),
+        "throughput_per_min": round(60 * len(results) / wall_s, 2) if wall_s else 0.0,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "spark_mean_s": round(sum(spark) / len(spark), 3) if spark else 0.0,
+        "spark_p95_s": percentile(spark, 95),
+        "spark_pool": get_pool().stats(),
+        "plan_cache": plan_cache.stats(),
+        "router": router.stats(),
+        # identical queries that waited on one already running instead of hitting spark again
+        "single_flight": query_flights.stats(),
+        "metadata_coalesced": metadata_cache.stats()["coalesced"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries with concurrent agents.")
+    parser.add_argument("input", help="JSONL file with one {'id': ..., 'query': ...} per line")
+    parser.add_argument("output", help="JSONL file results are appended to; rerun with the same file to resume")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent agent runs (default: 4)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_batch(load_queries(args.input), args.output, args.workers)
+    print(json.dumps(summarize(results, time.perf_counter() - start), indent=2))
@@ -0,0 +1,363 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import time
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from smolagents import ChatMessage, LogLevel, Model
+from smolagents.memory import ActionStep, PlanningStep
+from smolagents.monitoring import TokenUsage
+
+from render import estimate_tokens
+from spark_session import configure_spark, reset_spark_time, spark_time
+from telemetry import MODES, flush_telemetry, setup_telemetry, telemetry_stats
+from tool_metrics import tool_metrics
+
+BENCH_TABLE = "spark_catalog.adtech_db.base"
+BENCH_ROLLUP = "spark_catalog.adtech_db.base_daily_rollup"
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_cases.jsonl")
+FIXTURE_ENTITY = "2E1EF0B6328770FA94ABED6B63FA273A"
+
+
+class ScriptedModel(Model):
+    """
+    Stand-in for the LLM that answers action steps with a fixed list of code
+    snippets, so a benchmark run is deterministic and needs no model server.
+
+    Planning calls (stop sequence '<end_plan>') get a short fixed plan. Token
+    usage is estimated from the characters sent and returned, the same way
+    render.estimate_tokens budgets tool output. `cached_tokens` estimates
+    what a provider prefix cache would serve: the longest prefix each
+    request shares with a recent earlier request, in this or another case.
+    """
+
+    # recent requests of every case, as a provider's prefix cache would hold them
+    _sent: list[str] = []
+
+    def __init__(self, steps: list[str], **kwargs):
+        super().__init__(model_id="scripted", **kwargs)
+        self.steps = list(steps)
+        self.calls = 0
+        self.cached_tokens = 0
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs) -> ChatMessage:
+        self.calls += 1
+        prompt = "".join(f"<{_role(message)}>{_message_text(message)}" for message in messages)
+        prefix = max((len(os.path.commonprefix([prompt, sent])) for sent in ScriptedModel._sent), default=0)
+        self.cached_tokens += estimate_tokens(prompt[:prefix]) if prefix else 0
+        ScriptedModel._sent = ScriptedModel._sent[-63:] + [prompt]
+        if stop_sequences and "<end_plan>" in stop_sequences:
+            content = "1. Run the scripted steps in order.\n2. Return the last result with final_answer.\n"
+        elif response_format is None and stop_sequences is None:
+            # provide_final_answer() after max_steps
+            content = "Error: scripted steps exhausted before a final answer."
+        else:
+            code = self.steps.pop(0) if self.steps else 'final_answer("Error: scripted steps exhausted")'
+            content = json.dumps({"thought": "Next scripted step.", "code": code})
+        return ChatMessage(
+            role="assistant",
+            content=content,
+            token_usage=TokenUsage(input_tokens=_message_tokens(messages), output_tokens=estimate_tokens(content)),
+        )
+
+
+def _message_tokens(messages) -> int:
+    tokens = 0
+    for message in messages:
+        tokens += estimate_tokens(_message_text(message))
+    return tokens
+
+
+def _message_text(message) -> str:
+    content = message.content if isinstance(message, ChatMessage) else message.get("content")
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _role(message) -> str:
+    return str(message.role if isinstance(message, ChatMessage) else message.get("role"))
+
+
+def build_fixture(spark, table_name: str = BENCH_TABLE, seed: int = 0, rows_per_day: int = 40) -> int:
+    """
+    Create a small `base`-shaped table, partitioned by event_date and isocode,
+    with the shapes the example queries look for: the query1 entity on Jan
+    31st, points around the query3 coordinates, and a pickwell drop in the
+    3rd week of January. Returns the number of rows.
+    """
+    rnd = random.Random(seed)
+    entities = [f"{rnd.getrandbits(128):032X}" for _ in range(500)]
+    centers = {"RU": (52.2286, 104.2377), "US": (40.7128, -74.0060)}
+    rows = []
+    day = datetime.date(2025, 1, 1)
+    while day <= datetime.date(2025, 4, 30):
+        for isocode, (lat, lon) in centers.items():
+            for provider in ["pickwell", "acme", "zed"]:
+                count = rows_per_day
+                if provider == "pickwell" and datetime.date(2025, 1, 15) <= day <= datetime.date(2025, 1, 21):
+                    count //= 5
+                for _ in range(count):
+                    seconds = rnd.randrange(24 * 3600)
+                    rows.append((
+                        rnd.choice(entities),
+                        datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(seconds=seconds),
+                        isocode,
+                        provider,
+                        lat + rnd.uniform(-0.5, 0.5),
+                        lon + rnd.uniform(-0.5, 0.5),
+                    ))
+        day += datetime.timedelta(days=1)
+    for hour in (3, 9, 17):
+        rows.append((FIXTURE_ENTITY, datetime.datetime(2025, 1, 31, hour), "RU", "acme", 52.23, 104.24))
+
+    df = spark.createDataFrame(
+        rows, "EntityId string, eventtimeunix timestamp, isocode string, provider string, latitude double, longitude double"
+    ).selectExpr("*", "to_date(eventtimeunix) as event_date")
+    database = table_name.rsplit(".", 1)[0]
+    spark.sql(f"create database if not exists {database}")
+    df.write.mode("overwrite").partitionBy("event_date", "isocode").saveAsTable(table_name)
+    return len(rows)
+
+
+def load_cases(path: str = CASES_PATH, table_name: str = BENCH_TABLE) -> list[dict]:
+    """
+    Benchmark cases, one JSON object per line:
+    {"id", "question" or "example" (a key of agent.EXAMPLE_QUERIES), "steps": [code, ...],
+     "expected_sql" (optional), "tolerance" (optional relative tolerance for numbers)}
+    '{table}' in steps and expected_sql is replaced by `table_name`.
+    """
+    from agent import EXAMPLE_QUERIES
+
+    cases = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if "example" in case:
+                case["question"] = EXAMPLE_QUERIES[case["example"]].replace("prod_catalog.adtech_db.base", table_name)
+            else:
+                case["question"] = case["question"].replace("prod_catalog.adtech_db.base", table_name)
+            case["steps"] = [step.replace("{table}", table_name) for step in case["steps"]]
+            if case.get("expected_sql"):
+                case["expected_sql"] = case["expected_sql"].replace("{table}", table_name)
+            cases.append(case)
+    return cases
+
+
+def expected_values(spark, expected_sql: str) -> list[str]:
+    return [str(value) for row in spark.sql(expected_sql).collect() for value in row]
+
+
+def is_correct(answer: str, expected: list[str], tolerance: float = 0.0) -> bool:
+    """Every expected value shows up in the answer; numbers may be off by `tolerance` (relative)."""
+    numbers = [float(n) for n in re.findall(r"-?\d+(?:\.\d+)?", answer.replace(",", ""))]
+    for value in expected:
+        try:
+            target = float(value)
+        except ValueError:
+            if value.lower() not in answer.lower():
+                return False
+            continue
+        if not any(abs(n - target) <= tolerance * abs(target) for n in numbers):
+            return False
+    return True
+
+
+def run_case(case: dict, spark, build_agent, build_prompt, verbose: bool = False) -> dict:
+    model = ScriptedModel(case["steps"])
+    agent = build_agent(model)
+    if not verbose:
+        # console rendering of every step would be part of the measured wall time
+        agent.logger.level = LogLevel.OFF
+    # cases run one at a time, so the process wide tool metrics are this case's
+    tool_metrics.reset()
+
+    reset_spark_time()
+    start = time.perf_counter()
+    try:
+        answer, error = str(agent.run(build_prompt(case["question"]))), None
+    except Exception as e:
+        answer, error = "", f"{type(e).__name__}: {e}"
+    wall_s = time.perf_counter() - start
+    spark_s = spark_time()
+
+    steps = agent.memory.steps
+    usage = [step.token_usage for step in steps if isinstance(step, (ActionStep, PlanningStep)) and step.token_usage]
+    tools = tool_metrics.summary()
+    result = {
+        "id": case["id"],
+        "wall_s": round(wall_s, 3),
+        "spark_s": round(spark_s, 3),
+        "steps": sum(isinstance(step, ActionStep) for step in steps),
+        "planning_steps": sum(isinstance(step, PlanningStep) for step in steps),
+        "model_calls": model.calls,
+        "tool_calls": sum(t["calls"] for t in tools.values()),
+        "tools": {name: t["calls"] for name, t in tools.items()},
+        "prompt_tokens": sum(u.input_tokens for u in usage),
+        "completion_tokens": sum(u.output_tokens for u in usage),
+        "cached_tokens": model.cached_tokens,
+        "rows_scanned": sum(t["rows_scanned"] for t in tools.values()),
+        "bytes_scanned": sum(t["bytes_scanned"] for t in tools.values()),
+        "files_scanned": sum(t["files_scanned"] for t in tools.values()),
+        "cache_hits": sum(t["cache_hits"] for t in tools.values()),
+        "error": error,
+        "correct": None,
+        "answer": answer,
+    }
+    if case.get("expected_sql") and error is None:
+        result["correct"] = is_correct(answer, expected_values(spark, case["expected_sql"]), case.get("tolerance", 0.0))
+    return result
+
+
+def summarize(results: list[dict]) -> dict:
+    graded = [r for r in results if r["correct"] is not None]
+    totals = {
+        key: round(sum(r[key] for r in results), 3)
+        for key in ["wall_s", "spark_s", "steps", "tool_calls", "prompt_tokens", "completion_tokens", "cached_tokens",
+                    "rows_scanned", "bytes_scanned", "files_scanned"]
+    }
+    return {
+        "cases": len(results),
+        "errors": sum(r["error"] is not None for r in results),
+        "correct": sum(r["correct"] is True for r in graded),
+        "graded": len(graded),
+        **totals,
+    }
+
+
+def compare(report: dict, baseline: dict) -> list[str]:
+    """One line per case whose metrics changed against `baseline`."""
+    keys = ["wall_s", "steps", "tool_calls", "prompt_tokens", "completion_tokens", "cached_tokens", "rows_scanned", "bytes_scanned"]
+    before = {r["id"]: r for r in baseline["results"]}
+    lines = []
+    for result in report["results"]:
+        old = before.get(result["id"])
+        if old is None:
+            lines.append(f"{result['id']}: new case")
+            continue
+        changes = [f"{key} {old.get(key)} -> {result[key]}" for key in keys if old.get(key) != result[key] and key != "wall_s"]
+        if old.get("wall_s") and abs(result["wall_s"] - old["wall_s"]) > 0.2 * old["wall_s"]:
+            changes.append(f"wall_s {old['wall_s']} -> {result['wall_s']}")
+        if old.get("correct") and not result["correct"]:
+            changes.append("REGRESSION: answer no longer correct")
+        if changes:
+            lines.append(f"{result['id']}: " + ", ".join(changes))
+    return lines
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay scripted agent runs against a local spark fixture.")
+    parser.add_argument("--output", default="bench_report.json", help="JSON report to write (default: bench_report.json)")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--cases", default=CASES_PATH, help="JSONL file of benchmark cases")
+    parser.add_argument("--only", nargs="*", help="run only these case ids")
+    parser.add_argument("--warehouse", default="/tmp/oracle_bench_warehouse", help="local spark warehouse for the fixture")
+    parser.add_argument("--rebuild", action="store_true", help="recreate the fixture table")
+    parser.add_argument("--rollups", action="store_true", help="build the fixture's daily rollup and answer eligible queries from it")
+    parser.add_argument("--cold", action="store_true", help="clear the metadata, result and cost caches before every case")
+    parser.add_argument("--verbose", action="store_true", help="print the agent's steps")
+    parser.add_argument("--telemetry", choices=MODES, default="off", help="telemetry mode to measure the overhead of (default: off)")
+    parser.add_argument("--tail-sample-rate", type=float, default=1.0, help="fraction of ordinary runs exported (default: 1.0)")
+    parser.add_argument("--otlp", action="store_true", help="export spans to phoenix instead of an in-memory exporter")
+    args = parser.parse_args()
+
+    from pyspark.sql import SparkSession
+
+    spark = (
+        SparkSession.builder.master("local[2]")
+        .appName("oracle-bench")
+        .config("spark.ui.enabled", "false")
+        .config("spark.sql.shuffle.partitions", "4")
+        .config("spark.sql.warehouse.dir", args.warehouse)
+        .config("spark.driver.extraJavaOptions", f"-Dderby.system.home={args.warehouse}")
+        .enableHiveSupport()
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    rebuilt = args.rebuild or not spark.catalog.tableExists(BENCH_TABLE)
+    if rebuilt:
+        print(f"building fixture {BENCH_TABLE} ({build_fixture(spark)} rows)")
+    if args.rollups:
+        from config import ROLLUP_TABLES
+        from rollup import refresh_rollup
+
+        ROLLUP_TABLES[BENCH_TABLE] = BENCH_ROLLUP
+        print(f"rollup {BENCH_ROLLUP}: {refresh_rollup(spark, BENCH_TABLE, BENCH_ROLLUP, rebuild=rebuilt)}")
+    configure_spark(factory=spark.newSession)
+
+    # before agent.py is imported, whose own setup_telemetry() call is then a no-op
+    exporter = None if args.otlp else InMemorySpanExporter()
+    setup_telemetry(args.telemetry, exporter=exporter, tail_sample_rate=args.tail_sample_rate)
+
+    from agent import build_agent, build_prompt
+    import tools
+    from column_profiles import ColumnProfileStore
+    from config import PROFILE_TABLES
+    from schema_index import SchemaIndex
+    from tools import cost_cache, metadata_cache, result_cache
+
+    # the fixture's profiles and schema index live next to it, not in the user's stores
+    PROFILE_TABLES[BENCH_TABLE] = {"time_column": "eventtimeunix", "partition_columns": ["isocode"], "columns": []}
+    tools.column_profiles = ColumnProfileStore(os.path.join(args.warehouse, "column_profiles.sqlite"))
+    print(f"column profiles: {tools.column_profiles.refresh(spark, BENCH_TABLE, PROFILE_TABLES[BENCH_TABLE], rebuild=rebuilt)}")
+    tools.schema_index = SchemaIndex(os.path.join(args.warehouse, "schema_index.sqlite"))
+    print(f"schema index: {tools.schema_index.refresh(spark, [BENCH_TABLE.split('.')[0]], rebuild=rebuilt)}")
+
+    cases = load_cases(args.cases)
+    if args.only:
+        cases = [case for case in cases if case["id"] in args.only]
+
+    results = []
+    for case in cases:
+        if args.cold:
+            metadata_cache.invalidate()
+            cost_cache.invalidate()
+            result_cache.clear()
+        result = run_case(case, spark, build_agent, build_prompt, args.verbose)
+        results.append(result)
+        print(
+            f"{result['id']}: {result['wall_s']}s, {result['steps']} steps, {result['tool_calls']} tool calls, "
+            f"{result['prompt_tokens']}+{result['completion_tokens']} tokens ({result['cached_tokens']} cacheable), "
+            f"{result['rows_scanned']} rows scanned, "
+            f"correct={result['correct']}" + (f", error={result['error']}" if result["error"] else "")
+        )
+
+    flush_telemetry()
+    report = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "model": "scripted",
+        "cold": args.cold,
+        "rollups": args.rollups,
+        "telemetry": {
+            **telemetry_stats(),
+            "tail_sample_rate": args.tail_sample_rate,
+            "spans_exported": len(exporter.get_finished_spans()) if exporter is not None else None,
+        },
+        "summary": summarize(results),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["summary"], indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            changes = compare(report, json.load(f))
+        print("\n".join(changes) if changes else "no changes against baseline")
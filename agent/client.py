@@ -0,0 +1,80 @@
+import argparse
+import http.client
+import json
+import socket
+import sys
+import time
+
+from config import SERVER_HOST, SERVER_PORT, SERVER_SOCKET, SERVER_TIMEOUT_SECONDS
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(method: str, path: str, body: dict | None = None,
+            host: str = SERVER_HOST, port: int = SERVER_PORT, socket_path: str = SERVER_SOCKET,
+            timeout: float = SERVER_TIMEOUT_SECONDS) -> dict:
+    """Send one request to the agent server and return its JSON reply. Raises OSError if it isn't running."""
+    if socket_path:
+        conn = UnixHTTPConnection(socket_path, timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        payload = None if body is None else json.dumps(body)
+        conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(result.get("error", f"HTTP {response.status}"))
+    return result
+
+
+def ask(query: str, **kwargs) -> dict:
+    return request("POST", "/query", {"query": query}, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ask the running agent server (see server.py) a question.")
+    parser.add_argument("query", nargs="?", help="question for the agent")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--socket", default=SERVER_SOCKET, help="talk to a server on this unix socket")
+    parser.add_argument("--stats", action="store_true", help="print the server's startup timings and counters")
+    parser.add_argument("--local", action="store_true", help="run the agent in this process if no server is running")
+    args = parser.parse_args()
+    target = {"host": args.host, "port": args.port, "socket_path": args.socket}
+
+    if args.stats:
+        print(json.dumps(request("GET", "/stats", **target), indent=2))
+        sys.exit(0)
+    if not args.query:
+        parser.error("a query is required")
+
+    start = time.perf_counter()
+    try:
+        result = ask(args.query, **target)
+    except OSError as e:
+        if not args.local:
+            sys.exit(f"agent server not reachable ({e}); start it with `python agent/server.py` or pass --local")
+        print("agent server not reachable, running the agent in this process")
+        from agent import query_agent
+
+        query_agent(args.query)
+        print(f"time to answer: {time.perf_counter() - start:.2f}s (cold, in process)")
+        sys.exit(0)
+    except RuntimeError as e:
+        sys.exit(f"agent error: {e}")
+
+    print(result["answer"])
+    print(f"time to answer: {time.perf_counter() - start:.2f}s "
+          f"(agent {result['latency_s']}s, spark {result['spark_s']}s)")
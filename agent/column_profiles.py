@@ -0,0 +1,328 @@
+import argparse
+import datetime
+import decimal
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pyarrow as pa
+
+from config import PROFILE_HLL_PRECISION, PROFILE_STORE_PATH, PROFILE_TABLES, PROFILE_TOP_K
+from render import iter_arrow_batches
+from rollup import appended_days, current_snapshot, days_filter
+
+_PRIMITIVE_TYPES = (
+    "string", "varchar", "char", "boolean", "tinyint", "smallint", "int", "bigint",
+    "float", "double", "decimal", "date", "timestamp",
+)
+# columns whose most frequent values are kept
+_TOP_K_TYPES = ("string", "varchar", "char", "boolean")
+_MAX_ROWS = 10**9
+
+
+class ColumnProfileStore:
+    """
+    Per partition column statistics of the tables in PROFILE_TABLES, kept in
+    a sqlite file and served without touching spark.
+
+    A partition is a day of the table's time column plus the values of its
+    partition columns (eg. 2025-01-31 / RU). For every profiled column and
+    partition the store holds the row and null counts, min and max, the
+    HyperLogLog registers of the column (merged across partitions for the
+    distinct count of any range) and, for string columns, the `top_k` most
+    frequent values. A partition with fewer than `top_k` distinct values has
+    its complete value list, so distinct counts and value lists over such
+    partitions are exact.
+
+    refresh() recomputes only the days touched by new iceberg snapshots.
+    Rows whose time column is NULL belong to no day and are not profiled;
+    refresh() reports how many there were.
+    """
+
+    def __init__(self, path: str = PROFILE_STORE_PATH, hll_precision: int = PROFILE_HLL_PRECISION, top_k: int = PROFILE_TOP_K):
+        self.path = path
+        self.hll_precision = hll_precision
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            create table if not exists column_profiles (
+                table_name text, column_name text, day text, partition text,
+                rows integer, nulls integer, min text, max text, registers blob, top text,
+                primary key (table_name, column_name, day, partition)
+            );
+            create table if not exists profile_state (
+                table_name text primary key, snapshot text, columns text, refreshed_at text
+            );
+        """)
+
+    # ---- serving -------------------------------------------------------
+
+    def state(self, table_name: str) -> dict | None:
+        """{"snapshot", "columns": [[name, type], ...], "refreshed_at"} of a profiled table, None if it has no profile."""
+        with self._lock:
+            row = self._db.execute(
+                "select snapshot, columns, refreshed_at from profile_state where table_name = ?", (table_name.lower(),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"snapshot": row[0], "columns": json.loads(row[1]), "refreshed_at": row[2]}
+
+    def profile(
+        self,
+        table_name: str,
+        column_name: str,
+        start: datetime.date | None = None,
+        end: datetime.date | None = None,
+        partition_values: dict[str, list[str]] | None = None,
+    ) -> dict | None:
+        """
+        Statistics of one column over the partitions from `start` to `end`
+        (inclusive) whose partition columns have one of `partition_values`.
+        Returns {"partitions", "rows", "nulls", "min", "max", "distinct",
+        "exact", "top": [(value, count), ...]} or None when nothing matches.
+        `exact` tells whether distinct and top are exact, else they are
+        estimates (HLL; counts from the per partition top values).
+        """
+        query = "select partition, rows, nulls, min, max, registers, top from column_profiles where table_name = ? and column_name = ?"
+        params = [table_name.lower(), column_name.lower()]
+        if start is not None:
+            query += " and day >= ?"
+            params.append(start.isoformat())
+        if end is not None:
+            query += " and day <= ?"
+            params.append(end.isoformat())
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+
+        spec = self._spec(table_name)
+        wanted = {
+            spec["partition_columns"].index(name): {str(value).lower() for value in values}
+            for name, values in (partition_values or {}).items()
+            if name in spec["partition_columns"]
+        }
+        selected = [
+            row for row in rows
+            if all(str(json.loads(row[0])[index]).lower() in values for index, values in wanted.items())
+        ]
+        return merge_profiles(selected, self.top_k) if selected else None
+
+    # ---- refresh -------------------------------------------------------
+
+    def refresh(self, spark, table_name: str, spec: dict, rebuild: bool = False) -> dict:
+        """
+        Bring the profiles of `table_name` up to date with its current snapshot,
+        like rollup.refresh_rollup: unchanged when at the current snapshot, only
+        the appended days for iceberg appends, else a full rebuild.
+        Returns {"table", "action", "days", "snapshot", "null_time_rows", "seconds"}.
+        """
+        start = time.perf_counter()
+        snapshot = current_snapshot(spark, table_name)
+        target = "" if snapshot is None else str(snapshot)
+        state = self.state(table_name)
+        result = {"table": table_name, "action": "unchanged", "days": 0, "snapshot": snapshot, "null_time_rows": 0}
+
+        days = None
+        if not rebuild and state is not None and state["snapshot"] == target:
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return result
+        if not rebuild and state is not None and state["snapshot"] and snapshot is not None:
+            days = appended_days(spark, table_name, int(state["snapshot"]), snapshot, spec["time_column"])
+
+        columns = self._profiled_columns(spark, table_name, spec)
+        profiles, result["null_time_rows"] = self._compute(spark, table_name, spec, columns, days)
+        with self._lock:
+            if days is None:
+                self._db.execute("delete from column_profiles where table_name = ?", (table_name.lower(),))
+            else:
+                self._db.executemany(
+                    "delete from column_profiles where table_name = ? and day = ?",
+                    [(table_name.lower(), day.isoformat()) for day in days],
+                )
+            self._db.executemany("insert or replace into column_profiles values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", profiles)
+            self._db.execute(
+                "insert or replace into profile_state values (?, ?, ?, ?)",
+                (table_name.lower(), target, json.dumps(columns),
+                 datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")),
+            )
+            self._db.commit()
+        result["action"] = "rebuilt" if days is None else "incremental"
+        result["days"] = len({row[2] for row in profiles}) if days is None else len(days)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _spec(self, table_name: str) -> dict:
+        for name, spec in PROFILE_TABLES.items():
+            if name.lower() == table_name.lower():
+                return spec
+        return {"time_column": None, "partition_columns": []}
+
+    def _profiled_columns(self, spark, table_name: str, spec: dict) -> list[list[str]]:
+        described = []
+        for row in spark.sql(f"describe {table_name}").collect():
+            if not row[0] or row[0].startswith("#"):
+                break
+            described.append([row[0], row[1]])
+        wanted = {column.lower() for column in spec.get("columns") or []}
+        return [
+            [name, data_type] for name, data_type in described
+            if data_type.split("(")[0].lower() in _PRIMITIVE_TYPES and (not wanted or name.lower() in wanted)
+        ]
+
+    def _compute(
+        self, spark, table_name: str, spec: dict, columns: list[list[str]], days: list[datetime.date] | None
+    ) -> tuple[list[tuple], int]:
+        """
+        (profile rows of every (column, partition) of the given days (all days when None), rows without a day),
+        in three aggregations.
+        """
+        if days == []:
+            return [], 0
+        time_column = spec["time_column"]
+        partition_columns = spec["partition_columns"]
+        keys = [f"to_date({time_column}) as day"] + [f"{column} as p{i}" for i, column in enumerate(partition_columns)]
+        key_names = ["day"] + [f"p{i}" for i in range(len(partition_columns))]
+        where = f"where {days_filter(time_column, days)}" if days else ""
+        group_by = ", ".join(key_names)
+        precision = self.hll_precision
+
+        # row/null counts and min/max of every column, one row per partition
+        stats = ", ".join(
+            f"count_if(`{name}` is null) as c{i}_nulls, min(`{name}`) as c{i}_min, max(`{name}`) as c{i}_max"
+            for i, (name, _) in enumerate(columns)
+        )
+        stats_table = _collect(spark, f"select {', '.join(keys)}, count(*) as rows, {stats} from {table_name} {where} group by {group_by}")
+
+        # HyperLogLog registers: for each hashed value, the register is its top `precision`
+        # bits and the rank is the position of the first 1 bit in the rest
+        hashes = ", ".join(
+            f"named_struct('col', {i}, 'h', if(`{name}` is null, null, xxhash64(`{name}`)))" for i, (name, _) in enumerate(columns)
+        )
+        registers_table = _collect(spark, f"""
+            select {group_by}, col, collect_list(idx) as idx, collect_list(rank) as rank
+            from (
+                select {group_by}, col, shiftrightunsigned(h, {64 - precision}) as idx,
+                       max(least(64 - length(bin(shiftleft(h, {precision}))), {64 - precision}) + 1) as rank
+                from (select {', '.join(keys)}, inline(array({hashes})) from {table_name} {where})
+                where h is not null
+                group by {group_by}, col, shiftrightunsigned(h, {64 - precision})
+            )
+            group by {group_by}, col
+        """)
+
+        top_columns = [(i, name) for i, (name, data_type) in enumerate(columns) if data_type.lower().startswith(_TOP_K_TYPES)]
+        top_rows = []
+        if top_columns:
+            values = ", ".join(f"named_struct('col', {i}, 'value', cast(`{name}` as string))" for i, name in top_columns)
+            top_rows = _collect(spark, f"""
+                select {group_by}, col, value, count from (
+                    select *, row_number() over (partition by {group_by}, col order by count desc, value) as position
+                    from (
+                        select {group_by}, col, value, count(*) as count
+                        from (select {', '.join(keys)}, inline(array({values})) from {table_name} {where})
+                        where value is not null
+                        group by {group_by}, col, value
+                    )
+                )
+                where position <= {self.top_k}
+            """).to_pylist()
+
+        registers = {}
+        if registers_table.num_rows:
+            idx, rank = registers_table.column("idx").combine_chunks(), registers_table.column("rank").combine_chunks()
+            matrix = np.zeros((registers_table.num_rows, 2**precision), dtype=np.uint8)
+            rows = np.repeat(np.arange(registers_table.num_rows), np.diff(idx.offsets.to_numpy()))
+            matrix[rows, idx.flatten().to_numpy()] = rank.flatten().to_numpy()
+            for i, key in enumerate(zip(*(registers_table.column(name).to_pylist() for name in key_names + ["col"]))):
+                registers[key] = matrix[i].tobytes()
+        tops = {}
+        for row in top_rows:
+            key = tuple(row[name] for name in key_names) + (row["col"],)
+            tops.setdefault(key, []).append([row["value"], row["count"]])
+
+        profiles, null_time_rows = [], 0
+        for row in stats_table.to_pylist():
+            partition = tuple(row[name] for name in key_names)
+            if partition[0] is None:
+                # a NULL time column: no day to file these rows under
+                null_time_rows += row["rows"]
+                continue
+            for i, (name, _) in enumerate(columns):
+                profiles.append((
+                    table_name.lower(), name.lower(), partition[0].isoformat(), json.dumps([_jsonable(v) for v in partition[1:]]),
+                    row["rows"], row[f"c{i}_nulls"], json.dumps(_jsonable(row[f"c{i}_min"])), json.dumps(_jsonable(row[f"c{i}_max"])),
+                    registers.get(partition + (i,), bytes(2**precision)),
+                    json.dumps(tops[partition + (i,)]) if partition + (i,) in tops else None,
+                ))
+        return profiles, null_time_rows
+
+
+def merge_profiles(rows: list[tuple], top_k: int) -> dict:
+    """Merge (partition, rows, nulls, min, max, registers, top) store rows into one column profile."""
+    mins = [value for value in (json.loads(row[3]) for row in rows) if value is not None]
+    maxs = [value for value in (json.loads(row[4]) for row in rows) if value is not None]
+    registers = np.max(np.vstack([np.frombuffer(row[5], dtype=np.uint8) for row in rows]), axis=0)
+    tops = [json.loads(row[6]) for row in rows if row[6] is not None]
+    counts = Counter()
+    for top in tops:
+        for value, count in top:
+            counts[value] += count
+    # a partition listing fewer than top_k values listed all of them
+    exact = len(tops) == len(rows) and all(len(top) < top_k for top in tops)
+    return {
+        "partitions": len(rows),
+        "rows": sum(row[1] for row in rows),
+        "nulls": sum(row[2] for row in rows),
+        "min": min(mins) if mins else None,
+        "max": max(maxs) if maxs else None,
+        "distinct": len(counts) if exact else round(hll_estimate(registers)),
+        "exact": exact,
+        "top": counts.most_common(),
+    }
+
+
+def hll_estimate(registers: np.ndarray) -> float:
+    """HyperLogLog cardinality estimate, with the linear counting correction for small counts."""
+    m = registers.size
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return float(estimate)
+
+
+def _collect(spark, query: str) -> pa.Table:
+    batches = list(iter_arrow_batches(spark.sql(query), _MAX_ROWS))
+    if not batches:
+        return pa.table({})
+    return pa.Table.from_batches(batches)
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+if __name__ == "__main__":
+    from spark_session import spark_session
+
+    parser = argparse.ArgumentParser(description="Build or incrementally refresh the column profile store.")
+    parser.add_argument("tables", nargs="*", help="tables to profile (default: every table in ORACLE_PROFILE_TABLES)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild from scratch instead of refreshing new snapshots")
+    args = parser.parse_args()
+
+    store = ColumnProfileStore()
+    with spark_session() as spark:
+        for table_name in args.tables or list(PROFILE_TABLES):
+            print(json.dumps(store.refresh(spark, table_name, PROFILE_TABLES[table_name], rebuild=args.rebuild), default=str))
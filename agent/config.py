@@ -0,0 +1,180 @@
+import json
+import os
+
+# Settings shared by the agent, tools and UI.
+# Every value can be overridden with an ORACLE_* environment variable.
+
+# Spark
+# spark connect url ('sc://host:port') or a local master ('local[*]') for tests
+SPARK_REMOTE = os.getenv("ORACLE_SPARK_REMOTE", "sc://spark-connect-test.tail7cdba.ts.net")
+SPARK_APP_NAME = os.getenv("ORACLE_SPARK_APP_NAME", "Oracle")
+SPARK_POOL_SIZE = int(os.getenv("ORACLE_SPARK_POOL_SIZE", "4"))
+# seconds to wait for a free session before giving up
+SPARK_POOL_TIMEOUT_SECONDS = float(os.getenv("ORACLE_SPARK_POOL_TIMEOUT_SECONDS", "120"))
+# idle sessions older than this are pinged before being reused
+SPARK_HEALTH_CHECK_SECONDS = float(os.getenv("ORACLE_SPARK_HEALTH_CHECK_SECONDS", "30"))
+
+# Metadata cache (catalog/database/table listings and table schemas)
+METADATA_CACHE_TTL_SECONDS = int(os.getenv("ORACLE_METADATA_CACHE_TTL_SECONDS", "3600"))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("ORACLE_METADATA_CACHE_MAX_ENTRIES", "2048"))
+# how long a looked-up iceberg snapshot id is trusted before asking spark again
+SNAPSHOT_TTL_SECONDS = int(os.getenv("ORACLE_SNAPSHOT_TTL_SECONDS", "60"))
+# sqlite file used to persist the metadata cache between processes; empty disables it
+METADATA_CACHE_PATH = os.getenv("ORACLE_METADATA_CACHE_PATH", "")
+
+# Result cache for sql_query_to_str
+RESULT_CACHE_ENABLED = os.getenv("ORACLE_RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("ORACLE_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# only matters for tables without iceberg snapshots, others are keyed on their snapshot id
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("ORACLE_RESULT_CACHE_TTL_SECONDS", "3600"))
+
+# Single flight: concurrent identical queries (same tool, same normalized sql) run once and share the result
+SINGLE_FLIGHT_ENABLED = os.getenv("ORACLE_SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Rendering of query results handed back to the LLM
+RENDER_MAX_BYTES = int(os.getenv("ORACLE_RENDER_MAX_BYTES", "16000"))
+RENDER_MAX_TOKENS = int(os.getenv("ORACLE_RENDER_MAX_TOKENS", "4000"))
+RENDER_MAX_CELL_CHARS = int(os.getenv("ORACLE_RENDER_MAX_CELL_CHARS", "200"))
+
+# Partition guard for agent queries
+# table name (or catalog.db.table) -> columns every scan of it must filter on
+PARTITION_COLUMNS = json.loads(os.getenv(
+    "ORACLE_PARTITION_COLUMNS", '{"base": ["eventtimeunix", "isocode"]}'
+))
+# 'reject' refuses unfiltered scans, 'inject' adds DEFAULT_PARTITION_FILTERS instead
+PARTITION_GUARD_MODE = os.getenv("ORACLE_PARTITION_GUARD_MODE", "reject")
+# column -> filter added in 'inject' mode; a missing column without a default is still rejected
+DEFAULT_PARTITION_FILTERS = json.loads(os.getenv(
+    "ORACLE_DEFAULT_PARTITION_FILTERS",
+    '{"eventtimeunix": "eventtimeunix >= current_timestamp() - INTERVAL 1 DAY"}',
+))
+
+# Pre-execution cost guard (EXPLAIN COST) for sql_query_to_str
+COST_GUARD_ENABLED = os.getenv("ORACLE_COST_GUARD_ENABLED", "1") == "1"
+# queries estimated to scan more than this are refused
+MAX_SCAN_BYTES = int(os.getenv("ORACLE_MAX_SCAN_BYTES", str(50 * 1024**3)))
+COST_CACHE_TTL_SECONDS = int(os.getenv("ORACLE_COST_CACHE_TTL_SECONDS", "3600"))
+
+# Approximate query mode: relative standard error asked of approx_count_distinct
+APPROX_RSD = float(os.getenv("ORACLE_APPROX_RSD", "0.05"))
+
+# Geo radius tool: column names of the point tables (eg. base)
+GEO_LAT_COLUMN = os.getenv("ORACLE_GEO_LAT_COLUMN", "latitude")
+GEO_LON_COLUMN = os.getenv("ORACLE_GEO_LON_COLUMN", "longitude")
+GEO_TIME_COLUMN = os.getenv("ORACLE_GEO_TIME_COLUMN", "eventtimeunix")
+GEO_ISOCODE_COLUMN = os.getenv("ORACLE_GEO_ISOCODE_COLUMN", "isocode")
+GEO_ENTITY_COLUMN = os.getenv("ORACLE_GEO_ENTITY_COLUMN", "EntityId")
+# optional precomputed geohash column and its length; empty disables the cell prefilter
+GEO_CELL_COLUMN = os.getenv("ORACLE_GEO_CELL_COLUMN", "")
+GEO_CELL_PRECISION = int(os.getenv("ORACLE_GEO_CELL_PRECISION", "7"))
+
+# Agent server (server.py) and the thin client (client.py) talking to it
+SERVER_HOST = os.getenv("ORACLE_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("ORACLE_SERVER_PORT", "8765"))
+# serve on a unix socket at this path instead of host:port when set
+SERVER_SOCKET = os.getenv("ORACLE_SERVER_SOCKET", "")
+SERVER_TIMEOUT_SECONDS = int(os.getenv("ORACLE_SERVER_TIMEOUT_SECONDS", "600"))
+
+# Telemetry: 'off', 'sync' (export every span as it ends) or 'batch' (async export from a bounded queue)
+TELEMETRY_MODE = os.getenv("ORACLE_TELEMETRY_MODE", "batch")
+TELEMETRY_ENDPOINT = os.getenv("PHOENIX_COLLECTOR_ENDPOINT", "http://localhost:6006").rstrip("/") + "/v1/traces"
+TELEMETRY_PROJECT_NAME = os.getenv("PHOENIX_PROJECT_NAME", "default")
+# head sampling: fraction of runs traced at all
+TELEMETRY_HEAD_SAMPLE_RATE = float(os.getenv("ORACLE_TELEMETRY_HEAD_SAMPLE_RATE", "1.0"))
+# tail sampling: fraction of traced runs exported; runs with errors or slower than TELEMETRY_SLOW_SECONDS always are
+TELEMETRY_TAIL_SAMPLE_RATE = float(os.getenv("ORACLE_TELEMETRY_TAIL_SAMPLE_RATE", "1.0"))
+TELEMETRY_SLOW_SECONDS = float(os.getenv("ORACLE_TELEMETRY_SLOW_SECONDS", "30"))
+# runs held in memory waiting for their tail sampling decision
+TELEMETRY_MAX_PENDING_TRACES = int(os.getenv("ORACLE_TELEMETRY_MAX_PENDING_TRACES", "256"))
+TELEMETRY_QUEUE_SIZE = int(os.getenv("ORACLE_TELEMETRY_QUEUE_SIZE", "2048"))
+TELEMETRY_BATCH_SIZE = int(os.getenv("ORACLE_TELEMETRY_BATCH_SIZE", "512"))
+TELEMETRY_EXPORT_DELAY_MS = int(os.getenv("ORACLE_TELEMETRY_EXPORT_DELAY_MS", "5000"))
+
+# Plan cache: answer questions matching a learned SQL template without the agent loop
+PLAN_CACHE_ENABLED = os.getenv("ORACLE_PLAN_CACHE_ENABLED", "1") == "1"
+# successful runs a template needs before it is used, and failed uses before it is dropped
+PLAN_CACHE_MIN_SUCCESSES = int(os.getenv("ORACLE_PLAN_CACHE_MIN_SUCCESSES", "1"))
+PLAN_CACHE_MAX_FAILURES = int(os.getenv("ORACLE_PLAN_CACHE_MAX_FAILURES", "2"))
+PLAN_CACHE_PATH = os.getenv("ORACLE_PLAN_CACHE_PATH", "")
+
+# Models: tiers from cheapest to most capable, each a LiteLLM model_id plus its LiteLLM kwargs,
+# the agent's step limit and the price per 1k tokens (0 for local models)
+MODEL_TIERS = json.loads(os.getenv("ORACLE_MODEL_TIERS", """[
+    {"name": "small", "model_id": "ollama_chat/qwen3:8b", "max_steps": 3, "cost_per_1k_tokens": 0.0,
+     "model_kwargs": {"temperature": 0.3, "top_p": 0.9, "api_base": "http://192.168.8.116:11434"}},
+    {"name": "large", "model_id": "ollama_chat/gemma3:27b-it-qat", "max_steps": 5, "cost_per_1k_tokens": 0.0,
+     "model_kwargs": {"temperature": 0.3, "top_p": 0.9, "api_base": "http://192.168.8.116:11434"}},
+    {"name": "reasoning", "model_id": "o4-mini", "max_steps": 8, "cost_per_1k_tokens": 0.0025,
+     "model_kwargs": {}}
+]"""))
+# tier used when routing is off, and by build_agent() by default
+MODEL_TIER = os.getenv("ORACLE_MODEL_TIER", "large")
+
+# Model router: start each question on the cheapest tier that fits its complexity, escalate on failure.
+# Off by default: routed analysis questions can reach paid external tiers
+ROUTER_ENABLED = os.getenv("ORACLE_ROUTER_ENABLED", "0") == "1"
+# no escalation once a question has taken this long, or when the next tier would cost more than the budget (USD)
+ROUTER_LATENCY_BUDGET_SECONDS = float(os.getenv("ORACLE_ROUTER_LATENCY_BUDGET_SECONDS", "300"))
+ROUTER_COST_BUDGET = float(os.getenv("ORACLE_ROUTER_COST_BUDGET", "0.05"))
+
+# Rollups: daily summaries of large tables, used instead of the raw partitions for eligible aggregate queries
+ROLLUPS_ENABLED = os.getenv("ORACLE_ROLLUPS_ENABLED", "1") == "1"
+# source table -> its daily rollup table, (re)built by `python agent/rollup.py`
+ROLLUP_TABLES = json.loads(os.getenv(
+    "ORACLE_ROLLUP_TABLES", '{"prod_catalog.adtech_db.base": "prod_catalog.adtech_db.base_daily_rollup"}'
+))
+ROLLUP_TIME_COLUMN = os.getenv("ORACLE_ROLLUP_TIME_COLUMN", "eventtimeunix")
+# breakdown columns kept in the rollup; queries may filter and group on these only
+ROLLUP_DIMENSIONS = json.loads(os.getenv("ORACLE_ROLLUP_DIMENSIONS", '["isocode", "provider"]'))
+# distinct counts of this column are kept as HLL sketches
+ROLLUP_ENTITY_COLUMN = os.getenv("ORACLE_ROLLUP_ENTITY_COLUMN", "EntityId")
+# log2 of the HLL sketch buckets; 12 gives ~1.6% relative standard error
+ROLLUP_SKETCH_LG_K = int(os.getenv("ORACLE_ROLLUP_SKETCH_LG_K", "12"))
+
+# Volume drop detection (detect_volume_drops)
+DROPS_TIME_COLUMN = os.getenv("ORACLE_DROPS_TIME_COLUMN", "eventtimeunix")
+# robust z score and relative drop a bucket or a level shift needs to be reported
+DROPS_Z_THRESHOLD = float(os.getenv("ORACLE_DROPS_Z_THRESHOLD", "3.5"))
+DROPS_MIN_DROP = float(os.getenv("ORACLE_DROPS_MIN_DROP", "0.3"))
+# most (bucket, dimensions) rows pulled back from the aggregation
+DROPS_MAX_ROWS = int(os.getenv("ORACLE_DROPS_MAX_ROWS", "200000"))
+
+# Column profiles: per day/partition column statistics, (re)built by `python agent/column_profiles.py`
+# table -> time column, partition columns and the columns to profile (empty: every primitive column)
+PROFILE_TABLES = json.loads(os.getenv("ORACLE_PROFILE_TABLES", """{
+    "prod_catalog.adtech_db.base": {"time_column": "eventtimeunix", "partition_columns": ["isocode"], "columns": []}
+}"""))
+PROFILE_STORE_PATH = os.path.expanduser(os.getenv("ORACLE_PROFILE_STORE_PATH", "~/.oracle/column_profiles.sqlite"))
+# most frequent values kept per string column and partition
+PROFILE_TOP_K = int(os.getenv("ORACLE_PROFILE_TOP_K", "20"))
+# log2 of the HyperLogLog registers per column and partition; 11 gives ~2.3% relative standard error
+PROFILE_HLL_PRECISION = int(os.getenv("ORACLE_PROFILE_HLL_PRECISION", "11"))
+
+# Schema index: every catalog/database/table/column, (re)built by `python agent/schema_index.py`
+SCHEMA_INDEX_CATALOGS = json.loads(os.getenv("ORACLE_SCHEMA_INDEX_CATALOGS", '["prod_catalog", "test_catalog"]'))
+SCHEMA_INDEX_PATH = os.path.expanduser(os.getenv("ORACLE_SCHEMA_INDEX_PATH", "~/.oracle/schema_index.sqlite"))
+# tables without a new snapshot are described again after this long (catches non-iceberg schema changes)
+SCHEMA_INDEX_MAX_AGE_HOURS = float(os.getenv("ORACLE_SCHEMA_INDEX_MAX_AGE_HOURS", "24"))
+
+# Result cursors (open_cursor / read_cursor): results materialized once, paged locally with duckdb
+CURSOR_DIR = os.path.expanduser(os.getenv("ORACLE_CURSOR_DIR", "~/.oracle/cursors"))
+# a cursor expires this long after it was last read
+CURSOR_TTL_SECONDS = int(os.getenv("ORACLE_CURSOR_TTL_SECONDS", "1800"))
+# recently read cursors kept in memory as arrow; the rest are read back from their parquet file
+CURSOR_MEMORY_MAX_BYTES = int(os.getenv("ORACLE_CURSOR_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+CURSOR_DISK_MAX_BYTES = int(os.getenv("ORACLE_CURSOR_DISK_MAX_BYTES", str(2 * 1024**3)))
+# most rows and bytes (as arrow) materialized per cursor, whichever comes first
+CURSOR_MAX_ROWS = int(os.getenv("ORACLE_CURSOR_MAX_ROWS", "1000000"))
+CURSOR_MAX_BYTES = int(os.getenv("ORACLE_CURSOR_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Web UI (streamlit run ui/app.py)
+# background threads listing the tables of the selected catalog into the metadata cache; each holds a spark session while it runs
+UI_PREFETCH_WORKERS = int(os.getenv("ORACLE_UI_PREFETCH_WORKERS", "2"))
+
+# Conversation memory (web UI): what a follow-up question is told about the earlier turns
+# most tokens of pinned facts, summary and recent turns added to each question
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("ORACLE_CONVERSATION_TOKEN_BUDGET", "2000"))
+# turns sent verbatim; older ones are rolled into the summary
+CONVERSATION_RECENT_TURNS = int(os.getenv("ORACLE_CONVERSATION_RECENT_TURNS", "3"))
+# model tier that rewrites the summary as turns are rolled in; empty keeps one line per turn, without a model call
+CONVERSATION_SUMMARY_TIER = os.getenv("ORACLE_CONVERSATION_SUMMARY_TIER", "")
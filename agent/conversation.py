@@ -0,0 +1,173 @@
+from typing import Callable
+
+from sqlglot import exp
+
+from render import estimate_tokens
+from sql_utils import DIALECT, parse_sql, referenced_tables
+
+# longest answer line kept per turn in the extractive summary
+_SUMMARY_LINE_CHARS = 200
+
+
+class ConversationMemory:
+    """
+    What the agent is told about the earlier turns of a conversation, in at
+    most `budget_tokens` per request.
+
+    The last `recent_turns` turns are sent verbatim. Older turns are rolled
+    into a running summary one at a time, as they leave the verbatim window,
+    by `summarize(summary, turn) -> new summary` (by default one line per
+    turn, see extractive_summary). Pinned facts are always sent: the table
+    selected in the UI, the tables, filters and SQL of the last answered
+    query, and anything pinned with pin().
+
+    When pinned facts + summary + verbatim turns don't fit the budget as a
+    turn is added, the oldest verbatim turns are summarized early, then the
+    oldest part of the summary is dropped. context() and stats() only read.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 2000,
+        recent_turns: int = 3,
+        summarize: Callable[[str, dict], str] | None = None,
+    ):
+        self.budget_tokens = budget_tokens
+        self.recent_turns = recent_turns
+        self.summarize = summarize or extractive_summary
+        self.pins: dict[str, str] = {}
+        self.summary = ""
+        self.turns: list[dict] = []
+        self.summarized_turns = 0
+        # tokens of every turn so far, verbatim: what resending the whole history would cost
+        self.history_tokens = 0
+
+    def pin(self, name: str, value: str | None) -> None:
+        """Always tell the agent `name: value`; a None or empty value unpins it."""
+        if value:
+            self.pins[name] = value
+        else:
+            self.pins.pop(name, None)
+
+    def add_turn(self, question: str, answer: str, sql: str | None = None) -> None:
+        """Record an answered question; `sql` is the query the answer came from, if any."""
+        turn = {"question": question, "answer": answer, "sql": sql}
+        self.turns.append(turn)
+        self.history_tokens += estimate_tokens(_turn_text(turn))
+        if sql:
+            self.pin("last query", sql)
+            self.pin("tables queried", ", ".join(referenced_tables(sql)))
+            self.pin("filters in effect", " AND ".join(query_filters(sql)))
+        while len(self.turns) > self.recent_turns:
+            self._fold()
+        self._fit()
+
+    def context(self) -> str:
+        """
+        Pinned facts, summary and recent turns, within the token budget; empty for a new conversation.
+        Read only: turns are folded into the summary by add_turn(), never here.
+        """
+        text = self._render(self.summary)
+        over = estimate_tokens(text) - self.budget_tokens
+        if over > 0 and self.summary:
+            # pins changed since the last turn: leave out the oldest summary lines, without forgetting them
+            text = self._render(_drop_oldest(self.summary, over))
+        if estimate_tokens(text) > self.budget_tokens:
+            # pinned facts alone are over the budget, send them cut short
+            return text[: self.budget_tokens * 4]
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "context_tokens": estimate_tokens(self.context()),
+            "history_tokens": self.history_tokens,
+            "budget_tokens": self.budget_tokens,
+            "verbatim_turns": len(self.turns),
+            "summarized_turns": self.summarized_turns,
+        }
+
+    def clear(self) -> None:
+        self.pins.clear()
+        self.summary = ""
+        self.turns = []
+        self.summarized_turns = 0
+        self.history_tokens = 0
+
+    # ---- internals -----------------------------------------------------
+
+    def _fold(self) -> None:
+        """Roll the oldest verbatim turn into the summary."""
+        turn = self.turns.pop(0)
+        try:
+            self.summary = self.summarize(self.summary, turn)
+        except Exception:
+            # a failing summarizer model must not lose the turn
+            self.summary = extractive_summary(self.summary, turn)
+        self.summarized_turns += 1
+
+    def _fit(self) -> None:
+        """Fold the oldest verbatim turns, then drop the oldest summary lines, until the context fits the budget."""
+        while True:
+            over = estimate_tokens(self._render(self.summary)) - self.budget_tokens
+            if over <= 0:
+                return
+            if self.turns:
+                self._fold()
+            elif self.summary:
+                self.summary = _drop_oldest(self.summary, over)
+            else:
+                return
+
+    def _render(self, summary: str) -> str:
+        sections = []
+        if self.pins:
+            sections.append("Pinned facts:\n" + "\n".join(f"- {name}: {value}" for name, value in self.pins.items()))
+        if summary:
+            sections.append(f"Summary of earlier turns:\n{summary}")
+        if self.turns:
+            sections.append("Recent turns:\n" + "\n\n".join(_turn_text(turn, self._answer_budget()) for turn in self.turns))
+        return "\n\n".join(sections)
+
+    def _answer_budget(self) -> int:
+        # a verbatim answer (often a rendered table) gets an equal share of a quarter of the budget
+        return max(self.budget_tokens // (4 * max(len(self.turns), 1)), 50)
+
+
+def extractive_summary(summary: str, turn: dict) -> str:
+    """`summary` plus one line for `turn`: its question and the first line of its answer."""
+    answer = next((line.strip() for line in str(turn["answer"]).splitlines() if line.strip()), "")
+    if len(answer) > _SUMMARY_LINE_CHARS:
+        answer = answer[:_SUMMARY_LINE_CHARS] + "..."
+    line = f"- {' '.join(turn['question'].split())} -> {answer}"
+    return f"{summary}\n{line}" if summary else line
+
+
+def query_filters(query: str) -> list[str]:
+    """The AND-ed conditions of a query's outermost WHERE clause, as spark sql, eg. ["isocode = 'US'", ...]."""
+    expression = parse_sql(query)
+    if expression is None:
+        return []
+    where = expression.args.get("where")
+    if where is None:
+        return []
+    conditions = where.this.flatten() if isinstance(where.this, exp.And) else [where.this]
+    return [condition.sql(dialect=DIALECT) for condition in conditions]
+
+
+def _turn_text(turn: dict, answer_tokens: int | None = None) -> str:
+    answer = str(turn["answer"])
+    if answer_tokens is not None and estimate_tokens(answer) > answer_tokens:
+        answer = answer[: answer_tokens * 4] + "\n... (cut)"
+    text = f"User: {turn['question']}\nAgent: {answer}"
+    if turn["sql"]:
+        text += f"\nSQL: {turn['sql']}"
+    return text
+
+
+def _drop_oldest(summary: str, tokens: int) -> str:
+    """`summary` without its oldest lines, at least `tokens` shorter."""
+    lines = summary.splitlines()
+    dropped = 0
+    while lines and dropped < tokens:
+        dropped += estimate_tokens(lines.pop(0) + "\n")
+    return "\n".join(lines)
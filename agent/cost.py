@@ -0,0 +1,70 @@
+import re
+
+_STATS = re.compile(r"Statistics\(sizeInBytes=([0-9.E+\-]+)\s*([KMGTPE]i)?B(?:, rowCount=([0-9.E+\-]+))?")
+_UNITS = {None: 1, "Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50, "Ei": 2**60}
+# leaf nodes of an optimized logical plan that read data
+_SCAN_NODES = ("Relation", "RelationV2", "HiveTableRelation", "LocalRelation", "InMemoryRelation")
+
+
+class CostEstimationError(RuntimeError):
+    """EXPLAIN COST did not return a usable plan (eg. the query doesn't analyze)."""
+
+
+def parse_explain_cost(plan: str) -> dict:
+    """
+    Scan estimate from the output of `EXPLAIN COST <query>`.
+
+    Sums the statistics of the leaf scan nodes of the optimized logical plan,
+    which for iceberg tables already reflect partition pruning.
+    Returns {"bytes": int, "rows": int | None, "scans": int}.
+    """
+    if "== Optimized Logical Plan ==" not in plan:
+        raise CostEstimationError(plan.strip().splitlines()[0] if plan.strip() else "empty plan")
+    logical = plan.split("== Optimized Logical Plan ==", 1)[1].split("== Physical Plan ==", 1)[0]
+    if "Exception" in logical:
+        raise CostEstimationError(logical.strip().splitlines()[0])
+
+    total_bytes = 0
+    total_rows = 0
+    rows_known = True
+    scans = 0
+    for line in logical.splitlines():
+        node = line.lstrip(" :+-")
+        if not node.startswith(_SCAN_NODES):
+            continue
+        match = _STATS.search(line)
+        if match is None:
+            continue
+        scans += 1
+        total_bytes += int(float(match.group(1)) * _UNITS[match.group(2)])
+        if match.group(3) is None:
+            rows_known = False
+        else:
+            total_rows += int(float(match.group(3)))
+
+    if scans == 0:
+        # no recognizable scan node, fall back to the root estimate
+        match = _STATS.search(logical)
+        if match is None:
+            raise CostEstimationError("no statistics in plan")
+        total_bytes = int(float(match.group(1)) * _UNITS[match.group(2)])
+        rows_known = match.group(3) is not None
+        total_rows = int(float(match.group(3))) if rows_known else 0
+
+    return {"bytes": total_bytes, "rows": total_rows if rows_known else None, "scans": scans}
+
+
+def format_bytes(num_bytes: int | float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(num_bytes) < 1024 or unit == "TiB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+
+def describe_estimate(estimate: dict, max_scan_bytes: int) -> str:
+    """One line summary of an estimate for the agent."""
+    text = f"estimated scan: {format_bytes(estimate['bytes'])} across {estimate['scans']} table scan(s)"
+    if estimate["rows"] is not None:
+        text += f", ~{estimate['rows']:,} rows"
+    verdict = "within" if estimate["bytes"] <= max_scan_bytes else "OVER"
+    return f"{text} ({verdict} budget of {format_bytes(max_scan_bytes)})"
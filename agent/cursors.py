@@ -0,0 +1,236 @@
+import glob
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlglot import exp
+
+from sql_utils import parse_sql
+
+# name the cursor's rows go by in the paging queries
+_VIEW = "result"
+
+
+class CursorNotFound(KeyError):
+    pass
+
+
+class CursorStore:
+    """
+    Query results materialized once and paged, filtered and sorted locally.
+
+    open() writes the rows to a parquet file in `directory` batch by batch,
+    as they arrive, and returns a handle id. read() runs a select over them with duckdb, so the next page
+    or a re-sort costs milliseconds and never touches spark again. Recently
+    used results stay in memory as arrow tables, up to `max_memory_bytes`;
+    the others are read back from their file. A cursor expires
+    `ttl_seconds` after it was last used, and the oldest files are removed
+    once the directory holds more than `max_disk_bytes`. Files outlive the
+    process, so a cursor opened by one agent process can be read by another
+    until it expires.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int = 1800, max_memory_bytes: int = 256 * 1024**2, max_disk_bytes: int = 2 * 1024**3):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._tables: OrderedDict[str, pa.Table] = OrderedDict()
+        self._memory_bytes = 0
+        self._keys: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.reads = 0
+        self.expired = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def open(
+        self,
+        batches: Iterable[pa.RecordBatch],
+        schema: pa.Schema,
+        key: tuple | None = None,
+        max_rows: int | None = None,
+        max_bytes: int | None = None,
+    ) -> tuple[str, bool]:
+        """
+        Store the rows of `batches` and return (cursor id, whether they were cut).
+        Each batch is written out as it arrives, and reading stops at `max_rows`
+        rows or `max_bytes` bytes of arrow data, so the result never has to fit
+        in memory whole. `schema` is used when there are no batches. `key`
+        (eg. normalized sql + snapshots) lets find() reuse the cursor.
+        """
+        cursor_id = "c" + secrets.token_hex(4)
+        writer, kept, rows, size, cut = None, [], 0, 0, False
+        try:
+            for batch in batches:
+                if max_rows is not None and rows + batch.num_rows > max_rows:
+                    batch, cut = batch.slice(0, max_rows - rows), True
+                if max_bytes is not None and size + batch.nbytes > max_bytes:
+                    # rows of a batch are about the same size: keep the share that fits
+                    fit = int(batch.num_rows * (max_bytes - size) / batch.nbytes)
+                    batch, cut = batch.slice(0, fit), True
+                if writer is None:
+                    writer = pq.ParquetWriter(self._path(cursor_id), batch.schema)
+                if batch.num_rows:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+                    size += batch.nbytes
+                    # only results within the memory budget are kept as arrow too
+                    if kept is not None and size <= self.max_memory_bytes:
+                        kept.append(batch)
+                    else:
+                        kept = None
+                if cut:
+                    break
+            if writer is None:
+                writer = pq.ParquetWriter(self._path(cursor_id), schema)
+        finally:
+            if writer is not None:
+                writer.close()
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+        with self._lock:
+            self.opened += 1
+            if key is not None:
+                self._keys[key] = cursor_id
+            if kept is not None:
+                self._remember(cursor_id, pa.Table.from_batches(kept, writer.schema))
+        self._sweep()
+        return cursor_id, cut
+
+    def find(self, key: tuple) -> str | None:
+        """Id of a live cursor opened with `key`, if any."""
+        with self._lock:
+            cursor_id = self._keys.get(key)
+        if cursor_id is None or not self._alive(cursor_id):
+            return None
+        with self._lock:
+            self.reused += 1
+        return cursor_id
+
+    def table(self, cursor_id: str) -> pa.Table:
+        """All rows of a cursor. Raises CursorNotFound when it expired or never existed."""
+        if not cursor_id.isalnum() or not self._alive(cursor_id):
+            raise CursorNotFound(cursor_id)
+        os.utime(self._path(cursor_id))
+        with self._lock:
+            table = self._tables.get(cursor_id)
+            if table is not None:
+                self._tables.move_to_end(cursor_id)
+                return table
+        table = pq.read_table(self._path(cursor_id))
+        with self._lock:
+            self._remember(cursor_id, table)
+        return table
+
+    def read(
+        self,
+        cursor_id: str,
+        columns: str = "",
+        where: str = "",
+        order_by: str = "",
+        offset: int = 0,
+        limit: int = 20,
+    ) -> tuple[pa.Table, int, int]:
+        """
+        (page, rows matching `where`, rows in the cursor) of `select columns
+        from the cursor where ... order by ... limit/offset`. The clauses are
+        Spark SQL, like the rest of the agent's queries, and are translated to
+        duckdb. Raises CursorNotFound, or ValueError for clauses that don't
+        parse or reach outside the cursor.
+        """
+        table = self.table(cursor_id)
+        select = parse_sql(
+            f"select {columns or '*'} from {_VIEW}"
+            + (f" where {where}" if where else "")
+            + (f" order by {order_by}" if order_by else "")
+        )
+        if select is None or not isinstance(select, exp.Select):
+            raise ValueError("columns, where_clause and order_by must be plain SQL expressions")
+        if any(table_.name != _VIEW for table_ in select.find_all(exp.Table)) or len(list(select.find_all(exp.Select))) > 1:
+            raise ValueError("where_clause and order_by can only use the cursor's columns, no subqueries or other tables")
+        counted = select.copy()
+        counted.set("order", None)
+        count_sql = f"select count(*) from ({counted.sql(dialect='duckdb')})"
+        page_sql = select.limit(limit).offset(offset).sql(dialect="duckdb")
+
+        # no file or network access: the clauses come from the LLM
+        connection = duckdb.connect(config={"enable_external_access": False})
+        try:
+            connection.register(_VIEW, table)
+            matching = connection.execute(count_sql).fetchone()[0]
+            page = connection.execute(page_sql).arrow()
+        except duckdb.Error as e:
+            raise ValueError(str(e).splitlines()[0]) from e
+        finally:
+            connection.close()
+        with self._lock:
+            self.reads += 1
+        return page, matching, table.num_rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "reads": self.reads,
+                "expired": self.expired,
+                "in_memory": len(self._tables),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    # ---- internals -----------------------------------------------------
+
+    def _path(self, cursor_id: str) -> str:
+        return os.path.join(self.directory, f"{cursor_id}.parquet")
+
+    def _alive(self, cursor_id: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self._path(cursor_id)) < self.ttl_seconds
+        except OSError:
+            return False
+
+    def _remember(self, cursor_id: str, table: pa.Table) -> None:
+        # caller holds the lock; results bigger than the budget are only kept on disk
+        if table.nbytes > self.max_memory_bytes:
+            return
+        self._tables[cursor_id] = table
+        self._memory_bytes += table.nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._tables.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _sweep(self) -> None:
+        """Delete expired cursors, then the least recently used ones while over the disk budget."""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.parquet")):
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for mtime, size, path in files:
+            if now - mtime < self.ttl_seconds and total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            cursor_id = os.path.basename(path)[: -len(".parquet")]
+            with self._lock:
+                self.expired += 1
+                table = self._tables.pop(cursor_id, None)
+                if table is not None:
+                    self._memory_bytes -= table.nbytes
+                self._keys = {key: value for key, value in self._keys.items() if value != cursor_id}
@@ -0,0 +1,153 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180
+# bounding boxes are padded by this share of the radius, so float error never drops a point the exact check would keep
+_BOX_MARGIN = 0.01
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> tuple[float, float, list[tuple[float, float]]]:
+    """
+    Latitude range and longitude range(s) containing every point within
+    `radius_km` of (lat, lon). Boxes crossing the antimeridian are split in
+    two longitude ranges; boxes reaching a pole span all longitudes.
+    The box is slightly larger than the circle, see _BOX_MARGIN.
+    """
+    radius_km *= 1 + _BOX_MARGIN
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), [(-180.0, 180.0)]
+
+    # widest point of the circle is at the latitude closest to a pole
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    dlon = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(widest_lat)))
+    if dlon >= 180:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def haversine_km_sql(lat_col: str, lon_col: str, lat: float, lon: float) -> str:
+    """Spark SQL expression for the great circle distance in km from (lat, lon)."""
+    return (
+        f"2 * {EARTH_RADIUS_KM} * asin(sqrt("
+        f"pow(sin(radians({lat_col} - {lat!r}) / 2), 2) + "
+        f"cos(radians({lat!r})) * cos(radians({lat_col})) * "
+        f"pow(sin(radians({lon_col} - {lon!r}) / 2), 2)))"
+    )
+
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> tuple[float, float]:
+    """(height, width) in degrees of a geohash cell of `precision` characters."""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision - lon_bits
+    return 180 / 2**lat_bits, 360 / 2**lon_bits
+
+
+def geohash_cover(
+    min_lat: float, max_lat: float, lon_ranges: list[tuple[float, float]], max_precision: int, max_cells: int = 32
+) -> tuple[int, list[str]]:
+    """
+    Geohash cells covering a bounding box, at the finest precision
+    (up to `max_precision`) that needs no more than `max_cells` cells.
+    """
+    for precision in range(max_precision, 0, -1):
+        height, width = geohash_cell_size(precision)
+        cells_estimate = sum(
+            (math.ceil((max_lat - min_lat) / height) + 1) * (math.ceil((max_lon - min_lon) / width) + 1)
+            for min_lon, max_lon in lon_ranges
+        )
+        if cells_estimate > max_cells and precision > 1:
+            continue
+        cells = set()
+        for min_lon, max_lon in lon_ranges:
+            for lat in _steps(min_lat, max_lat, height):
+                for lon in _steps(min_lon, max_lon, width):
+                    cells.add(geohash_encode(lat, lon, precision))
+        return precision, sorted(cells)
+    return 0, []
+
+
+def _steps(start: float, stop: float, step: float) -> list[float]:
+    values = []
+    value = start
+    while value < stop:
+        values.append(value)
+        value += step
+    values.append(stop)
+    return values
+
+
+def build_radius_query(
+    table_name: str,
+    lat: float,
+    lon: float,
+    radius_km: float,
+    time_filter: str,
+    extra_filters: list[str],
+    lat_col: str,
+    lon_col: str,
+    select: str,
+    cell_col: str | None = None,
+    cell_precision: int = 7,
+) -> str:
+    """
+    Radius query over `table_name` with the cheap predicates first.
+
+    The inner query keeps only rows inside the bounding box (and, with
+    `cell_col`, inside the covering geohash cells) so parquet/iceberg min/max
+    statistics can skip files; the exact haversine distance is only computed
+    for the rows that survive. `select` is the outer projection and can use
+    the `distance_km` column.
+    """
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, radius_km)
+    filters = [time_filter, *extra_filters, f"{lat_col} between {min_lat!r} and {max_lat!r}"]
+    lon_filters = [f"{lon_col} between {lo!r} and {hi!r}" for lo, hi in lon_ranges if (lo, hi) != (-180.0, 180.0)]
+    if len(lon_filters) == 1:
+        filters.append(lon_filters[0])
+    elif lon_filters:
+        filters.append("(" + " or ".join(lon_filters) + ")")
+    if cell_col:
+        precision, cells = geohash_cover(min_lat, max_lat, lon_ranges, cell_precision)
+        cell_list = ", ".join(f"'{cell}'" for cell in cells)
+        filters.append(f"substr({cell_col}, 1, {precision}) in ({cell_list})")
+
+    where = "\n                and ".join(filters)
+    return f"""
+        select {select}
+        from (
+            select *, {haversine_km_sql(lat_col, lon_col, lat, lon)} as distance_km
+            from (
+                select *
+                from {table_name}
+                where {where}
+            ) box
+        ) candidates
+        where distance_km <= {radius_km!r}
+    """
@@ -0,0 +1,198 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from single_flight import SingleFlight
+from tool_metrics import add as add_tool_metrics
+
+
+class _Entry:
+    __slots__ = ("value", "snapshot_id", "expires_at")
+
+    def __init__(self, value: Any, snapshot_id: Any, expires_at: float):
+        self.value = value
+        self.snapshot_id = snapshot_id
+        self.expires_at = expires_at
+
+
+class MetadataCache:
+    """
+    Shared, thread-safe cache for catalog/schema metadata.
+
+    Entries expire after `ttl_seconds` and the least recently used entry
+    is evicted once `max_entries` is reached. An entry can be tagged with
+    the iceberg snapshot id it was read at; it is dropped as soon as the
+    table reports a different current snapshot.
+
+    When `path` is given, entries are written through to a local sqlite
+    file and loaded back on start so a cold process starts warm.
+
+    Concurrent misses of the same key make one `loader()` call; the other
+    callers wait for it and share its value (counted as `coalesced`).
+    """
+
+    def __init__(self, ttl_seconds: int = 3600, max_entries: int = 2048, path: str | None = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.coalesced = 0
+        if path:
+            self._open_store(path)
+
+    # ---- public api ----------------------------------------------------
+
+    def get_or_load(
+        self,
+        key: tuple,
+        loader: Callable[[], Any],
+        snapshot_id: Callable[[], Any] | None = None,
+        ttl_seconds: int | None = None,
+        persist: bool = True,
+    ) -> Any:
+        """
+        Return the cached value for `key`, calling `loader()` on a miss.
+
+        Args:
+            key: tuple identifying the entry, eg. ("columns", "prod_catalog.adtech_db.base")
+            loader: function that fetches the value from spark
+            snapshot_id: optional function returning the table's current snapshot id
+            ttl_seconds: overrides the cache ttl for this entry
+            persist: write the entry to the on-disk store (if enabled)
+        """
+        skey = _key_to_str(key)
+        current_snapshot = snapshot_id() if snapshot_id is not None else None
+
+        with self._lock:
+            entry = self._entries.get(skey)
+            if entry is not None:
+                if entry.expires_at <= time.time():
+                    self.expirations += 1
+                    self._drop(skey)
+                elif snapshot_id is not None and entry.snapshot_id != current_snapshot:
+                    self.invalidations += 1
+                    self._drop(skey)
+                else:
+                    self._entries.move_to_end(skey)
+                    self.hits += 1
+                    add_tool_metrics(cache_hits=1)
+                    return entry.value
+            self.misses += 1
+        add_tool_metrics(cache_misses=1)
+
+        # load outside the lock so one slow spark call doesn't block other lookups
+        def load():
+            value = loader()
+            self.put(key, value, snapshot_id=current_snapshot, ttl_seconds=ttl_seconds, persist=persist)
+            return value
+
+        value, shared = self._flights.do(skey, load)
+        if shared:
+            with self._lock:
+                self.coalesced += 1
+        return value
+
+    def put(
+        self,
+        key: tuple,
+        value: Any,
+        snapshot_id: Any = None,
+        ttl_seconds: int | None = None,
+        persist: bool = True,
+    ) -> None:
+        skey = _key_to_str(key)
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._entries[skey] = _Entry(value, snapshot_id, expires_at)
+            self._entries.move_to_end(skey)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._store_delete(oldest)
+            if persist:
+                self._store_put(skey, value, snapshot_id, expires_at)
+
+    def invalidate(self, *key_prefix: Any) -> int:
+        """
+        Drop every entry whose key starts with `key_prefix`.
+        Called with no arguments the whole cache is cleared.
+        Returns the number of dropped entries.
+        """
+        prefix = list(key_prefix)
+        with self._lock:
+            doomed = [k for k in self._entries if json.loads(k)[: len(prefix)] == prefix]
+            for k in doomed:
+                self._drop(k)
+            self.invalidations += len(doomed)
+            return len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.expirations = self.invalidations = self.evictions = self.coalesced = 0
+
+    # ---- internals -----------------------------------------------------
+
+    def _drop(self, skey: str) -> None:
+        self._entries.pop(skey, None)
+        self._store_delete(skey)
+
+    def _open_store(self, path: str) -> None:
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "create table if not exists metadata_cache ("
+            " key text primary key, value text, snapshot_id text, expires_at real)"
+        )
+        now = time.time()
+        self._db.execute("delete from metadata_cache where expires_at <= ?", (now,))
+        self._db.commit()
+        rows = self._db.execute(
+            "select key, value, snapshot_id, expires_at from metadata_cache"
+            " order by expires_at desc limit ?",
+            (self.max_entries,),
+        ).fetchall()
+        # oldest first so the freshest entries end up as most recently used
+        for skey, value, snapshot_id, expires_at in reversed(rows):
+            self._entries[skey] = _Entry(json.loads(value), json.loads(snapshot_id), expires_at)
+
+    def _store_put(self, skey: str, value: Any, snapshot_id: Any, expires_at: float) -> None:
+        if self._db is None:
+            return
+        self._db.execute(
+            "insert or replace into metadata_cache values (?, ?, ?, ?)",
+            (skey, json.dumps(value), json.dumps(snapshot_id), expires_at),
+        )
+        self._db.commit()
+
+    def _store_delete(self, skey: str) -> None:
+        if self._db is None:
+            return
+        self._db.execute("delete from metadata_cache where key = ?", (skey,))
+        self._db.commit()
+
+
+def _key_to_str(key: tuple) -> str:
+    return json.dumps(list(key))
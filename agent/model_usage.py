@@ -0,0 +1,167 @@
+import argparse
+import json
+import secrets
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+
+from smolagents import LiteLLMModel
+
+from percentiles import percentile
+
+# time to first token samples kept per model for the percentiles
+_TTFT_WINDOW = 1000
+
+_current = threading.local()
+
+
+class ModelUsage:
+    """Per model totals of every LLM call in this process: prompt, cached and completion tokens, time to first token."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        self._ttft = defaultdict(lambda: deque(maxlen=_TTFT_WINDOW))
+
+    def add(self, model_id: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int, ttft_s: float | None) -> None:
+        with self._lock:
+            totals = self._models[model_id]
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["completion_tokens"] += completion_tokens
+            if ttft_s is not None:
+                self._ttft[model_id].append(ttft_s)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                model_id: {
+                    **totals,
+                    "cached_share": round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0,
+                    "ttft_p50_s": round(percentile(self._ttft[model_id], 50), 3),
+                    "ttft_p95_s": round(percentile(self._ttft[model_id], 95), 3),
+                }
+                for model_id, totals in self._models.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._ttft.clear()
+
+
+model_usage = ModelUsage()
+
+
+def begin_model_calls() -> None:
+    """Start logging this thread's model calls, see model_calls()."""
+    _current.calls = []
+
+
+def model_calls() -> list[dict]:
+    """Model calls made by this thread since begin_model_calls(): {"model", "prompt_tokens", "cached_tokens", ...}."""
+    return list(getattr(_current, "calls", None) or [])
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prefix cache, as litellm reports them (OpenAI, Anthropic); 0 if unknown."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+
+
+class _RecordingClient:
+    """The litellm module, with the token usage and time to first token of every completion recorded."""
+
+    def __init__(self, client, model_id: str):
+        self._client = client
+        self._model_id = model_id
+
+    def completion(self, **kwargs):
+        start = time.perf_counter()
+        if kwargs.get("stream"):
+            return self._stream(self._client.completion(**kwargs), start)
+        response = self._client.completion(**kwargs)
+        self._record(response.usage, None)
+        return response
+
+    def _stream(self, events, start: float):
+        ttft, usage = None, None
+        try:
+            for event in events:
+                if ttft is None and event.choices and event.choices[0].delta.content:
+                    ttft = time.perf_counter() - start
+                if getattr(event, "usage", None):
+                    usage = event.usage
+                yield event
+        finally:
+            self._record(usage, ttft)
+
+    def _record(self, usage, ttft_s: float | None) -> None:
+        call = {
+            "model": self._model_id,
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "cached_tokens": cached_tokens(usage),
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "ttft_s": None if ttft_s is None else round(ttft_s, 3),
+        }
+        model_usage.add(call["model"], call["prompt_tokens"], call["cached_tokens"], call["completion_tokens"], ttft_s)
+        calls = getattr(_current, "calls", None)
+        if calls is not None:
+            calls.append(call)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class RecordingLiteLLMModel(LiteLLMModel):
+    """LiteLLMModel whose calls are counted in `model_usage` and logged for model_calls()."""
+
+    def create_client(self):
+        return _RecordingClient(super().create_client(), self.model_id)
+
+
+def measure_prefix_cache(model: LiteLLMModel, system_prompt: str, question: str, repeats: int = 3) -> dict:
+    """
+    Median time to first token of `question` after `system_prompt`, cold (the
+    prompt made unique by a leading nonce, so no prefix cache can match it)
+    and warm (the same prompt sent again), streamed from `model`.
+    """
+    def ttft(system: str) -> float:
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": system}]},
+            {"role": "user", "content": [{"type": "text", "text": question}]},
+        ]
+        start = time.perf_counter()
+        for delta in model.generate_stream(messages):
+            if delta.content:
+                return time.perf_counter() - start
+        return time.perf_counter() - start
+
+    cold = [ttft(f"[{secrets.token_hex(8)}]\n{system_prompt}") for _ in range(repeats)]
+    ttft(system_prompt)
+    warm = [ttft(system_prompt) for _ in range(repeats)]
+    return {
+        "model": model.model_id,
+        "repeats": repeats,
+        "cold_ttft_s": round(statistics.median(cold), 3),
+        "warm_ttft_s": round(statistics.median(warm), 3),
+        "saved_s": round(statistics.median(cold) - statistics.median(warm), 3),
+        "usage": model_usage.summary().get(model.model_id),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how much a warm prompt prefix cuts time to first token.")
+    parser.add_argument("--tier", help="model tier to measure (default: ORACLE_MODEL_TIER)")
+    parser.add_argument("--repeats", type=int, default=3, help="cold and warm requests each (default: 3)")
+    args = parser.parse_args()
+
+    from agent import EXAMPLE_QUERIES, build_agent, build_prompt, default_tier, router
+    from config import MODEL_TIERS
+
+    tier = next(tier for tier in MODEL_TIERS if tier["name"] == args.tier) if args.tier else default_tier
+    tier_model = router.model(tier)
+    system_prompt = build_agent(tier_model).system_prompt
+    print(json.dumps(measure_prefix_cache(tier_model, system_prompt, build_prompt(EXAMPLE_QUERIES["query1"], tier_model.model_id), args.repeats)))
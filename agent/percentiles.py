@@ -0,0 +1,14 @@
+import math
+from typing import Iterable
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of `values`, in any order; 0.0 when there are none.
+    The one definition behind every p50/p95 reported (batch summary, router and
+    model stats, the UI sidebar), so they agree for the same samples.
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[max(1, math.ceil(pct / 100 * len(values))) - 1]
@@ -0,0 +1,292 @@
+import datetime
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from sqlglot import exp
+
+from sql_utils import DIALECT, parse_sql
+
+_MONTHS = {
+    month: number
+    for number, names in enumerate(
+        [("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+         ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"),
+         ("dec", "december")],
+        start=1,
+    )
+    for month in names
+}
+# slot patterns, tried in order; earlier matches win overlapping text
+_SLOTS = [
+    ("date", re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")),
+    ("date", re.compile(r"\b(" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b", re.I)),
+    ("str", re.compile(r"(?<!\w)'([^']*)'(?!\w)|\"([^\"]*)\"")),
+    ("iso", re.compile(r"(?<=isocode )([A-Z]{2})\b")),
+    ("num", re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")),
+]
+_ISO_DATE = re.compile(r"^(\d{4}-\d{2}-\d{2})(.*)$")
+
+
+class PlanCache:
+    """
+    Parameterized SQL templates learned from successful agent runs.
+
+    A question is reduced to a template by replacing its literals (dates,
+    quoted values, isocodes, numbers) with typed slots. The final
+    sql_query_to_str query of a successful run is stored against that
+    template, with each SQL literal bound to the question slot it came from
+    (dates may be shifted by a day, eg. an exclusive end date).
+
+    A new question whose template is exactly a stored one, and whose
+    template has succeeded at least `min_successes` times, gets the stored
+    SQL with its own literals filled in. Templates are never matched by
+    similarity: questions a character apart ("=" vs "!=", "on" vs "before"
+    a date) ask different things. Templates that fail `max_failures` times
+    are dropped.
+
+    When `path` is given, templates are written through to a sqlite file.
+    """
+
+    def __init__(
+        self,
+        min_successes: int = 1,
+        max_failures: int = 2,
+        max_entries: int = 1024,
+        path: str | None = None,
+    ):
+        self.min_successes = min_successes
+        self.max_failures = max_failures
+        self.max_entries = max_entries
+        self._templates: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.lookups = 0
+        self.hits = 0
+        self.unproven = 0
+        self.fallbacks = 0
+        self.learned = 0
+        if path:
+            self._open_store(path)
+
+    def lookup(self, question: str) -> dict | None:
+        """
+        Filled plan for `question`, or None when no proven template matches exactly:
+        {"key": template key, "sql": ready to run sql}
+        """
+        template, values = question_template(question)
+        with self._lock:
+            self.lookups += 1
+            entry = self._templates.get(template)
+            if entry is None or entry["signature"] != [kind for kind, _ in values]:
+                return None
+            if entry["successes"] < self.min_successes:
+                self.unproven += 1
+                return None
+            self._templates.move_to_end(template)
+        sql = fill_sql(entry["sql"], entry["bindings"], values)
+        if sql is None:
+            return None
+        return {"key": template, "sql": sql}
+
+    def hit(self, key: str) -> None:
+        """The plan from lookup() answered the question."""
+        with self._lock:
+            self.hits += 1
+            entry = self._templates.get(key)
+            if entry is not None:
+                entry["successes"] += 1
+                self._store_put(entry)
+
+    def miss(self, key: str) -> None:
+        """The plan from lookup() failed; the caller falls back to the agent."""
+        with self._lock:
+            self.fallbacks += 1
+            entry = self._templates.get(key)
+            if entry is None:
+                return
+            entry["failures"] += 1
+            if entry["failures"] >= self.max_failures:
+                self._drop(key)
+            else:
+                self._store_put(entry)
+
+    def learn(self, question: str, sql: str) -> bool:
+        """
+        Store `sql`, the validated final query of a successful run for `question`.
+        Returns False, storing nothing, unless every literal of the question is
+        used by the sql: a template ignoring one would answer other questions wrong.
+        """
+        template, values = question_template(question)
+        bindings = bind_literals(sql, values)
+        if bindings is None or {binding["slot"] for binding in bindings} != set(range(len(values))):
+            return False
+        with self._lock:
+            entry = self._templates.get(template)
+            if entry is not None and entry["sql"] == sql:
+                entry["successes"] += 1
+            else:
+                entry = {
+                    "key": template,
+                    "signature": [kind for kind, _ in values],
+                    "sql": sql,
+                    "bindings": bindings,
+                    "successes": 1,
+                    "failures": 0,
+                }
+                self._templates[template] = entry
+                self.learned += 1
+            self._templates.move_to_end(template)
+            while len(self._templates) > self.max_entries:
+                self._drop(next(iter(self._templates)))
+            self._store_put(entry)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "templates": len(self._templates),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "unproven": self.unproven,
+                "fallbacks": self.fallbacks,
+                "learned": self.learned,
+            }
+
+    # ---- internals -----------------------------------------------------
+
+    def _drop(self, key: str) -> None:
+        self._templates.pop(key, None)
+        if self._db is not None:
+            self._db.execute("delete from plan_cache where key = ?", (key,))
+            self._db.commit()
+
+    def _open_store(self, path: str) -> None:
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("create table if not exists plan_cache (key text primary key, entry text)")
+        for _, entry in self._db.execute("select key, entry from plan_cache").fetchall():
+            entry = json.loads(entry)
+            self._templates[entry["key"]] = entry
+
+    def _store_put(self, entry: dict) -> None:
+        if self._db is None:
+            return
+        self._db.execute("insert or replace into plan_cache values (?, ?)", (entry["key"], json.dumps(entry)))
+        self._db.commit()
+
+
+def question_template(question: str) -> tuple[str, list[tuple[str, str]]]:
+    """
+    Split a question into a template with typed slots and the slot values.
+
+    Example:
+        question_template("records for EntityId='AB12' on Jan 31st 2025 in isocode RU")
+        -> ("records for entityid=<str> on <date> in isocode <iso>",
+            [("str", "AB12"), ("date", "2025-01-31"), ("iso", "RU")])
+    """
+    found = []
+    taken = [False] * len(question)
+    for kind, pattern in _SLOTS:
+        for match in pattern.finditer(question):
+            if any(taken[match.start():match.end()]):
+                continue
+            value = _slot_value(kind, match)
+            if value is None:
+                continue
+            taken[match.start():match.end()] = [True] * (match.end() - match.start())
+            found.append((match.start(), match.end(), kind, value))
+    found.sort()
+
+    parts, values, position = [], [], 0
+    for start, end, kind, value in found:
+        parts.append(question[position:start])
+        parts.append(f"<{kind}>")
+        values.append((kind, value))
+        position = end
+    parts.append(question[position:])
+    template = re.sub(r"\s+", " ", "".join(parts)).strip().lower()
+    return template, values
+
+
+def bind_literals(sql: str, values: list[tuple[str, str]]) -> list[dict] | None:
+    """
+    Tie each literal of `sql` that came from the question to its slot:
+    [{"literal": index among the sql's literals, "slot": slot index, "offset": days}].
+    Returns None when the sql doesn't parse or no literal comes from the question.
+    """
+    expression = parse_sql(sql)
+    if expression is None:
+        return None
+    bindings = []
+    for index, literal in enumerate(_literals(expression)):
+        binding = _bind(literal, values)
+        if binding is not None:
+            bindings.append({"literal": index, **binding})
+    return bindings or None
+
+
+def fill_sql(sql: str, bindings: list[dict], values: list[tuple[str, str]]) -> str | None:
+    """`sql` with its bound literals replaced by the new slot `values`."""
+    expression = parse_sql(sql)
+    if expression is None:
+        return None
+    literals = _literals(expression)
+    for binding in bindings:
+        if binding["literal"] >= len(literals) or binding["slot"] >= len(values):
+            return None
+        literal = literals[binding["literal"]]
+        kind, value = values[binding["slot"]]
+        if kind == "date":
+            date = datetime.date.fromisoformat(value) + datetime.timedelta(days=binding["offset"])
+            suffix = _ISO_DATE.match(literal.this).group(2)
+            literal.replace(exp.Literal.string(date.isoformat() + suffix))
+        elif kind == "num":
+            literal.replace(exp.Literal.number(value))
+        else:
+            literal.replace(exp.Literal.string(value))
+    return expression.sql(dialect=DIALECT)
+
+
+def _literals(expression: exp.Expression) -> list[exp.Literal]:
+    # LIMIT values and GROUP BY / ORDER BY ordinals are part of the plan, not the question
+    return [
+        literal for literal in expression.find_all(exp.Literal)
+        if not isinstance(literal.parent, (exp.Limit, exp.Group, exp.Ordered))
+    ]
+
+
+def _bind(literal: exp.Literal, values: list[tuple[str, str]]) -> dict | None:
+    if literal.is_string:
+        match = _ISO_DATE.match(literal.this)
+        if match:
+            date = datetime.date.fromisoformat(match.group(1))
+            # same day first, then a day either side (eg. exclusive end dates)
+            for offset in (0, 1, -1):
+                slots = [i for i, (kind, value) in enumerate(values) if kind == "date" and value == (date - datetime.timedelta(days=offset)).isoformat()]
+                if slots:
+                    return {"slot": slots[-1] if offset > 0 else slots[0], "offset": offset}
+            return None
+        for i, (kind, value) in enumerate(values):
+            if kind in ("str", "iso") and value.lower() == literal.this.lower():
+                return {"slot": i, "offset": 0}
+        return None
+    for i, (kind, value) in enumerate(values):
+        if kind == "num" and float(value) == float(literal.this):
+            return {"slot": i, "offset": 0}
+    return None
+
+
+def _slot_value(kind: str, match: re.Match) -> str | None:
+    if kind == "date":
+        try:
+            if match.group(1).isdigit():
+                return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+            return datetime.date(int(match.group(3)), _MONTHS[match.group(1).lower()], int(match.group(2))).isoformat()
+        except ValueError:
+            return None
+    if kind == "str":
+        return match.group(1) if match.group(1) is not None else match.group(2)
+    return match.group(0) if kind == "num" else match.group(1)
@@ -0,0 +1,205 @@
+import datetime
+import decimal
+from typing import Any, Iterator
+
+import pyarrow as pa
+
+from config import RENDER_MAX_BYTES, RENDER_MAX_CELL_CHARS, RENDER_MAX_TOKENS
+from tool_metrics import add, classic_scan_metrics, connect_scan_metrics, is_recording, record
+
+NULL = "NULL"
+ELLIPSIS = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), same rule render_df budgets with."""
+    return (len(text) + 3) // 4
+
+
+def iter_arrow_batches(df, max_rows: int) -> Iterator[pa.RecordBatch]:
+    """
+    Yield the first `max_rows + 1` rows of a spark DataFrame as arrow record batches.
+
+    The extra row tells the caller whether the result was cut. On spark connect
+    the batches are read off the grpc stream as they arrive, so a consumer that
+    stops early never holds the rest. Classic (local) sessions collect the
+    limited result as arrow in one go.
+
+    Neither has a public arrow api in pyspark 3.5 (DataFrame.toArrow comes
+    with 4.0), so this uses pyspark internals, which is why requirements.txt
+    pins pyspark. A pyspark without them falls back to collecting rows.
+
+    Inside an instrumented tool call the rows/bytes/files scanned are added to
+    the call's metrics: from the PlanMetrics at the end of the connect stream
+    or from the executed classic plan. A consumer that stops early should
+    close() the generator, which reads the rest of the limited stream for its
+    metrics.
+    """
+    limited = df.limit(max_rows + 1)
+    if type(limited).__module__.startswith("pyspark.sql.connect"):
+        client = limited._session.client
+        if not hasattr(client, "_execute_and_fetch_as_iterator") or not hasattr(client, "_execute_plan_request_with_metadata"):
+            yield from _collect_rows_as_arrow(limited)
+            return
+        from pyspark.sql.connect.client.core import PlanMetrics
+
+        request = client._execute_plan_request_with_metadata()
+        request.plan.CopyFrom(limited._plan.to_proto(client))
+        stream = client._execute_and_fetch_as_iterator(request)
+        plan_metrics = []
+        try:
+            for response in stream:
+                if isinstance(response, pa.RecordBatch):
+                    yield response
+                elif isinstance(response, PlanMetrics):
+                    plan_metrics.append(response)
+        except GeneratorExit:
+            # the rest is at most `max_rows + 1` rows, and the metrics come last
+            plan_metrics.extend(response for response in stream if isinstance(response, PlanMetrics))
+            raise
+        finally:
+            add(**connect_scan_metrics(plan_metrics))
+    elif hasattr(limited, "_collect_as_arrow"):
+        batches = limited._collect_as_arrow()
+        if is_recording():
+            add(**classic_scan_metrics(limited))
+        yield from batches
+    else:
+        yield from _collect_rows_as_arrow(limited)
+
+
+def _collect_rows_as_arrow(df) -> Iterator[pa.RecordBatch]:
+    """Collect `df` through the public row api and convert it to arrow: slower, and no scan metrics on spark connect."""
+    from pyspark.sql.pandas.types import to_arrow_schema
+
+    rows = [row.asDict(recursive=True) for row in df.collect()]
+    if is_recording() and not type(df).__module__.startswith("pyspark.sql.connect"):
+        add(**classic_scan_metrics(df))
+    yield from pa.Table.from_pylist(rows, schema=to_arrow_schema(df.schema)).to_batches()
+
+
+def render_df(
+    df,
+    max_rows: int = 20,
+    max_bytes: int = RENDER_MAX_BYTES,
+    max_tokens: int = RENDER_MAX_TOKENS,
+    max_cell_chars: int = RENDER_MAX_CELL_CHARS,
+    more_rows_hint: str = "",
+) -> str:
+    """
+    Render a spark DataFrame as compact text for the LLM.
+
+    Output is a `name:type` header, one ' | ' separated line per row and a
+    footer with the row count and anything that was cut. Rendering stops at
+    whichever comes first of `max_rows`, `max_bytes` or `max_tokens`; cells
+    longer than `max_cell_chars` are truncated. `more_rows_hint` is added to
+    the footer when there were more than `max_rows` rows.
+    """
+    header = " | ".join(f"{field.name}:{field.dataType.simpleString()}" for field in df.schema.fields)
+    batches = iter_arrow_batches(df, max_rows)
+    try:
+        return _render(header, batches, max_rows, max_bytes, max_tokens, max_cell_chars, more_rows_hint)
+    finally:
+        # still inside the tool call, so the scan metrics are added to it
+        batches.close()
+
+
+def render_arrow(
+    table: pa.Table,
+    max_rows: int = 20,
+    max_bytes: int = RENDER_MAX_BYTES,
+    max_tokens: int = RENDER_MAX_TOKENS,
+    max_cell_chars: int = RENDER_MAX_CELL_CHARS,
+    more_rows_hint: str = "",
+) -> str:
+    """Render an arrow table like render_df, with spark type names in the header."""
+    header = " | ".join(f"{field.name}:{_spark_type_name(field.type)}" for field in table.schema)
+    return _render(header, table.to_batches(), max_rows, max_bytes, max_tokens, max_cell_chars, more_rows_hint)
+
+
+def _render(
+    header: str,
+    batches,
+    max_rows: int,
+    max_bytes: int,
+    max_tokens: int,
+    max_cell_chars: int,
+    more_rows_hint: str,
+) -> str:
+    lines = [header]
+    size = len(header.encode())
+    chars = len(header)
+    rows_fetched = 0
+    truncated_cells = 0
+    stopped_by = None
+
+    for batch in batches:
+        columns = [column.to_pylist() for column in batch.columns]
+        for i in range(batch.num_rows):
+            rows_fetched += 1
+            if rows_fetched > max_rows:
+                stopped_by = "row limit"
+                break
+            cells = []
+            row_truncated_cells = 0
+            for column in columns:
+                cell = _format_cell(column[i])
+                if len(cell) > max_cell_chars:
+                    cell = cell[:max_cell_chars] + ELLIPSIS
+                    row_truncated_cells += 1
+                cells.append(cell)
+            line = " | ".join(cells)
+            size += len(line.encode()) + 1
+            chars += len(line) + 1
+            if size > max_bytes or (chars + 3) // 4 > max_tokens:
+                stopped_by = "output budget"
+                break
+            lines.append(line)
+            truncated_cells += row_truncated_cells
+        if stopped_by:
+            break
+
+    rows_shown = len(lines) - 1
+    record(rows=rows_shown)
+    if stopped_by is None:
+        footer = f"-- {rows_shown} rows"
+    elif stopped_by == "row limit":
+        footer = f"-- showing {rows_shown} rows, more rows available (row limit {max_rows}){more_rows_hint}"
+    else:
+        footer = f"-- showing {rows_shown} rows, output cut at {max_bytes} bytes / {max_tokens} tokens; narrow the query"
+    if truncated_cells:
+        footer += f"; {truncated_cells} cells truncated to {max_cell_chars} chars"
+    lines.append(footer)
+    return "\n".join(lines)
+
+
+def _spark_type_name(arrow_type: pa.DataType) -> str:
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "string"
+    if pa.types.is_timestamp(arrow_type):
+        return "timestamp"
+    if pa.types.is_date(arrow_type):
+        return "date"
+    if pa.types.is_decimal(arrow_type):
+        return f"decimal({arrow_type.precision},{arrow_type.scale})"
+    names = {
+        pa.int8(): "tinyint", pa.int16(): "smallint", pa.int32(): "int", pa.int64(): "bigint",
+        pa.float32(): "float", pa.float64(): "double", pa.bool_(): "boolean", pa.binary(): "binary",
+    }
+    return names.get(arrow_type, str(arrow_type))
+
+
+def _format_cell(value: Any) -> str:
+    if value is None:
+        return NULL
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, decimal.Decimal):
+        return format(value.normalize(), "f")
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, str):
+        return value.replace("\n", "\\n")
+    return str(value).replace("\n", "\\n")
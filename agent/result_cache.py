@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+from tool_metrics import add as add_tool_metrics
+
+
+class ResultCache:
+    """
+    LRU cache of rendered query results, bounded by memory size.
+
+    Keys are built by the caller from the normalized query text and the
+    snapshot ids of every table it reads, so new data landing in a table
+    changes the key instead of serving a stale result. `ttl_seconds` is a
+    safety net for tables without snapshots (views, non-iceberg tables).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, tuple[str, int, float]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.time():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                add_tool_metrics(cache_misses=1)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        add_tool_metrics(cache_hits=1)
+        return entry[0]
+
+    def put(self, key: tuple, value: str) -> None:
+        size = _sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, size, time.time() + self.ttl_seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _pop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+def _sizeof(key: tuple, value: str) -> int:
+    return len(value.encode()) + sum(len(str(part)) for part in key)
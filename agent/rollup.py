@@ -0,0 +1,294 @@
+import argparse
+import datetime
+import json
+import re
+import time
+
+from sqlglot import exp
+
+from config import (
+    ROLLUP_DIMENSIONS,
+    ROLLUP_ENTITY_COLUMN,
+    ROLLUP_SKETCH_LG_K,
+    ROLLUP_TABLES,
+    ROLLUP_TIME_COLUMN,
+)
+
+# columns of a rollup table besides the dimensions; the day is last, as the partition column
+DAY_COLUMN = "event_date"
+COUNT_COLUMN = "records"
+SKETCH_COLUMN = "entities"
+# table property holding the source snapshot id a rollup is up to date with ('' for non iceberg sources)
+STATE_PROPERTY = "oracle.rollup.source_snapshot"
+
+_DAY_LITERAL = re.compile(r"^\d{4}-\d{2}-\d{2}(?: 00:00(?::00(?:\.0+)?)?)?$")
+# functions that give the same result on the time column and on its day
+_DAY_FUNCTIONS = (exp.Year, exp.Quarter, exp.Month, exp.WeekOfYear, exp.DayOfWeek, exp.DayOfMonth, exp.DayOfYear, exp.DateTrunc)
+_DAY_UNITS = {"DAY", "DD", "WEEK", "MONTH", "MON", "MM", "QUARTER", "YEAR", "YYYY", "YY"}
+# comparisons of the time column with a midnight literal that hold for the whole day, keyed on the column's side
+_DAY_COMPARISONS = {(exp.GTE, "this"), (exp.LT, "this"), (exp.LTE, "expression"), (exp.GT, "expression")}
+
+
+def rollup_select(
+    source: str,
+    days: list[datetime.date] | None = None,
+    time_column: str = ROLLUP_TIME_COLUMN,
+    dimensions: list[str] = ROLLUP_DIMENSIONS,
+    entity_column: str = ROLLUP_ENTITY_COLUMN,
+    lg_k: int = ROLLUP_SKETCH_LG_K,
+) -> str:
+    """SQL computing the rollup rows of `source`, for all days or only `days`."""
+    where = f"where {days_filter(time_column, days)}" if days else ""
+    dims = ", ".join(dimensions)
+    return f"""
+        select {dims}, count(*) as {COUNT_COLUMN}, hll_sketch_agg({entity_column}, {lg_k}) as {SKETCH_COLUMN},
+               to_date({time_column}) as {DAY_COLUMN}
+        from {source}
+        {where}
+        group by {dims}, to_date({time_column})
+    """
+
+
+def days_filter(time_column: str, days: list[datetime.date]) -> str:
+    """SQL condition keeping the rows of `time_column` on one of `days`."""
+    first, last = min(days), max(days) + datetime.timedelta(days=1)
+    listed = ", ".join(f"date'{day.isoformat()}'" for day in sorted(days))
+    # the range prunes partitions of the source, the list skips the days in between
+    return f"{time_column} >= '{first}' and {time_column} < '{last}' and to_date({time_column}) in ({listed})"
+
+
+def current_snapshot(spark, table_name: str) -> int | None:
+    """Current iceberg snapshot id of the table, None for tables without snapshot history."""
+    try:
+        rows = spark.sql(f"""
+            select snapshot_id
+            from {table_name}.history
+            where is_current_ancestor
+            order by made_current_at desc
+            limit 1
+        """).collect()
+    except Exception:
+        return None
+    return rows[0][0] if rows else None
+
+
+def appended_days(
+    spark, source: str, start_snapshot: int, end_snapshot: int, time_column: str = ROLLUP_TIME_COLUMN
+) -> list[datetime.date] | None:
+    """Days touched by the snapshots after `start_snapshot`, None when they aren't all appends."""
+    try:
+        appended = (
+            spark.read.format("iceberg")
+            .option("start-snapshot-id", str(start_snapshot))
+            .option("end-snapshot-id", str(end_snapshot))
+            .load(source)
+        )
+        rows = appended.selectExpr(f"to_date({time_column})").distinct().collect()
+    except Exception:
+        return None
+    return [row[0] for row in rows if row[0] is not None]
+
+
+def rollup_state(spark, rollup: str) -> str | None:
+    """Source snapshot id (as a string, '' for non iceberg sources) the rollup was built at, None if it doesn't exist."""
+    try:
+        rows = spark.sql(f"show tblproperties {rollup}").collect()
+    except Exception:
+        return None
+    return next((row[1] for row in rows if row[0] == STATE_PROPERTY), None)
+
+
+def refresh_rollup(spark, source: str, rollup: str, rebuild: bool = False) -> dict:
+    """
+    Bring `rollup` up to date with the current snapshot of `source`.
+
+    Nothing is read when the rollup is already at the current snapshot. When
+    iceberg can read the new snapshots as appends, only the days they touch
+    are recomputed and overwritten; otherwise (the first build, overwrites or
+    deletes in the source, expired snapshots, or `rebuild`) the whole rollup
+    is rebuilt. Sources without snapshots are only built once, later changes
+    need `rebuild`.
+    Returns {"source", "rollup", "action": "unchanged" | "incremental" | "rebuilt", "days", "snapshot", "seconds"}.
+    """
+    start = time.perf_counter()
+    snapshot = current_snapshot(spark, source)
+    state = rollup_state(spark, rollup)
+    target = "" if snapshot is None else str(snapshot)
+    result = {"source": source, "rollup": rollup, "action": "unchanged", "days": 0, "snapshot": snapshot}
+
+    if rebuild or state is None or (state != target and not (state and snapshot)):
+        spark.sql(rollup_select(source)).write.mode("overwrite").partitionBy(DAY_COLUMN).saveAsTable(rollup)
+        result["action"] = "rebuilt"
+    elif state != target:
+        days = appended_days(spark, source, int(state), snapshot)
+        if days is None:
+            spark.sql(rollup_select(source)).write.mode("overwrite").partitionBy(DAY_COLUMN).saveAsTable(rollup)
+            result["action"] = "rebuilt"
+        else:
+            if days:
+                _overwrite_days(spark, source, rollup, days)
+            result["action"], result["days"] = "incremental", len(days)
+    if result["action"] != "unchanged":
+        spark.sql(f"alter table {rollup} set tblproperties ('{STATE_PROPERTY}' = '{target}')")
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def rewrite_for_rollup(
+    expression: exp.Expression,
+    rollup_tables: dict[str, str] = ROLLUP_TABLES,
+    time_column: str = ROLLUP_TIME_COLUMN,
+    dimensions: list[str] = ROLLUP_DIMENSIONS,
+    entity_column: str = ROLLUP_ENTITY_COLUMN,
+) -> tuple[exp.Expression, str, str] | None:
+    """
+    Rewrite an aggregate query over a table with a rollup into the same query
+    over the rollup. Returns (rewritten copy, source table, rollup table), or
+    None when the rollup can't give the same answer.
+
+    Eligible queries are a single SELECT over the source table that either
+    aggregates or is SELECT DISTINCT, where:
+    - aggregates are COUNT(*) (summed from the daily counts) or
+      approx_count_distinct of the entity column (merged HLL sketches; exact
+      COUNT(DISTINCT) is never answered from the rollup)
+    - other columns are dimensions, the day column, output aliases, or the
+      time column inside a date cast, a day-level date function, or a
+      `>=` / `<` comparison with a midnight date
+
+    Example:
+        select lower(provider) as provider, count(*) as records from prod_catalog.adtech_db.base
+        where eventtimeunix >= '2025-01-15' and eventtimeunix < '2025-01-22' and isocode = 'RU' group by 1
+        -> select lower(provider) as provider, coalesce(sum(records), 0) as records from prod_catalog.adtech_db.base_daily_rollup
+           where event_date >= '2025-01-15' and event_date < '2025-01-22' and isocode = 'RU' group by 1
+    """
+    if not isinstance(expression, exp.Select):
+        return None
+    if expression.find(exp.Join, exp.Subquery, exp.With, exp.Union, exp.Window, exp.Lateral, exp.Anonymous):
+        return None
+    tables = list(expression.find_all(exp.Table))
+    if len(tables) != 1 or tables[0].args.get("sample"):
+        return None
+    name = ".".join(part.name for part in tables[0].parts).lower()
+    source = next(
+        (table for table in rollup_tables if table.lower() == name or table.lower().endswith("." + name)), None
+    )
+    if source is None:
+        return None
+
+    expression = expression.copy()
+    table = next(expression.find_all(exp.Table))
+    # keep spark's output names of unaliased aggregates
+    expression.set("expressions", [
+        exp.alias_(projection, _spark_name(projection), quoted=True)
+        if isinstance(projection, (exp.Count, exp.ApproxDistinct)) else projection
+        for projection in expression.expressions
+    ])
+
+    aggregates = []
+    for node in expression.find_all(exp.AggFunc):
+        if isinstance(node, exp.Count) and isinstance(node.this, (exp.Star, exp.Literal)) and not node.this.is_string:
+            aggregates.append((node, _sum_counts()))
+        elif isinstance(node, exp.ApproxDistinct) and _is_column(node.this, entity_column):
+            aggregates.append((node, _merge_sketches()))
+        else:
+            return None
+    if not aggregates and not expression.args.get("distinct"):
+        # plain rows of the source, not one per day and dimension
+        return None
+
+    aggregate_ids = {id(node) for node, _ in aggregates}
+    aliases = {projection.alias.lower() for projection in expression.expressions if isinstance(projection, exp.Alias)}
+    allowed = {dimension.lower() for dimension in dimensions} | {DAY_COLUMN}
+    replacements = []
+    for column in expression.find_all(exp.Column):
+        if any(id(ancestor) in aggregate_ids for ancestor in _ancestors(column)):
+            continue
+        if column.name.lower() in allowed or (not column.table and column.name.lower() in aliases):
+            continue
+        if column.name.lower() != time_column.lower():
+            return None
+        replaced = _day_replacement(column)
+        if replaced is None:
+            return None
+        replacements.append(replaced)
+
+    for node, replacement in replacements + aggregates:
+        node.replace(replacement)
+
+    rollup = rollup_tables[source]
+    replacement = exp.to_table(rollup)
+    if table.args.get("alias"):
+        replacement.set("alias", table.args["alias"])
+    table.replace(replacement)
+    return expression, source, rollup
+
+
+def _overwrite_days(spark, source: str, rollup: str, days: list[datetime.date]) -> None:
+    key = "spark.sql.sources.partitionOverwriteMode"
+    previous = spark.conf.get(key, "static")
+    spark.conf.set(key, "dynamic")
+    try:
+        spark.sql(rollup_select(source, days)).write.insertInto(rollup, overwrite=True)
+    finally:
+        spark.conf.set(key, previous)
+
+
+def _day_replacement(column: exp.Column) -> tuple[exp.Expression, exp.Expression] | None:
+    """(node, replacement) turning a use of the time column into the same use of the day column."""
+    day = exp.column(DAY_COLUMN)
+    parent = column.parent
+    if isinstance(parent, exp.TsOrDsToDate) or (
+        isinstance(parent, (exp.Cast, exp.TryCast)) and parent.to.is_type(exp.DataType.Type.DATE)
+    ):
+        return parent, day
+    if isinstance(parent, _DAY_FUNCTIONS):
+        return column, day
+    if isinstance(parent, exp.TimestampTrunc) and parent.text("unit").upper() in _DAY_UNITS:
+        return column, day
+    for comparison, side in _DAY_COMPARISONS:
+        if isinstance(parent, comparison) and parent.args.get(side) is column:
+            other = parent.expression if side == "this" else parent.this
+            if isinstance(other, exp.Literal) and other.is_string and _DAY_LITERAL.match(other.this):
+                return column, day
+    return None
+
+
+def _ancestors(node: exp.Expression):
+    parent = node.parent
+    while parent is not None:
+        yield parent
+        parent = parent.parent
+
+
+def _is_column(node: exp.Expression, name: str) -> bool:
+    return isinstance(node, exp.Column) and node.name.lower() == name.lower()
+
+
+def _sum_counts() -> exp.Expression:
+    # count(*) over no rows is 0, sum over no rows is null
+    return exp.Coalesce(this=exp.Sum(this=exp.column(COUNT_COLUMN)), expressions=[exp.Literal.number(0)])
+
+
+def _merge_sketches() -> exp.Expression:
+    union = exp.Anonymous(this="hll_union_agg", expressions=[exp.column(SKETCH_COLUMN)])
+    estimate = exp.Anonymous(this="hll_sketch_estimate", expressions=[union])
+    return exp.Coalesce(this=estimate, expressions=[exp.Literal.number(0)])
+
+
+def _spark_name(node: exp.Expression) -> str:
+    if isinstance(node, exp.Count):
+        return f"count({node.this.sql() if isinstance(node.this, exp.Literal) else 1})"
+    return f"approx_count_distinct({node.this.sql()})"
+
+
+if __name__ == "__main__":
+    from spark_session import spark_session
+
+    parser = argparse.ArgumentParser(description="Build or incrementally refresh the daily rollup tables.")
+    parser.add_argument("tables", nargs="*", help="source tables to refresh (default: every table in ORACLE_ROLLUP_TABLES)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild from scratch instead of refreshing new snapshots")
+    args = parser.parse_args()
+
+    with spark_session() as spark:
+        for source in args.tables or list(ROLLUP_TABLES):
+            print(json.dumps(refresh_rollup(spark, source, ROLLUP_TABLES[source], rebuild=args.rebuild), default=str))
@@ -0,0 +1,172 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+from smolagents import LiteLLMModel
+
+from model_usage import RecordingLiteLLMModel
+from percentiles import percentile
+from plan_cache import question_template
+
+# question complexity, cheapest first; a question of level i starts on tier i (or the last tier)
+COMPLEXITY = ("metadata", "query", "analysis")
+
+_ANALYSIS = re.compile(
+    r"\b(explain|why|causes?|drops?|spikes?|anomal\w*|trends?|compar\w*|correlat\w*|investigate|changed?)\b", re.I
+)
+_METADATA = re.compile(r"\b(catalogs?|databases?|tables?|schemas?|columns?|types?|ddl|describe|history|snapshots?)\b", re.I)
+_DATA = re.compile(r"\b(records?|rows?|entit\w*|unique|distinct|values?|exists?|within|average|sum|top)\b", re.I)
+_LATENCY_WINDOW = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def build_model(tier: dict) -> LiteLLMModel:
+    return RecordingLiteLLMModel(model_id=tier["model_id"], **tier.get("model_kwargs", {}))
+
+
+def classify_question(question: str) -> str:
+    """
+    Complexity of `question`, one of COMPLEXITY:
+    - 'analysis': asks why / explains / compares, eg. "Explain the data drop in ..."
+    - 'metadata': about catalogs, tables or columns, with no literals or data
+      words, eg. "how many tables in test_catalog.dev_kbailey ?"
+    - 'query': everything else, a question answered by one or a few SQL queries
+    """
+    if _ANALYSIS.search(question):
+        return "analysis"
+    _, values = question_template(question)
+    if not values and _METADATA.search(question) and not _DATA.search(question):
+        return "metadata"
+    return "query"
+
+
+class ModelRouter:
+    """
+    Send each question to the cheapest model tier that fits its complexity,
+    escalating to the next tier when a run raises or runs out of steps.
+
+    `tiers` are ordered from cheapest to most capable (see MODEL_TIERS in
+    config.py). `attempt(question, tier, model)` runs the agent once and
+    returns a smolagents RunResult. Escalation stops once the question has
+    taken `latency_budget_seconds`, or when the next tier's expected cost
+    (its average tokens per run so far, else the tokens used so far on this
+    question) would take the question over `cost_budget`. The last result is
+    returned even if it failed; if every attempt raised, the last error is
+    raised.
+    """
+
+    def __init__(
+        self,
+        tiers: list[dict],
+        attempt: Callable[[str, dict, LiteLLMModel], Any],
+        latency_budget_seconds: float = 300,
+        cost_budget: float = 0.05,
+    ):
+        if not tiers:
+            raise ValueError("the router needs at least one model tier")
+        self.tiers = tiers
+        self.attempt = attempt
+        self.latency_budget_seconds = latency_budget_seconds
+        self.cost_budget = cost_budget
+        self._models: dict[str, LiteLLMModel] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            tier["name"]: {"routed": 0, "runs": 0, "successes": 0, "failures": 0, "escalations": 0,
+                           "seconds": 0.0, "tokens": 0, "cost": 0.0}
+            for tier in tiers
+        }
+        self._latencies = {tier["name"]: deque(maxlen=_LATENCY_WINDOW) for tier in tiers}
+
+    def model(self, tier: dict) -> LiteLLMModel:
+        """The tier's model client, built on first use and shared by concurrent runs."""
+        with self._lock:
+            if tier["name"] not in self._models:
+                self._models[tier["name"]] = build_model(tier)
+            return self._models[tier["name"]]
+
+    def route(self, question: str) -> int:
+        """Index of the tier `question` starts on."""
+        level = COMPLEXITY.index(classify_question(question))
+        return min(level, len(self.tiers) - 1)
+
+    def run(self, question: str) -> Any:
+        start = time.perf_counter()
+        index = self.route(question)
+        with self._lock:
+            self._stats[self.tiers[index]["name"]]["routed"] += 1
+        spent, tokens_so_far = 0.0, 0
+        result, error = None, None
+        while True:
+            tier = self.tiers[index]
+            attempt_start = time.perf_counter()
+            try:
+                result, error = self.attempt(question, tier, self.model(tier)), None
+                succeeded = result.state == "success"
+                reason = "ok" if succeeded else result.state
+            except Exception as e:
+                result, error, succeeded, reason = None, e, False, type(e).__name__
+            seconds = time.perf_counter() - attempt_start
+            tokens = _total_tokens(result)
+            cost = tokens * tier.get("cost_per_1k_tokens", 0.0) / 1000
+            spent += cost
+            tokens_so_far += tokens
+            self._record(tier, seconds, tokens, cost, succeeded)
+            logger.info("%s (%s) %s in %.1fs, %d tokens", tier["name"], tier["model_id"], reason, seconds, tokens)
+
+            if succeeded or index + 1 >= len(self.tiers):
+                break
+            following = self.tiers[index + 1]
+            expected = self._expected_tokens(following, tokens_so_far) * following.get("cost_per_1k_tokens", 0.0) / 1000
+            if time.perf_counter() - start >= self.latency_budget_seconds or spent + expected > self.cost_budget:
+                logger.info("not escalating to %s, over the latency or cost budget", following["name"])
+                break
+            with self._lock:
+                self._stats[tier["name"]]["escalations"] += 1
+            index += 1
+
+        if result is None:
+            raise error
+        return result
+
+    def stats(self) -> dict:
+        """Per tier: questions routed to it, runs, escalation rate, latency and tokens."""
+        with self._lock:
+            stats = {}
+            for name, totals in self._stats.items():
+                latencies = self._latencies[name]
+                runs = totals["runs"]
+                stats[name] = {
+                    **{key: round(value, 4) if isinstance(value, float) else value for key, value in totals.items()},
+                    "escalation_rate": round(totals["escalations"] / runs, 3) if runs else 0.0,
+                    "latency_p50_s": round(percentile(latencies, 50), 3),
+                    "latency_p95_s": round(percentile(latencies, 95), 3),
+                }
+            return stats
+
+    # ---- internals -----------------------------------------------------
+
+    def _record(self, tier: dict, seconds: float, tokens: int, cost: float, succeeded: bool) -> None:
+        with self._lock:
+            totals = self._stats[tier["name"]]
+            totals["runs"] += 1
+            totals["successes" if succeeded else "failures"] += 1
+            totals["seconds"] += seconds
+            totals["tokens"] += tokens
+            totals["cost"] += cost
+            self._latencies[tier["name"]].append(seconds)
+
+    def _expected_tokens(self, tier: dict, fallback: int) -> int:
+        with self._lock:
+            totals = self._stats[tier["name"]]
+            return totals["tokens"] // totals["runs"] if totals["runs"] else fallback
+
+
+def _total_tokens(result) -> int:
+    usage = getattr(result, "token_usage", None)
+    return usage.input_tokens + usage.output_tokens if usage is not None else 0
+
+
@@ -0,0 +1,277 @@
+import argparse
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from config import SCHEMA_INDEX_CATALOGS, SCHEMA_INDEX_MAX_AGE_HOURS, SCHEMA_INDEX_PATH
+from rollup import current_snapshot
+
+# how much a match on each kind of name counts towards a table's score
+_WEIGHTS = {"table": 1.0, "column": 1.0, "database": 0.5, "comment": 0.5, "catalog": 0.3}
+_FUZZY_CUTOFF = 0.75
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+
+
+class SchemaIndex:
+    """
+    Local index of every catalog, database, table and column, with column
+    types and comments, partitioning and table comments, kept in a sqlite
+    file. It answers keyword and fuzzy lookups in one call (eg. which tables
+    have an EntityId column) and lists catalogs, databases and tables for
+    the UI, without going through spark.
+
+    refresh() lists the databases and tables of each catalog and describes
+    only the tables that are new, whose iceberg snapshot changed, or that
+    were described more than `max_age_hours` ago; dropped tables are removed.
+    """
+
+    def __init__(self, path: str = SCHEMA_INDEX_PATH, max_age_hours: float = SCHEMA_INDEX_MAX_AGE_HOURS):
+        self.path = path
+        self.max_age_hours = max_age_hours
+        self._lock = threading.Lock()
+        self._vocabulary, self._signature = None, None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            create table if not exists schema_tables (
+                catalog text, database text, table_name text, partitioning text, comment text,
+                snapshot text, described_at real,
+                primary key (catalog, database, table_name)
+            );
+            create table if not exists schema_columns (
+                catalog text, database text, table_name text, position integer,
+                column_name text, data_type text, comment text,
+                primary key (catalog, database, table_name, position)
+            );
+        """)
+
+    # ---- listings ------------------------------------------------------
+
+    def catalogs(self) -> list[str]:
+        return self._column("select distinct catalog from schema_tables order by 1")
+
+    def databases(self, catalog: str) -> list[str]:
+        return self._column("select distinct database from schema_tables where catalog = ? order by 1", catalog.lower())
+
+    def tables(self, catalog: str, database: str) -> list[str]:
+        return self._column(
+            "select table_name from schema_tables where catalog = ? and database = ? order by 1", catalog.lower(), database.lower()
+        )
+
+    def table(self, full_name: str) -> dict | None:
+        """{"name", "partitioning", "comment", "columns": [(name, type, comment), ...]} of 'catalog.db.table'."""
+        parts = full_name.lower().split(".")
+        if len(parts) != 3:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "select partitioning, comment from schema_tables where catalog = ? and database = ? and table_name = ?", parts
+            ).fetchone()
+            columns = self._db.execute(
+                "select column_name, data_type, comment from schema_columns"
+                " where catalog = ? and database = ? and table_name = ? order by position", parts
+            ).fetchall()
+        if row is None:
+            return None
+        return {"name": ".".join(parts), "partitioning": json.loads(row[0]), "comment": row[1], "columns": columns}
+
+    # ---- search --------------------------------------------------------
+
+    def search(self, keywords: str, limit: int = 10) -> list[dict]:
+        """
+        Tables matching `keywords`, best first. Every keyword is matched against
+        catalog, database, table and column names and comment words: exactly,
+        as a substring, or fuzzily (eg. 'entity_id' finds EntityId). A table's
+        score is the sum of its best match per keyword, so tables matching
+        more of the keywords rank first.
+        Returns [{"name", "score", "matched": [column names]}, ...].
+        """
+        terms = [term.lower() for term in _WORD.findall(keywords)]
+        if not terms:
+            return []
+        vocabulary = self._load_vocabulary()
+        scores = defaultdict(dict)
+        matched = defaultdict(set)
+        for term in terms:
+            loose = term.replace("_", "")
+            candidates = {word: 1.0 for word in vocabulary if word == term or word.replace("_", "") == loose}
+            for word in vocabulary:
+                if word not in candidates and len(term) >= 3 and term in word:
+                    candidates[word] = 0.7
+            for word in difflib.get_close_matches(term, vocabulary, n=20, cutoff=_FUZZY_CUTOFF):
+                candidates.setdefault(word, 0.6 * difflib.SequenceMatcher(None, term, word).ratio())
+            for word, quality in candidates.items():
+                for table, kind, column in vocabulary[word]:
+                    score = quality * _WEIGHTS[kind]
+                    if score > scores[table].get(term, 0.0):
+                        scores[table][term] = score
+                    if column is not None:
+                        matched[table].add(column)
+        ranked = sorted(scores, key=lambda table: (-sum(scores[table].values()), table))
+        return [
+            {"name": table, "score": round(sum(scores[table].values()), 3), "matched": sorted(matched[table])}
+            for table in ranked[:limit]
+        ]
+
+    def _load_vocabulary(self) -> dict[str, list[tuple]]:
+        """lower case word -> [(table, kind, column name or None), ...], rebuilt when the index changes."""
+        with self._lock:
+            # a refresh from another process (eg. the cron job) shows up as new described_at times
+            signature = self._db.execute("select count(*), max(described_at) from schema_tables").fetchone()
+            if self._vocabulary is not None and signature == self._signature:
+                return self._vocabulary
+            vocabulary = defaultdict(list)
+            for catalog, database, table_name, comment in self._db.execute(
+                "select catalog, database, table_name, comment from schema_tables"
+            ):
+                name = f"{catalog}.{database}.{table_name}"
+                vocabulary[catalog].append((name, "catalog", None))
+                vocabulary[database].append((name, "database", None))
+                vocabulary[table_name].append((name, "table", None))
+                for word in set(_WORD.findall((comment or "").lower())):
+                    vocabulary[word].append((name, "comment", None))
+            for catalog, database, table_name, column, comment in self._db.execute(
+                "select catalog, database, table_name, column_name, comment from schema_columns"
+            ):
+                name = f"{catalog}.{database}.{table_name}"
+                vocabulary[column.lower()].append((name, "column", column))
+                for word in set(_WORD.findall((comment or "").lower())):
+                    vocabulary[word].append((name, "comment", column))
+            self._vocabulary, self._signature = dict(vocabulary), signature
+            return self._vocabulary
+
+    # ---- refresh -------------------------------------------------------
+
+    def refresh(self, spark, catalogs: list[str] = SCHEMA_INDEX_CATALOGS, rebuild: bool = False) -> dict:
+        """
+        Bring the index up to date with the catalogs.
+        Returns {"catalogs", "tables", "described", "removed", "failed", "seconds"}.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            known = {
+                (row[0], row[1], row[2]): (row[3], row[4])
+                for row in self._db.execute("select catalog, database, table_name, snapshot, described_at from schema_tables")
+            }
+        listed, described, failed = set(), 0, []
+        # catalogs and (catalog, database)s that couldn't be listed: their tables are kept as they are
+        unlisted = set()
+        for catalog in catalogs:
+            catalog = catalog.lower()
+            try:
+                databases = [row[0].lower() for row in spark.sql(f"show databases in {catalog}").collect()]
+            except Exception:
+                failed.append(catalog)
+                unlisted.add((catalog,))
+                continue
+            for database in databases:
+                try:
+                    tables = spark.sql(f"show tables in {catalog}.{database}").collect()
+                except Exception:
+                    failed.append(f"{catalog}.{database}")
+                    unlisted.add((catalog, database))
+                    continue
+                for row in tables:
+                    if row.isTemporary:
+                        continue
+                    key = (catalog, database, row.tableName.lower())
+                    listed.add(key)
+                    full_name = ".".join(key)
+                    snapshot = current_snapshot(spark, full_name)
+                    snapshot = "" if snapshot is None else str(snapshot)
+                    previous = known.get(key)
+                    if (
+                        not rebuild and previous is not None and previous[0] == snapshot
+                        and time.time() - previous[1] < self.max_age_hours * 3600
+                    ):
+                        continue
+                    try:
+                        self._store(key, snapshot, spark.sql(f"describe table extended {full_name}").collect())
+                        described += 1
+                    except Exception:
+                        failed.append(full_name)
+
+        wanted = {catalog.lower() for catalog in catalogs}
+        removed = [
+            key for key in known
+            if key[0] in wanted and key not in listed and key[:1] not in unlisted and key[:2] not in unlisted
+        ]
+        with self._lock:
+            for key in removed:
+                self._db.execute("delete from schema_tables where catalog = ? and database = ? and table_name = ?", key)
+                self._db.execute("delete from schema_columns where catalog = ? and database = ? and table_name = ?", key)
+            self._db.commit()
+        return {
+            "catalogs": list(catalogs),
+            "tables": len(listed),
+            "described": described,
+            "removed": len(removed),
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def _store(self, key: tuple, snapshot: str, rows: list) -> None:
+        columns, partitioning, comment = parse_describe(rows)
+        with self._lock:
+            self._db.execute("delete from schema_columns where catalog = ? and database = ? and table_name = ?", key)
+            self._db.executemany(
+                "insert into schema_columns values (?, ?, ?, ?, ?, ?, ?)",
+                [(*key, position, *column) for position, column in enumerate(columns)],
+            )
+            self._db.execute(
+                "insert or replace into schema_tables values (?, ?, ?, ?, ?, ?, ?)",
+                (*key, json.dumps(partitioning), comment, snapshot, time.time()),
+            )
+            self._db.commit()
+
+    def _column(self, query: str, *params) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, params)]
+
+
+def parse_describe(rows: list) -> tuple[list[tuple], list[str], str | None]:
+    """
+    (columns as (name, type, comment), partitioning, table comment) from the rows
+    of `DESCRIBE TABLE EXTENDED`, for both iceberg ('# Partitioning', 'Part 0:
+    days(ts)') and hive style ('# Partition Information') tables.
+    """
+    columns, partitioning, comment = [], [], None
+    section = "columns"
+    for name, data_type, column_comment in (tuple(row)[:3] for row in rows):
+        name = (name or "").strip()
+        if name == "# col_name":
+            continue
+        if name.startswith("#"):
+            section = {"# partitioning": "iceberg", "# partition information": "hive"}.get(name.lower(), name.lower())
+            continue
+        if not name:
+            section = "other"
+            continue
+        if section == "columns":
+            columns.append((name, data_type, column_comment or None))
+        elif section == "iceberg" and name.lower().startswith("part "):
+            partitioning.append(data_type)
+        elif section == "hive":
+            partitioning.append(name)
+        elif section == "# detailed table information" and name == "Comment":
+            comment = data_type or None
+    return columns, partitioning, comment
+
+
+if __name__ == "__main__":
+    from spark_session import spark_session
+
+    parser = argparse.ArgumentParser(description="Build or incrementally refresh the schema index.")
+    parser.add_argument("catalogs", nargs="*", help="catalogs to index (default: ORACLE_SCHEMA_INDEX_CATALOGS)")
+    parser.add_argument("--rebuild", action="store_true", help="describe every table again")
+    args = parser.parse_args()
+
+    index = SchemaIndex()
+    with spark_session() as spark:
+        print(json.dumps(index.refresh(spark, args.catalogs or SCHEMA_INDEX_CATALOGS, rebuild=args.rebuild)))
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import SERVER_HOST, SERVER_PORT, SERVER_SOCKET
+
+PROCESS_START = time.perf_counter()
+
+
+class AgentRuntime:
+    """
+    Loads the agent module (smolagents, pyspark, phoenix, model client) once,
+    on first use or in the background right after the server starts, and
+    keeps it warm for every following query.
+    """
+
+    def __init__(self):
+        self._module = None
+        self._lock = threading.Lock()
+        self.timings = {"load_s": None, "ready_after_start_s": None, "first_answer_s": None}
+        self.queries = 0
+        self.errors = 0
+
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                import agent
+
+                self._module = agent
+                self.timings["load_s"] = round(time.perf_counter() - start, 3)
+                self.timings["ready_after_start_s"] = round(time.perf_counter() - PROCESS_START, 3)
+        return self._module
+
+    def answer(self, query: str) -> dict:
+        agent = self.load()
+        from spark_session import reset_spark_time, spark_time
+
+        reset_spark_time()
+        start = time.perf_counter()
+        try:
+            answer = agent.answer_query(query)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.queries += 1
+        result = {
+            "answer": str(answer),
+            "latency_s": round(time.perf_counter() - start, 3),
+            "spark_s": round(spark_time(), 3),
+        }
+        if self.timings["first_answer_s"] is None:
+            self.timings["first_answer_s"] = round(time.perf_counter() - PROCESS_START, 3)
+        return result
+
+    def stats(self) -> dict:
+        stats = {
+            "ready": self._module is not None,
+            "uptime_s": round(time.perf_counter() - PROCESS_START, 3),
+            "queries": self.queries,
+            "errors": self.errors,
+            **self.timings,
+        }
+        if self._module is not None:
+            from model_usage import model_usage
+            from tool_metrics import tool_metrics
+            from tools import cursor_store, query_flights
+
+            stats["tools"] = tool_metrics.summary()
+            stats["models"] = model_usage.summary()
+            stats["plan_cache"] = self._module.plan_cache.stats()
+            stats["router"] = self._module.router.stats()
+            stats["cursors"] = cursor_store.stats()
+            stats["single_flight"] = query_flights.stats()
+        return stats
+
+
+runtime = AgentRuntime()
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health -> {"ok": true}
+    GET  /stats  -> startup timings and counters
+    POST /query  {"query": "..."} -> {"answer": ..., "latency_s": ..., "spark_s": ...}
+    """
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"ok": True})
+        elif self.path == "/stats":
+            self._reply(200, runtime.stats())
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            query = json.loads(self.rfile.read(length))["query"]
+        except (ValueError, KeyError):
+            self._reply(400, {"error": 'body must be JSON like {"query": "..."}'})
+            return
+        try:
+            self._reply(200, runtime.answer(query))
+        except Exception as e:
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # client_address is empty for unix sockets, so don't use the default formatter
+        print(f"{self.command} {self.path} :: " + format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(host: str = SERVER_HOST, port: int = SERVER_PORT, socket_path: str = SERVER_SOCKET):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, AgentRequestHandler)
+    return ThreadingHTTPServer((host, port), AgentRequestHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the agent warm and answer queries over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--socket", default=SERVER_SOCKET, help="serve on this unix socket instead of host:port")
+    parser.add_argument("--lazy", action="store_true", help="load the agent on the first query instead of at startup")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.socket)
+    if not args.lazy:
+        threading.Thread(target=runtime.load, daemon=True).start()
+    print(f"agent server listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
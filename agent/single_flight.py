@@ -0,0 +1,105 @@
+import threading
+from typing import Any, Callable
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "cancelled", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        self.cancelled = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs a function once for concurrent calls with the same key.
+
+    The first caller of do() for a key (the leader) runs the function;
+    callers arriving while it runs wait for it and get the same result, or
+    the same exception raised again. Nothing is kept once the call returns:
+    later calls run again (reusing finished results is the result cache's
+    job).
+
+    A leader that is cancelled instead of failing (an interrupt, or an error
+    `is_cancellation` recognizes, eg. a killed spark job) doesn't cancel its
+    waiters: they start over and one of them becomes the new leader. A
+    waiter that stops waiting after `timeout` seconds raises TimeoutError;
+    the leader and the other waiters carry on.
+    """
+
+    def __init__(self, is_cancellation: Callable[[BaseException], bool] | None = None):
+        self.is_cancellation = is_cancellation or (lambda error: not isinstance(error, Exception))
+        self._flights: dict[Any, _Flight] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+        self.shared_errors = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.max_waiters = 0
+
+    def do(self, key: Any, fn: Callable[[], Any], timeout: float | None = None) -> tuple[Any, bool]:
+        """(fn()'s result, whether it came from another caller's run)."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    self.executions += 1
+                    leader = True
+                else:
+                    flight.waiters += 1
+                    self.max_waiters = flight.waiters if flight.waiters > self.max_waiters else self.max_waiters
+                    leader = False
+
+            if leader:
+                return self._lead(key, flight, fn), False
+
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    flight.waiters -= 1
+                    self.timeouts += 1
+                raise TimeoutError(f"gave up after waiting {timeout}s for an identical query already running")
+            if flight.cancelled:
+                # the leader was cancelled, not us: run it again
+                continue
+            with self._lock:
+                self.coalesced += 1
+                if flight.error is not None:
+                    self.shared_errors += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "shared_errors": self.shared_errors,
+                "cancelled": self.cancelled,
+                "timeouts": self.timeouts,
+                "in_flight": len(self._flights),
+                "max_waiters": self.max_waiters,
+            }
+
+    def _lead(self, key: Any, flight: _Flight, fn: Callable[[], Any]) -> Any:
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            if self.is_cancellation(e):
+                flight.cancelled = True
+                with self._lock:
+                    self.cancelled += 1
+            else:
+                flight.error = e
+            raise
+        finally:
+            # off the table before waking the waiters, so a waiter that starts over leads a new flight
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
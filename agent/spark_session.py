@@ -0,0 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from config import (
+    SPARK_APP_NAME,
+    SPARK_HEALTH_CHECK_SECONDS,
+    SPARK_POOL_SIZE,
+    SPARK_POOL_TIMEOUT_SECONDS,
+    SPARK_REMOTE,
+)
+
+
+class SparkSessionPool:
+    """
+    Bounded pool of spark sessions, created lazily on first use.
+
+    `remote` is either a spark connect url ('sc://host:port'), in which case
+    every pooled session is its own spark connect session, or a local master
+    ('local[*]'), in which case the pooled sessions are `newSession()`s of one
+    local pyspark session. A custom `factory` can be passed instead.
+
+    Sessions idle for longer than `health_check_seconds` are pinged before
+    being handed out and replaced if the ping fails. A session whose borrower
+    raised is pinged on return and dropped if it no longer answers, so the
+    next borrower reconnects.
+    """
+
+    def __init__(
+        self,
+        remote: str = SPARK_REMOTE,
+        app_name: str = SPARK_APP_NAME,
+        max_sessions: int = SPARK_POOL_SIZE,
+        health_check_seconds: float = SPARK_HEALTH_CHECK_SECONDS,
+        timeout_seconds: float = SPARK_POOL_TIMEOUT_SECONDS,
+        factory: Callable[[], "SparkSession"] | None = None,
+    ):
+        self.remote = remote
+        self.app_name = app_name
+        self.max_sessions = max_sessions
+        self.health_check_seconds = health_check_seconds
+        self.timeout_seconds = timeout_seconds
+        self.factory = factory or self._connect
+        self._idle: list[tuple["SparkSession", float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.created = 0
+        self.reconnects = 0
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow a session for the duration of the `with` block.
+
+        Example:
+            with pool.session() as spark:
+                spark.sql("select 1").collect()
+        """
+        spark = self._acquire()
+        healthy = True
+        start = time.perf_counter()
+        try:
+            yield spark
+        except Exception:
+            healthy = self._ping(spark)
+            raise
+        finally:
+            _spark_time.seconds = spark_time() + time.perf_counter() - start
+            self._release(spark, healthy)
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for spark, _ in idle:
+            self._stop(spark)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "reconnects": self.reconnects,
+            }
+
+    # ---- internals -----------------------------------------------------
+
+    def _acquire(self) -> "SparkSession":
+        deadline = time.monotonic() + self.timeout_seconds
+        with self._cond:
+            while not self._idle and self._size >= self.max_sessions:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No spark session available after {self.timeout_seconds}s "
+                        f"(pool size {self.max_sessions})"
+                    )
+                self._cond.wait(remaining)
+            if self._idle:
+                spark, idle_since = self._idle.pop()
+            else:
+                spark, idle_since = None, None
+                self._size += 1
+
+        if spark is None:
+            return self._create()
+
+        if time.monotonic() - idle_since > self.health_check_seconds and not self._ping(spark):
+            self._stop(spark)
+            with self._cond:
+                self.reconnects += 1
+            return self._create()
+        return spark
+
+    def _create(self) -> "SparkSession":
+        try:
+            spark = self.factory()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return spark
+
+    def _release(self, spark: "SparkSession", healthy: bool) -> None:
+        with self._cond:
+            if healthy:
+                self._idle.append((spark, time.monotonic()))
+            else:
+                self._size -= 1
+                self.reconnects += 1
+            self._cond.notify()
+        if not healthy:
+            self._stop(spark)
+
+    def _connect(self) -> "SparkSession":
+        from pyspark.sql import SparkSession
+
+        if self.remote.startswith("sc://"):
+            return SparkSession.builder.remote(self.remote).appName(self.app_name).create()
+        base = SparkSession.builder.master(self.remote).appName(self.app_name).getOrCreate()
+        return base.newSession()
+
+    def _ping(self, spark: "SparkSession") -> bool:
+        try:
+            spark.sql("select 1").collect()
+            return True
+        except Exception:
+            return False
+
+    def _stop(self, spark: "SparkSession") -> None:
+        # local sessions share one SparkContext, stopping one would stop them all
+        if not type(spark).__module__.startswith("pyspark.sql.connect"):
+            return
+        try:
+            spark.stop()
+        except Exception:
+            pass
+
+
+# seconds the current thread has spent holding a spark session, see spark_time()
+_spark_time = threading.local()
+
+_pool: SparkSessionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SparkSessionPool:
+    """Process wide session pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SparkSessionPool()
+        return _pool
+
+
+def configure_spark(remote: str | None = None, factory: Callable[[], "SparkSession"] | None = None, **kwargs) -> SparkSessionPool:
+    """
+    Replace the process wide pool, eg. to point the tools at a local pyspark session.
+
+    Example:
+        configure_spark(remote="local[2]")
+        configure_spark(factory=lambda: my_local_spark.newSession())
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = SparkSessionPool(remote=remote or SPARK_REMOTE, factory=factory, **kwargs)
+        return _pool
+
+
+def spark_session():
+    """Borrow a session from the process wide pool; use as `with spark_session() as spark:`"""
+    return get_pool().session()
+
+
+def spark_time() -> float:
+    """Seconds the current thread spent inside `spark_session()` blocks since reset_spark_time()."""
+    return getattr(_spark_time, "seconds", 0.0)
+
+
+def reset_spark_time() -> None:
+    _spark_time.seconds = 0.0
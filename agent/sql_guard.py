@@ -0,0 +1,173 @@
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.scope import Scope, ScopeType, traverse_scope
+
+from config import DEFAULT_PARTITION_FILTERS, PARTITION_COLUMNS, PARTITION_GUARD_MODE
+from sql_utils import DIALECT
+
+
+class QueryRejected(ValueError):
+    """Raised for queries that must not reach spark; the message is meant for the agent."""
+
+
+def prepare_query(query: str, max_rows: int) -> tuple[str, list[str]]:
+    """
+    Validate and rewrite an agent query before it is sent to spark.
+
+    - only a single SELECT (or WITH ... SELECT / UNION) statement is accepted
+    - scans of partitioned tables must filter on every partition column; a
+      missing filter is rejected or, in 'inject' mode, replaced by the
+      configured default filter
+    - the outermost query is limited to `max_rows`
+
+    Returns the rewritten query and notes about what was changed.
+    Raises QueryRejected with an actionable message otherwise.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(query, read=DIALECT) if s is not None]
+    except sqlglot.errors.SqlglotError as e:
+        raise QueryRejected(f"Could not parse query: {e}")
+    if len(statements) != 1:
+        raise QueryRejected("Only a single SQL statement is allowed per call.")
+    expression = statements[0]
+    if not isinstance(expression, exp.Query):
+        raise QueryRejected("Only SELECT queries are allowed for security reasons.")
+
+    notes = guard_partitions(expression)
+    expression = apply_outer_limit(expression, max_rows)
+    return expression.sql(dialect=DIALECT), notes
+
+
+def guard_partitions(
+    expression: exp.Expression,
+    partition_columns: dict[str, list[str]] = PARTITION_COLUMNS,
+    mode: str = PARTITION_GUARD_MODE,
+    default_filters: dict[str, str] = DEFAULT_PARTITION_FILTERS,
+) -> list[str]:
+    """
+    Check every SELECT scope that reads a partitioned table for filters on its
+    partition columns. A CTE or subquery that selects a partition column
+    unchanged may leave its filter to the queries reading it, when all of them
+    filter on it (spark pushes those filters down to the scan). Modifies
+    `expression` in place when filters are injected. Returns a note per
+    injected filter.
+    """
+    notes = []
+    scopes = traverse_scope(expression)
+    for scope in scopes:
+        select = scope.expression
+        if not isinstance(select, exp.Select):
+            continue
+        for alias, source in scope.sources.items():
+            if not isinstance(source, exp.Table):
+                continue
+            required = _partition_columns_for(source, partition_columns)
+            if not required:
+                continue
+            filtered = _filtered_columns(select, alias)
+            missing = [
+                column for column in required
+                if column not in filtered and not _filtered_by_readers(scopes, scope, column)
+            ]
+            if not missing:
+                continue
+
+            table_name = ".".join(part.name for part in source.parts)
+            injectable = [column for column in missing if column in default_filters]
+            if mode != "inject" or len(injectable) != len(missing):
+                example = " and ".join(_example_filter(column) for column in required)
+                where = ""
+                if scope.scope_type in (ScopeType.CTE, ScopeType.DERIVED_TABLE):
+                    where = (
+                        " inside the CTE/subquery that reads it (or select them unchanged and filter"
+                        " on them in every query reading the CTE/subquery)"
+                    )
+                raise QueryRejected(
+                    f"Query scans partitioned table {table_name} without a filter on "
+                    f"{', '.join(missing)}. Add partition filters{where}, eg. `where {example}`."
+                )
+            for column in missing:
+                condition = sqlglot.condition(default_filters[column], dialect=DIALECT)
+                if len(scope.sources) > 1:
+                    for col in condition.find_all(exp.Column):
+                        col.set("table", exp.to_identifier(alias))
+                select.where(condition, copy=False)
+                notes.append(f"added default partition filter on {table_name}: {condition.sql(dialect=DIALECT)}")
+    return notes
+
+
+def apply_outer_limit(expression: exp.Query, max_rows: int) -> exp.Query:
+    """Make sure the outermost query returns at most `max_rows` rows."""
+    limit = expression.args.get("limit")
+    if limit is None:
+        return expression.limit(max_rows, copy=False)
+    value = limit.expression
+    if isinstance(value, exp.Literal) and value.is_int:
+        if int(value.name) > max_rows:
+            limit.set("expression", exp.Literal.number(max_rows))
+        return expression
+    # non constant limit, eg. LIMIT (select ...): cap it from outside
+    return exp.select("*").from_(expression.subquery("limited")).limit(max_rows)
+
+
+def _partition_columns_for(table: exp.Table, partition_columns: dict[str, list[str]]) -> list[str]:
+    full_name = ".".join(part.name for part in table.parts).lower()
+    for pattern, columns in partition_columns.items():
+        pattern = pattern.lower()
+        if full_name == pattern or full_name.endswith("." + pattern) or table.name.lower() == pattern:
+            return [column.lower() for column in columns]
+    return []
+
+
+def _filtered_columns(select: exp.Select, alias: str) -> set[str]:
+    """Lower-cased names of the columns of `alias` used in the WHERE or JOIN ON conditions of `select`."""
+    conditions = []
+    if select.args.get("where") is not None:
+        conditions.append(select.args["where"])
+    for join in select.args.get("joins") or []:
+        if join.args.get("on") is not None:
+            conditions.append(join.args["on"])
+    columns = set()
+    for condition in conditions:
+        for column in condition.find_all(exp.Column):
+            if not column.table or column.table.lower() == alias.lower():
+                columns.add(column.name.lower())
+    return columns
+
+
+def _filtered_by_readers(scopes: list[Scope], scope: Scope, column: str) -> bool:
+    """Whether `scope` is a CTE or subquery passing `column` through and every query reading it filters on it."""
+    if scope.scope_type not in (ScopeType.CTE, ScopeType.DERIVED_TABLE) or not _passes_through(scope.expression, column):
+        return False
+    readers = [
+        (reader, alias)
+        for reader in scopes
+        for alias, (_, source) in reader.selected_sources.items()
+        if source is scope
+    ]
+    return bool(readers) and all(
+        isinstance(reader.expression, exp.Select)
+        and (column in _filtered_columns(reader.expression, alias) or _filtered_by_readers(scopes, reader, column))
+        for reader, alias in readers
+    )
+
+
+def _passes_through(select: exp.Expression, column: str) -> bool:
+    """Whether `select` outputs `column` unchanged, so that a filter on its output can be pushed down to its input."""
+    if not isinstance(select, exp.Select) or select.args.get("limit") is not None or select.find(exp.Window):
+        return False
+    for projection in select.expressions:
+        if isinstance(projection, exp.Star) or (isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star)):
+            return True
+        value = projection.unalias()
+        if isinstance(value, exp.Column) and value.name.lower() == column and projection.alias_or_name.lower() == column:
+            return True
+    return False
+
+
+def _example_filter(column: str) -> str:
+    if column == "eventtimeunix":
+        return "date(eventtimeunix) = '2025-01-01'"
+    if column == "isocode":
+        return "isocode = 'RU'"
+    return f"{column} = <value>"
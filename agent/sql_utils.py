@@ -0,0 +1,67 @@
+import sqlglot
+from sqlglot import exp
+
+DIALECT = "spark"
+
+# functions whose result changes between runs; queries using them are never cached
+_NON_DETERMINISTIC = (
+    exp.CurrentDate,
+    exp.CurrentDatetime,
+    exp.CurrentTime,
+    exp.CurrentTimestamp,
+    exp.Rand,
+    exp.Randn,
+)
+_NON_DETERMINISTIC_NAMES = {"now", "uuid", "shuffle", "unix_timestamp", "monotonically_increasing_id"}
+
+
+def parse_sql(query: str) -> exp.Expression | None:
+    """
+    Parse a single spark sql statement.
+    Returns None when the query can't be parsed.
+    """
+    try:
+        return sqlglot.parse_one(query, read=DIALECT)
+    except sqlglot.errors.SqlglotError:
+        return None
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Canonical form of a query: keywords upper-cased, identifiers lower-cased,
+    whitespace collapsed. String literals are left untouched.
+    Falls back to whitespace collapsing for queries the parser can't read.
+    """
+    expression = parse_sql(query)
+    if expression is None:
+        return " ".join(query.replace(";", " ").split())
+    return expression.sql(dialect=DIALECT, normalize=True)
+
+
+def referenced_tables(query: str) -> list[str]:
+    """
+    Sorted, lower-cased names of every table a query reads, without CTE names.
+    eg. ['prod_catalog.adtech_db.base']
+    """
+    expression = parse_sql(query)
+    if expression is None:
+        return []
+    ctes = {cte.alias.lower() for cte in expression.find_all(exp.CTE)}
+    tables = set()
+    for table in expression.find_all(exp.Table):
+        name = ".".join(part.name for part in table.parts).lower()
+        if name and name not in ctes:
+            tables.add(name)
+    return sorted(tables)
+
+
+def is_deterministic(query: str) -> bool:
+    expression = parse_sql(query)
+    if expression is None:
+        return False
+    for node in expression.walk():
+        if isinstance(node, _NON_DETERMINISTIC):
+            return False
+        if isinstance(node, exp.Anonymous) and node.name.lower() in _NON_DETERMINISTIC_NAMES:
+            return False
+    return True
@@ -0,0 +1,189 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, SpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import StatusCode
+
+from config import (
+    TELEMETRY_BATCH_SIZE,
+    TELEMETRY_ENDPOINT,
+    TELEMETRY_EXPORT_DELAY_MS,
+    TELEMETRY_HEAD_SAMPLE_RATE,
+    TELEMETRY_MAX_PENDING_TRACES,
+    TELEMETRY_MODE,
+    TELEMETRY_PROJECT_NAME,
+    TELEMETRY_QUEUE_SIZE,
+    TELEMETRY_SLOW_SECONDS,
+    TELEMETRY_TAIL_SAMPLE_RATE,
+)
+
+MODES = ("off", "sync", "batch")
+_TRACE_ID_LIMIT = 2**64
+
+
+class TailSamplingProcessor(SpanProcessor):
+    """
+    Hold the spans of each trace until its root span ends, then pass all of
+    them to `downstream` or drop them.
+
+    Traces with an error (a span with ERROR status or a tool that returned an
+    'Error: ...' string) or whose root took longer than `slow_seconds` are
+    always kept; of the rest, `sample_rate` are kept, chosen by a hash of the
+    trace id so the decision is stable and independent of the head sampler's
+    (which compares the trace id's low bits). At most `max_pending_traces` traces are held; when
+    more are open the oldest is decided early on the spans it has so far.
+    """
+
+    def __init__(self, downstream: SpanProcessor, sample_rate: float, slow_seconds: float, max_pending_traces: int):
+        self.downstream = downstream
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.max_pending_traces = max_pending_traces
+        self._pending: OrderedDict[int, list[ReadableSpan]] = OrderedDict()
+        self._errors: set[int] = set()
+        self._lock = threading.Lock()
+        self.kept = 0
+        self.dropped = 0
+        self.kept_errors = 0
+        self.kept_slow = 0
+        self.evicted = 0
+
+    def on_start(self, span, parent_context=None) -> None:
+        pass
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        decide = []
+        with self._lock:
+            self._pending.setdefault(trace_id, []).append(span)
+            if span.status.status_code == StatusCode.ERROR or span.attributes.get("oracle.tool.error"):
+                self._errors.add(trace_id)
+            if span.parent is None or span.parent.is_remote:
+                decide.append((trace_id, self._pending.pop(trace_id), span))
+            while len(self._pending) > self.max_pending_traces:
+                oldest, spans = self._pending.popitem(last=False)
+                self.evicted += 1
+                decide.append((oldest, spans, None))
+        for trace_id, spans, root in decide:
+            if self._keep(trace_id, root):
+                for pending_span in spans:
+                    self.downstream.on_end(pending_span)
+
+    def _keep(self, trace_id: int, root: ReadableSpan | None) -> bool:
+        with self._lock:
+            error = trace_id in self._errors
+            self._errors.discard(trace_id)
+            slow = root is not None and (root.end_time - root.start_time) / 1e9 >= self.slow_seconds
+            sampled = _trace_hash(trace_id) < self.sample_rate * _TRACE_ID_LIMIT
+            keep = error or slow or sampled
+            self.kept += keep
+            self.dropped += not keep
+            self.kept_errors += error
+            self.kept_slow += slow and not error
+        return keep
+
+    def shutdown(self) -> None:
+        self.downstream.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.downstream.force_flush(timeout_millis)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kept": self.kept,
+                "dropped": self.dropped,
+                "kept_errors": self.kept_errors,
+                "kept_slow": self.kept_slow,
+                "evicted": self.evicted,
+                "pending": len(self._pending),
+            }
+
+
+def _trace_hash(trace_id: int) -> int:
+    """64 bit hash of a trace id, uncorrelated with the id's bits that TraceIdRatioBased samples on."""
+    digest = hashlib.blake2b(trace_id.to_bytes(16, "big"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+_provider: TracerProvider | None = None
+_tail: TailSamplingProcessor | None = None
+_mode: str | None = None
+_setup_lock = threading.Lock()
+
+
+def setup_telemetry(
+    mode: str = TELEMETRY_MODE,
+    exporter: SpanExporter | None = None,
+    head_sample_rate: float = TELEMETRY_HEAD_SAMPLE_RATE,
+    tail_sample_rate: float = TELEMETRY_TAIL_SAMPLE_RATE,
+    slow_seconds: float = TELEMETRY_SLOW_SECONDS,
+) -> TracerProvider | None:
+    """
+    Install the process wide tracer provider and instrument smolagents.
+
+    - 'off': nothing is installed; tool spans go to the no-op tracer.
+    - 'sync': every kept span is exported to phoenix as it ends, on the
+      caller's thread.
+    - 'batch': kept spans are queued (bounded, TELEMETRY_QUEUE_SIZE; spans
+      beyond it are dropped) and exported in the background.
+
+    Spans go to phoenix over OTLP unless another `exporter` is given (eg. an
+    InMemorySpanExporter in tests). Only the first call configures anything,
+    later calls return the installed provider.
+    """
+    global _provider, _tail, _mode
+    if mode not in MODES:
+        raise ValueError(f"telemetry mode must be one of {MODES}, got {mode!r}")
+    with _setup_lock:
+        if _mode is not None:
+            return _provider
+        _mode = mode
+        if mode == "off":
+            return None
+
+        if exporter is None:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            exporter = OTLPSpanExporter(endpoint=TELEMETRY_ENDPOINT)
+        if mode == "batch":
+            export = BatchSpanProcessor(
+                exporter,
+                max_queue_size=TELEMETRY_QUEUE_SIZE,
+                max_export_batch_size=TELEMETRY_BATCH_SIZE,
+                schedule_delay_millis=TELEMETRY_EXPORT_DELAY_MS,
+            )
+        else:
+            export = SimpleSpanProcessor(exporter)
+        if tail_sample_rate < 1.0:
+            _tail = TailSamplingProcessor(export, tail_sample_rate, slow_seconds, TELEMETRY_MAX_PENDING_TRACES)
+            export = _tail
+
+        _provider = TracerProvider(
+            sampler=ParentBased(TraceIdRatioBased(head_sample_rate)),
+            resource=Resource.create({"openinference.project.name": TELEMETRY_PROJECT_NAME}),
+        )
+        _provider.add_span_processor(export)
+        trace.set_tracer_provider(_provider)
+
+        from openinference.instrumentation.smolagents import SmolagentsInstrumentor
+
+        SmolagentsInstrumentor().instrument(tracer_provider=_provider)
+        return _provider
+
+
+def telemetry_stats() -> dict:
+    stats = {"mode": _mode}
+    if _tail is not None:
+        stats["tail_sampling"] = _tail.stats()
+    return stats
+
+
+def flush_telemetry(timeout_millis: int = 30000) -> bool:
+    """Export everything still queued, eg. before a short lived process exits."""
+    return _provider.force_flush(timeout_millis) if _provider is not None else True
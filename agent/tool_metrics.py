@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import defaultdict
+
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+
+from spark_session import spark_time
+
+ATTRIBUTE_PREFIX = "oracle."
+# attributes summed into the per tool summary
+SUMMED = ("rows", "rows_scanned", "bytes_scanned", "files_scanned", "cache_hits", "cache_misses", "coalesced", "output_tokens")
+
+# metric keys of spark scan nodes: file sources and iceberg (BatchScan) custom metrics
+_ROWS_KEYS = ("numOutputRows",)
+_FILES_KEYS = ("numFiles", "resultDataFiles")
+_BYTES_KEYS = ("filesSize", "totalFileSize")
+
+_current = threading.local()
+
+
+class ToolMetrics:
+    """Per tool totals of every instrumented call in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = defaultdict(lambda: {"calls": 0, "errors": 0, "seconds": 0.0, "spark_seconds": 0.0, **dict.fromkeys(SUMMED, 0)})
+
+    def add(self, tool_name: str, seconds: float, spark_seconds: float, error: bool, attributes: dict) -> None:
+        with self._lock:
+            totals = self._tools[tool_name]
+            totals["calls"] += 1
+            totals["errors"] += int(error)
+            totals["seconds"] += seconds
+            totals["spark_seconds"] += spark_seconds
+            for key in SUMMED:
+                totals[key] += attributes.get(key, 0)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                name: {key: round(value, 3) if isinstance(value, float) else value for key, value in totals.items()}
+                for name, totals in self._tools.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tools.clear()
+
+
+tool_metrics = ToolMetrics()
+
+
+def instrumented(tool):
+    """
+    Wrap a smolagents tool so every call runs in an `oracle.tool.<name>` span.
+
+    The span carries the SQL, spark time, rows returned, bytes/files scanned,
+    cache hits/misses and the output size in tokens, as reported by the tool
+    through `record()` / `add()`, and the same numbers are summed in
+    `tool_metrics`. Spans go to whatever tracer provider is installed (phoenix,
+    an in-memory exporter in tests, or the no-op default).
+
+    Example:
+        @instrumented
+        @tool
+        def sql_query_to_str(query: str) -> str:
+            ...
+    """
+    # render reports rows and scan metrics back through record()/add(), import it late
+    from render import estimate_tokens
+
+    forward = tool.forward
+
+    def instrumented_forward(*args, **kwargs):
+        tracer = trace.get_tracer(__name__)
+        with tracer.start_as_current_span(f"oracle.tool.{tool.name}") as span:
+            parent, _current.attributes = getattr(_current, "attributes", None), {}
+            spark_before = spark_time()
+            start = time.perf_counter()
+            error = False
+            try:
+                output = forward(*args, **kwargs)
+                error = isinstance(output, str) and output.startswith("Error:")
+                _current.attributes["output_tokens"] = estimate_tokens(str(output))
+                return output
+            except Exception as e:
+                error = True
+                span.record_exception(e)
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                raise
+            finally:
+                attributes = _current.attributes
+                _current.attributes = parent
+                seconds = time.perf_counter() - start
+                spark_seconds = spark_time() - spark_before
+                span.set_attributes({
+                    f"{ATTRIBUTE_PREFIX}tool.name": tool.name,
+                    f"{ATTRIBUTE_PREFIX}tool.error": error,
+                    f"{ATTRIBUTE_PREFIX}spark_seconds": round(spark_seconds, 6),
+                    **{f"{ATTRIBUTE_PREFIX}{key}": value for key, value in attributes.items()},
+                })
+                tool_metrics.add(tool.name, seconds, spark_seconds, error, attributes)
+                calls = getattr(_current, "run_calls", None)
+                if calls is not None and parent is None:
+                    calls.append({"tool": tool.name, "error": error, **attributes})
+
+    tool.forward = instrumented_forward
+    return tool
+
+
+def begin_run() -> None:
+    """Start logging this thread's tool calls, see run_calls()."""
+    _current.run_calls = []
+
+
+def run_calls() -> list[dict]:
+    """Tool calls made by this thread since begin_run(), oldest first: {"tool", "error", "sql", "rows", ...}."""
+    return list(getattr(_current, "run_calls", None) or [])
+
+
+def is_recording() -> bool:
+    """True inside an instrumented tool call, so callers can skip collecting metrics nobody reads."""
+    return getattr(_current, "attributes", None) is not None
+
+
+def record(**attributes) -> None:
+    """Set attributes (eg. sql=...) on the instrumented tool call running in this thread, if any."""
+    current = getattr(_current, "attributes", None)
+    if current is not None:
+        current.update(attributes)
+
+
+def add(**counters) -> None:
+    """Add to counters (eg. cache_hits=1) of the instrumented tool call running in this thread, if any."""
+    current = getattr(_current, "attributes", None)
+    if current is not None:
+        for key, value in counters.items():
+            current[key] = current.get(key, 0) + value
+
+
+def scan_totals(nodes) -> dict:
+    """
+    Rows, bytes and files read by the scan nodes among `nodes`, an iterable
+    of (node name, {metric key: value}).
+    """
+    totals = {"rows_scanned": 0, "bytes_scanned": 0, "files_scanned": 0}
+    for name, metrics in nodes:
+        if not name.startswith(("Scan", "BatchScan")):
+            continue
+        for keys, total in ((_ROWS_KEYS, "rows_scanned"), (_BYTES_KEYS, "bytes_scanned"), (_FILES_KEYS, "files_scanned")):
+            totals[total] += sum(int(metrics[key]) for key in keys if key in metrics)
+    return totals
+
+
+def connect_scan_metrics(plan_metrics: list) -> dict:
+    """Scan totals from the PlanMetrics spark connect sends at the end of a result stream."""
+    return scan_totals((m.name, {value.name: value.value for value in m.metrics}) for m in plan_metrics)
+
+
+def classic_scan_metrics(df) -> dict:
+    """Scan totals from the executed plan of a classic (local) DataFrame that has been collected."""
+    return scan_totals(_plan_nodes(df._jdf.queryExecution().executedPlan()))
+
+
+def _plan_nodes(plan):
+    name = plan.getClass().getSimpleName()
+    if name == "AdaptiveSparkPlanExec":
+        yield from _plan_nodes(plan.executedPlan())
+        return
+    if name.endswith("QueryStageExec"):
+        yield from _plan_nodes(plan.plan())
+        return
+    metrics, entries = {}, plan.metrics().iterator()
+    while entries.hasNext():
+        entry = entries.next()
+        metrics[entry._1()] = entry._2().value()
+    yield plan.nodeName(), metrics
+    children = plan.children()
+    for i in range(children.size()):
+        yield from _plan_nodes(children.apply(i))
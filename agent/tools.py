@@ -1,15 +1,227 @@
-from sqlalchemy import create_engine, text
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import *
+from pyspark.sql.pandas.types import to_arrow_schema
 from smolagents import tool
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import datetime
+import re
 
-# Spark
-session_name = f"Oracle"
-spark = SparkSession.builder.remote(
-    "sc://spark-connect-test.tail7cdba.ts.net"
-).appName(session_name).getOrCreate()
+from config import (
+    APPROX_RSD,
+    COST_CACHE_TTL_SECONDS,
+    COST_GUARD_ENABLED,
+    CURSOR_DIR,
+    CURSOR_DISK_MAX_BYTES,
+    CURSOR_MAX_BYTES,
+    CURSOR_MAX_ROWS,
+    CURSOR_MEMORY_MAX_BYTES,
+    CURSOR_TTL_SECONDS,
+    DROPS_MAX_ROWS,
+    DROPS_MIN_DROP,
+    DROPS_TIME_COLUMN,
+    DROPS_Z_THRESHOLD,
+    GEO_CELL_COLUMN,
+    GEO_CELL_PRECISION,
+    GEO_ENTITY_COLUMN,
+    GEO_ISOCODE_COLUMN,
+    GEO_LAT_COLUMN,
+    GEO_LON_COLUMN,
+    GEO_TIME_COLUMN,
+    MAX_SCAN_BYTES,
+    METADATA_CACHE_MAX_ENTRIES,
+    METADATA_CACHE_PATH,
+    METADATA_CACHE_TTL_SECONDS,
+    PROFILE_STORE_PATH,
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    ROLLUPS_ENABLED,
+    SCHEMA_INDEX_PATH,
+    SINGLE_FLIGHT_ENABLED,
+    SNAPSHOT_TTL_SECONDS,
+)
+from anomaly import STEPS, find_drops, volume_matrix
+from approx import approximate_query, exact_reason
+from column_profiles import ColumnProfileStore
+from cost import CostEstimationError, describe_estimate, parse_explain_cost
+from cursors import CursorNotFound, CursorStore
+from geo import build_radius_query
+from metadata_cache import MetadataCache
+from render import iter_arrow_batches, render_arrow, render_df
+from result_cache import ResultCache
+from rollup import rewrite_for_rollup, rollup_state
+from schema_index import SchemaIndex
+from single_flight import SingleFlight
+from spark_session import spark_session
+from sql_guard import QueryRejected, prepare_query
+from sql_utils import DIALECT, is_deterministic, normalize_sql, parse_sql, referenced_tables
+from tool_metrics import add as add_tool_metrics, instrumented, record
 
+# Metadata cache shared by the catalog/schema tools
+metadata_cache = MetadataCache(
+    ttl_seconds=METADATA_CACHE_TTL_SECONDS,
+    max_entries=METADATA_CACHE_MAX_ENTRIES,
+    path=METADATA_CACHE_PATH or None,
+)
+
+# Rendered results of sql_query_to_str, keyed on normalized sql + table snapshots
+result_cache = ResultCache(max_bytes=RESULT_CACHE_MAX_BYTES, ttl_seconds=RESULT_CACHE_TTL_SECONDS)
+
+# EXPLAIN COST estimates, keyed on normalized sql + table snapshots
+cost_cache = MetadataCache(ttl_seconds=COST_CACHE_TTL_SECONDS, max_entries=METADATA_CACHE_MAX_ENTRIES)
+
+# Per day/partition column statistics, built by `python agent/column_profiles.py`
+column_profiles = ColumnProfileStore(PROFILE_STORE_PATH)
+
+# Query results kept for open_cursor / read_cursor paging
+cursor_store = CursorStore(
+    CURSOR_DIR,
+    ttl_seconds=CURSOR_TTL_SECONDS,
+    max_memory_bytes=CURSOR_MEMORY_MAX_BYTES,
+    max_disk_bytes=CURSOR_DISK_MAX_BYTES,
+)
+
+# Every catalog/database/table/column, built by `python agent/schema_index.py`; also feeds the UI dropdowns
+schema_index = SchemaIndex(SCHEMA_INDEX_PATH)
+
+# spark's own wording for a killed job (classic: SparkException from the DAGScheduler) and error class (spark connect)
+_JOB_CANCELLED = re.compile(r"org\.apache\.spark\.SparkException: (?:Job|Stage) \d+ cancelled\b")
+_CANCELLED_ERROR_CLASSES = {"OPERATION_CANCELED"}
+
+def is_cancellation(error: BaseException) -> bool:
+    """
+    An interrupt (KeyboardInterrupt, SystemExit), or a spark job killed from outside: not the query's fault,
+    so not handed to queries waiting on it. Other errors are, even when their message mentions a cancel column.
+    """
+    if not isinstance(error, Exception):
+        return True
+    get_error_class = getattr(error, "getErrorClass", None)
+    if get_error_class is not None and get_error_class() in _CANCELLED_ERROR_CLASSES:
+        return True
+    return bool(_JOB_CANCELLED.search(str(error)))
+
+# Identical queries already running, shared by concurrent agent runs (UI users, batch workers)
+query_flights = SingleFlight(is_cancellation=is_cancellation)
+
+def run_once(tool_name: str, query: str, run):
+    """
+    run() for `query`, unless `tool_name` is already running the same normalized query
+    for another agent; then wait for that run and return its result (or raise its error).
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return run()
+    result, shared = query_flights.do((tool_name, normalize_sql(query)), run)
+    if shared:
+        add_tool_metrics(coalesced=1)
+    return result
+
+def get_table_snapshot_id(table_name: str) -> int | None:
+    """
+    Current iceberg snapshot id of 'catalog.db.table'.
+    Returns None for tables without snapshot history (eg. views, non-iceberg tables).
+    Looked up at most once every SNAPSHOT_TTL_SECONDS per table.
+    """
+    def load():
+        query = f"""
+            select snapshot_id
+            from {table_name}.history
+            where is_current_ancestor
+            order by made_current_at desc
+            limit 1
+        """
+        try:
+            with spark_session() as spark:
+                result = spark.sql(query).collect()
+        except Exception:
+            return None
+        return result[0][0] if result else None
+
+    return metadata_cache.get_or_load(
+        ("snapshot", table_name.lower()), load, ttl_seconds=SNAPSHOT_TTL_SECONDS, persist=False
+    )
+
+def estimate_scan(query: str) -> dict:
+    """
+    Estimated bytes/rows scanned by a query, from its `EXPLAIN COST` plan.
+    Raises CostEstimationError when spark can't plan the query.
+    """
+    tables = referenced_tables(query)
+
+    def load():
+        with spark_session() as spark:
+            plan = spark.sql(f"EXPLAIN COST {query}").collect()[0][0]
+        return parse_explain_cost(plan)
+
+    return cost_cache.get_or_load(
+        ("cost", normalize_sql(query)),
+        load,
+        snapshot_id=lambda: [get_table_snapshot_id(table) for table in tables],
+    )
+
+def route_to_rollup(query: str) -> tuple[str, str] | None:
+    """
+    (query rewritten over a daily rollup, rollup table name) when the rollup can
+    answer `query` and is up to date with its source's current snapshot, else None.
+    """
+    if not ROLLUPS_ENABLED:
+        return None
+    expression = parse_sql(query)
+    routed = rewrite_for_rollup(expression) if expression is not None else None
+    if routed is None:
+        return None
+    rewritten, source, rollup = routed
+
+    def load():
+        with spark_session() as spark:
+            return rollup_state(spark, rollup)
+
+    state = metadata_cache.get_or_load(("rollup_state", rollup), load, ttl_seconds=SNAPSHOT_TTL_SECONDS, persist=False)
+    snapshot = get_table_snapshot_id(source)
+    if state is None or state != ("" if snapshot is None else str(snapshot)):
+        return None
+    return rewritten.sql(dialect=DIALECT), rollup
+
+def result_key(query: str) -> tuple:
+    """Cache key of a query's result: its normalized sql and the current snapshot of every table it reads."""
+    snapshots = tuple((table, get_table_snapshot_id(table)) for table in referenced_tables(query))
+    return normalize_sql(query), snapshots
+
+def list_databases(catalog_name: str) -> list[str]:
+    """Databases of a catalog, listed by spark and kept in the shared metadata cache (also used by the UI)."""
+    def load():
+        query = f"show databases in {catalog_name}"
+        with spark_session() as spark:
+            result = spark.sql(query).collect()
+        return [db[0] for db in result]
+
+    return metadata_cache.get_or_load(("databases", catalog_name.lower()), load)
+
+def list_tables(catalog_name: str, database_name: str) -> list[str]:
+    """Tables of 'catalog.db', listed by spark and kept in the shared metadata cache (also used by the UI)."""
+    def load():
+        query = f"show tables in {catalog_name}.{database_name}"
+        with spark_session() as spark:
+            result = spark.sql(query).collect()
+        return [table[1] for table in result]
+
+    return metadata_cache.get_or_load(("tables", catalog_name.lower(), database_name.lower()), load)
+
+def check_scan_budget(query: str) -> str | None:
+    """Error message for the agent if the query is estimated over MAX_SCAN_BYTES, else None."""
+    if not COST_GUARD_ENABLED:
+        return None
+    try:
+        estimate = estimate_scan(query)
+    except CostEstimationError as e:
+        return f"Error: {e}"
+    if estimate["bytes"] > MAX_SCAN_BYTES:
+        return (
+            f"Error: query refused, {describe_estimate(estimate, MAX_SCAN_BYTES)}. "
+            "Narrow the partition filters (fewer days, a single isocode) and try again."
+        )
+    return None
+
+@instrumented
 @tool
 def get_list_of_tables_in_database(catalog_name: str, database_name: str) -> list[str]:
     """
@@ -20,11 +232,9 @@ def get_list_of_tables_in_database(catalog_name: str, database_name: str) -> lis
         catalog_name: data catalog to use for query
         database_name: database within catalog to use for query
     """
-    query = f"show tables in {catalog_name}.{database_name}"
-    result = spark.sql(query).collect()
-    tables = [table[1] for table in result]
-    return tables
+    return list_tables(catalog_name, database_name)
 
+@instrumented
 @tool
 def get_list_of_databases_in_catalog(catalog_name: str) -> list[str]:
     """
@@ -34,12 +244,10 @@ def get_list_of_databases_in_catalog(catalog_name: str) -> list[str]:
     Args:
         catalog_name: Glue catalog to use for query
     """
-    query = f"show databases in {catalog_name}"
-    result = spark.sql(query).collect()
-    databases = [db[0] for db in result]
-    return databases
+    return list_databases(catalog_name)
 
-@tool 
+@instrumented
+@tool
 def get_table_description_as_str(catalog_name: str, database_name: str, table_name: str) -> str:
     """
     Get the description of a given 'catalog.db.table'.
@@ -53,9 +261,10 @@ def get_table_description_as_str(catalog_name: str, database_name: str, table_na
         table_name: Name of the table to use for query
     """
     query = f"DESCRIBE TABLE EXTENDED {catalog_name}.{database_name}.{table_name}"
-    result = spark.sql(query).toPandas()
-    return result.to_string()
+    with spark_session() as spark:
+        return render_df(spark.sql(query), max_rows=500)
 
+@instrumented
 @tool
 def get_table_columns_and_types_as_list(catalog_name: str, database_name: str, table_name: str) -> list[tuple[str, str]]:
     """
@@ -67,10 +276,56 @@ def get_table_columns_and_types_as_list(catalog_name: str, database_name: str, t
         database_name: Name of the database to use for query
         table_name: Name of the table to use for query
     """
-    query = f"DESCRIBE {catalog_name}.{database_name}.{table_name}"
-    result = spark.sql(query).collect()
-    return [(row.col_name, row.data_type) for row in result]
+    full_table_name = f"{catalog_name}.{database_name}.{table_name}"
+
+    def load():
+        query = f"DESCRIBE {full_table_name}"
+        with spark_session() as spark:
+            result = spark.sql(query).collect()
+        return [(row.col_name, row.data_type) for row in result]
+
+    columns = metadata_cache.get_or_load(
+        ("columns", full_table_name.lower()),
+        load,
+        snapshot_id=lambda: get_table_snapshot_id(full_table_name),
+    )
+    # entries loaded back from the on-disk store come back as lists
+    return [tuple(column) for column in columns]
+
+@instrumented
+@tool
+def search_schema(keywords: str, limit: int = 10) -> str:
+    """
+    Search every catalog, database, table and column at once, in one call instead of listing databases,
+    tables and columns one by one. Matches names exactly, as substrings or fuzzily (eg. 'entity id' finds
+    EntityId), and column/table comments.
+    Returns the best matching 'catalog.db.table' names with their partitioning and matched columns;
+    the top 3 also list all their columns and types.
+
+    Args:
+        keywords: Words to look for, eg. 'latitude longitude' or 'provider isocode base'
+        limit: Maximum number of tables to return. Not required. Default is 10.
+    """
+    results = schema_index.search(keywords, limit=limit)
+    if not results:
+        return f"No tables match '{keywords}'. Use get_list_of_databases_in_catalog to browse instead."
+    lines = [f"-- {len(results)} tables matching '{keywords}', best first"]
+    for rank, result in enumerate(results, start=1):
+        table = schema_index.table(result["name"])
+        partitioning = ", ".join(table["partitioning"]) or "none"
+        line = f"{rank}. {table['name']} (partitioned by {partitioning})"
+        if table["comment"]:
+            line += f" -- {table['comment']}"
+        if result["matched"]:
+            line += f"\n   matched columns: {', '.join(result['matched'])}"
+        if rank <= 3:
+            line += "\n   columns: " + ", ".join(
+                f"{name} {data_type}" + (f" ({comment})" if comment else "") for name, data_type, comment in table["columns"]
+            )
+        lines.append(line)
+    return "\n".join(lines)
 
+@instrumented
 @tool
 def get_table_ddl_as_str(table_name: str) -> str:
     """
@@ -81,9 +336,11 @@ def get_table_ddl_as_str(table_name: str) -> str:
         table_name: Name of the table to inspect; format 'catalog.db.table'
     """
     query = f"show create table {table_name}"
-    tbl_schema = spark.sql(query).collect()
+    with spark_session() as spark:
+        tbl_schema = spark.sql(query).collect()
     return tbl_schema[0][0]
 
+@instrumented
 @tool
 def sample_table_data(table_name: str, where_clause: str = "", limit: int = 10) -> str:
     """
@@ -109,16 +366,23 @@ def sample_table_data(table_name: str, where_clause: str = "", limit: int = 10)
         {where_clause} 
         limit {limit}
     """
+    try:
+        query, notes = prepare_query(query, limit)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
 
-    result = spark.sql(query).toPandas()
-    return result.to_string()
+    with spark_session() as spark:
+        return "\n".join(notes + [render_df(spark.sql(query), max_rows=limit)])
 
+@instrumented
 @tool
-def sql_query_to_str(query: str, max_rows: int = 20) -> str:
+def sql_query_to_str(query: str, max_rows: int = 20, use_cache: bool = True) -> str:
     """
-    Execute a SQL SELECT query and return results as pd.Datafram.to_string() string value
+    Execute a SQL SELECT query and return the results as compact text:
+    a 'column:type' header, one ' | ' separated line per row and a footer with the row count.
     Only SELECT statements are allowed for security.
-    LIMIT is applied to the query if not specified.
+    The outermost query is limited to max_rows rows.
 
     Rules:
         - When querying ANY .base table you must provide a where for eventtimeunix and isocode
@@ -128,20 +392,443 @@ def sql_query_to_str(query: str, max_rows: int = 20) -> str:
     Args:
         query: The SQL SELECT query to execute
         max_rows: Maximum number of rows to return. Not required. Default is 20.
+        use_cache: Reuse the result of an identical earlier query when its tables have not changed since. Set to False to force a fresh run. Not required. Default is True.
     """
     
-    query_upper = query.strip().upper()
+    max_rows = 20 if max_rows > 20 else max_rows
+    try:
+        query, notes = prepare_query(query, max_rows)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
+    routed = route_to_rollup(query)
+    if routed is not None:
+        query, rollup = routed
+        notes.append(f"answered from the daily rollup {rollup}")
+        record(rollup=rollup)
 
-    if not query_upper.startswith('SELECT'):
-        return "Error: Only SELECT queries are allowed for security reasons."
-    
-    if "LIMIT" not in query_upper:
-        max_rows = 20 if max_rows > 20 else max_rows
-        query = query.replace(";", "") + f" LIMIT {max_rows}"
+    cache_key = None
+    if use_cache and RESULT_CACHE_ENABLED and is_deterministic(query):
+        cache_key = result_key(query)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    def run():
+        budget_error = check_scan_budget(query)
+        if budget_error:
+            return budget_error
+        with spark_session() as spark:
+            return render_df(spark.sql(query), max_rows=max_rows, more_rows_hint="; open_cursor pages through all of them")
+
+    rendered = run_once("sql_query_to_str", query, run)
+    if rendered.startswith("Error:"):
+        return rendered
+    result = "\n".join(notes + [rendered])
+
+    if cache_key is not None:
+        result_cache.put(cache_key, result)
+    return result
+
+@instrumented
+@tool
+def open_cursor(query: str, page_size: int = 20) -> str:
+    """
+    Run a SQL SELECT query once and keep its whole result for paging, instead of rerunning it with another LIMIT/OFFSET.
+    Returns a cursor id, the total row count and the first page. Pass the id to read_cursor to get the next pages,
+    or to filter and re-sort the rows, without running the query again.
+    Same rules as sql_query_to_str apply (partition filters on .base tables).
+
+    Args:
+        query: The SQL SELECT query to run
+        page_size: Rows in the first page. Not required. Default is 20.
+    """
+    page_size = 20 if page_size > 20 else page_size
+    try:
+        query, notes = prepare_query(query, CURSOR_MAX_ROWS + 1)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
+    routed = route_to_rollup(query)
+    if routed is not None:
+        query, rollup = routed
+        notes.append(f"answered from the daily rollup {rollup}")
+        record(rollup=rollup)
+
+    key = result_key(query) if is_deterministic(query) else None
+    cursor_id = cursor_store.find(key) if key is not None else None
+    if cursor_id is None:
+        def run():
+            budget_error = check_scan_budget(query)
+            if budget_error:
+                return budget_error, False
+            with spark_session() as spark:
+                df = spark.sql(query)
+                return cursor_store.open(
+                    iter_arrow_batches(df, CURSOR_MAX_ROWS), to_arrow_schema(df.schema), key, CURSOR_MAX_ROWS, CURSOR_MAX_BYTES
+                )
 
-    result = spark.sql(query).toPandas()
-    return result.to_string()
+        cursor_id, cut = run_once("open_cursor", query, run)
+        if cursor_id.startswith("Error:"):
+            return cursor_id
+        if cut:
+            notes.append(f"result cut at the cursor limit ({CURSOR_MAX_ROWS} rows or {CURSOR_MAX_BYTES // 2**20} MB), narrow the query for the rest")
+    return "\n".join(notes + [read_cursor_page(cursor_id, limit=page_size)])
 
+@instrumented
+@tool
+def read_cursor(cursor_id: str, offset: int = 0, limit: int = 20, where_clause: str = "", order_by: str = "", columns: str = "") -> str:
+    """
+    Read a page of a result kept by open_cursor, optionally filtered, sorted or with other columns.
+    Works on the stored rows only, in milliseconds; the query is not run again.
+
+    Args:
+        cursor_id: Cursor id returned by open_cursor, eg. 'c1a2b3c4d'
+        offset: Number of rows to skip. Not required. Default is 0.
+        limit: Maximum number of rows to return. Not required. Default is 20.
+        where_clause: SQL filter on the result's columns, eg. "records > 100". Not required. Default is no filter.
+        order_by: SQL sort on the result's columns, eg. "records desc". Not required. Default is the query's order.
+        columns: Comma separated columns or expressions to return. Not required. Default is all columns.
+    """
+    limit = 20 if limit > 20 else limit
+    offset = 0 if offset < 0 else offset
+    return read_cursor_page(cursor_id, offset, limit, where_clause, order_by, columns)
+
+def read_cursor_page(cursor_id: str, offset: int = 0, limit: int = 20, where: str = "", order_by: str = "", columns: str = "") -> str:
+    try:
+        page, matching, total = cursor_store.read(cursor_id, columns, where, order_by, offset, limit)
+    except CursorNotFound:
+        return f"Error: cursor {cursor_id} expired or does not exist. Run open_cursor again."
+    except ValueError as e:
+        return f"Error: {e}"
+    scope = f"{matching} matching ({total} in the cursor)" if where else f"{total}"
+    first = offset + 1 if page.num_rows else offset
+    header = f"-- cursor {cursor_id}: rows {first}-{offset + page.num_rows} of {scope}"
+    if offset + page.num_rows < matching:
+        header += f", next page offset={offset + page.num_rows}"
+    return header + "\n" + render_arrow(page, max_rows=limit)
+
+@instrumented
+@tool
+def approx_sql_query_to_str(query: str, sample_percent: float = 0.0, max_rows: int = 20) -> str:
+    """
+    Run a SQL SELECT query approximately, for a fast estimate while exploring.
+    COUNT(DISTINCT x) becomes approx_count_distinct and percentile/median become percentile_approx.
+    With sample_percent the table is read with TABLESAMPLE and COUNT/SUM columns are scaled up.
+    Approximated columns get a '<column>_err95' column with their ~95% error bound.
+    SELECT DISTINCT lists are not approximated: the output then starts with '-- exact:'. Count unique values with COUNT(DISTINCT x).
+    Use sql_query_to_str afterwards when the exact answer is worth the cost.
+    Same rules as sql_query_to_str apply (partition filters on .base tables).
+
+    Args:
+        query: The SQL SELECT query to approximate
+        sample_percent: Percent of rows to sample (0-100), only for single table queries. Not required. Default is 0, no sampling.
+        max_rows: Maximum number of rows to return. Not required. Default is 20.
+    """
+    max_rows = 20 if max_rows > 20 else max_rows
+    try:
+        query, notes = prepare_query(query, max_rows)
+        expression = parse_sql(query)
+        approximations = approximate_query(expression, sample_percent=sample_percent, rsd=APPROX_RSD)
+    except (QueryRejected, ValueError) as e:
+        return f"Error: {e}"
+    # say so when nothing was approximated, so the answer isn't presented as an estimate
+    notes += approximations or [exact_reason(expression)]
+    query = expression.sql(dialect=DIALECT)
+    record(sql=query)
+    routed = route_to_rollup(query)
+    if routed is not None:
+        query, rollup = routed
+        notes.append(f"answered from the daily rollup {rollup}")
+        record(rollup=rollup)
+
+    def run():
+        budget_error = check_scan_budget(query)
+        if budget_error:
+            return budget_error
+        with spark_session() as spark:
+            return render_df(spark.sql(query), max_rows=max_rows)
+
+    result = run_once("approx_sql_query_to_str", query, run)
+    if result.startswith("Error:"):
+        return result
+    label = "approximate" if approximations else "exact"
+    return "\n".join([f"-- {label}: {note}" for note in notes] + [result])
+
+@instrumented
+@tool
+def count_entities_within_radius(
+    table_name: str,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    start_date: str,
+    end_date: str,
+    isocode: str,
+    return_rows: bool = False,
+) -> str:
+    """
+    Count records and unique EntityId within radius_km of a latitude/longitude point,
+    for a date range and isocode. Use it instead of writing Haversine SQL by hand:
+    a bounding box on latitude/longitude prunes files and rows first and the exact
+    Haversine distance is only computed for the points inside the box.
+
+    Args:
+        table_name: Table to search, format 'catalog.db.table', eg. 'prod_catalog.adtech_db.base'
+        latitude: Latitude of the center point in degrees
+        longitude: Longitude of the center point in degrees
+        radius_km: Search radius in kilometers
+        start_date: First day to include, format 'YYYY-MM-DD'
+        end_date: Last day to include, format 'YYYY-MM-DD'
+        isocode: Isocode to filter on, eg. 'RU'
+        return_rows: Return up to 20 matching rows with their distance_km instead of the counts. Not required. Default is False.
+    """
+    try:
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date)
+    except ValueError:
+        return "Error: start_date and end_date must be formatted as 'YYYY-MM-DD'."
+    if not isocode.isalpha():
+        return "Error: isocode must be a plain country code, eg. 'RU'."
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or radius_km <= 0:
+        return "Error: latitude must be within [-90, 90], longitude within [-180, 180] and radius_km positive."
+
+    if return_rows:
+        select = "*"
+    else:
+        select = f"count(*) as records, count(distinct {GEO_ENTITY_COLUMN}) as unique_entities"
+    query = build_radius_query(
+        table_name,
+        latitude,
+        longitude,
+        radius_km,
+        time_filter=(
+            f"{GEO_TIME_COLUMN} >= '{start.isoformat()}' "
+            f"and {GEO_TIME_COLUMN} < '{(end + datetime.timedelta(days=1)).isoformat()}'"
+        ),
+        extra_filters=[f"{GEO_ISOCODE_COLUMN} = '{isocode.upper()}'"],
+        lat_col=GEO_LAT_COLUMN,
+        lon_col=GEO_LON_COLUMN,
+        select=select,
+        cell_col=GEO_CELL_COLUMN or None,
+        cell_precision=GEO_CELL_PRECISION,
+    )
+    try:
+        query, notes = prepare_query(query, 20)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
+
+    def run():
+        budget_error = check_scan_budget(query)
+        if budget_error:
+            return budget_error
+        with spark_session() as spark:
+            return render_df(spark.sql(query), max_rows=20)
+
+    result = run_once("count_entities_within_radius", query, run)
+    if result.startswith("Error:"):
+        return result
+    return "\n".join(notes + [result])
+
+@instrumented
+@tool
+def detect_volume_drops(
+    table_name: str,
+    start_date: str,
+    end_date: str,
+    isocodes: str,
+    dimensions: str = "provider,isocode",
+    granularity: str = "day",
+    where_clause: str = "",
+    top_k: int = 10,
+) -> str:
+    """
+    Find where and when record volume dropped, in one scan. Use it for "data drop" / "missing data" /
+    "why is volume down" questions instead of pulling rows with sql_query_to_str.
+    Counts records per day (or hour) for every combination of the dimensions, then checks all of
+    those series, each single dimension value and the total for dips (a run of buckets well below
+    the series' median) and level shifts (volume stays lower from some bucket on).
+    Returns the drops ranked by records lost: series, kind, first/last bucket, baseline and
+    observed records per bucket, relative change and records lost.
+
+    Args:
+        table_name: Table to check, format 'catalog.db.table', eg. 'prod_catalog.adtech_db.base'
+        start_date: First day to include, format 'YYYY-MM-DD'. Include some normal days before the suspected drop as a baseline.
+        end_date: Last day to include, format 'YYYY-MM-DD'
+        isocodes: Comma separated isocodes to include, eg. 'RU' or 'RU,US'
+        dimensions: Comma separated columns to break volume down by. Not required. Default is 'provider,isocode'.
+        granularity: 'day' or 'hour'. Not required. Default is 'day'.
+        where_clause: Extra SQL filter, eg. "lower(provider) = 'pickwell'". Not required. Default is no filter.
+        top_k: Number of drops to return. Not required. Default is 10.
+    """
+    try:
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date) + datetime.timedelta(days=1)
+    except ValueError:
+        return "Error: start_date and end_date must be formatted as 'YYYY-MM-DD'."
+    if end <= start:
+        return "Error: end_date must not be before start_date."
+    if granularity not in STEPS:
+        return f"Error: granularity must be one of {', '.join(STEPS)}."
+    dims = [dim.strip() for dim in dimensions.split(",") if dim.strip()]
+    if not all(re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", dim) for dim in dims):
+        return "Error: dimensions must be a comma separated list of column names, eg. 'provider,isocode'."
+    codes = [code.strip().upper() for code in isocodes.split(",") if code.strip()]
+    if not all(code.isalpha() for code in codes):
+        return "Error: isocodes must be plain country codes, eg. 'RU,US'."
+
+    filters = [f"{DROPS_TIME_COLUMN} >= '{start.isoformat()}'", f"{DROPS_TIME_COLUMN} < '{end.isoformat()}'"]
+    if codes:
+        filters.append(f"isocode in ({', '.join(repr(code) for code in codes)})")
+    if where_clause:
+        filters.append(f"({where_clause})")
+    group_by = ", ".join(str(i) for i in range(1, len(dims) + 2))
+    query = f"""
+        select date_trunc('{granularity.upper()}', {DROPS_TIME_COLUMN}) as bucket,
+               {"".join(f"{dim}, " for dim in dims)}count(*) as records
+        from {table_name}
+        where {" and ".join(filters)}
+        group by {group_by}
+    """
+    try:
+        query, notes = prepare_query(query, DROPS_MAX_ROWS + 1)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
+    routed = route_to_rollup(query)
+    if routed is not None:
+        query, rollup = routed
+        notes.append(f"counted from the daily rollup {rollup}")
+        record(rollup=rollup)
+
+    def run():
+        budget_error = check_scan_budget(query)
+        if budget_error:
+            return budget_error
+        with spark_session() as spark:
+            return list(iter_arrow_batches(spark.sql(query), DROPS_MAX_ROWS))
+
+    batches = run_once("detect_volume_drops", query, run)
+    if isinstance(batches, str):
+        return batches
+    rows = sum(batch.num_rows for batch in batches)
+    record(rows=rows)
+    if rows > DROPS_MAX_ROWS:
+        return f"Error: more than {DROPS_MAX_ROWS} (bucket, {', '.join(dims)}) rows. Use fewer dimensions, fewer days or day granularity."
+    if rows == 0:
+        return "\n".join(notes + ["No records in that range."])
+
+    table = pa.Table.from_batches(batches)
+    # the current bucket is still filling up and would always look like a drop
+    now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    current = now.replace(hour=0) if granularity == "day" else now
+    grid_end = min(np.datetime64(datetime.datetime.combine(end, datetime.time()), "s"), np.datetime64(current, "s"))
+    if grid_end <= np.datetime64(start.isoformat(), "s"):
+        return f"Error: no complete {granularity} between start_date and end_date yet."
+    labels, grid, matrix = volume_matrix(
+        table.column("bucket").to_numpy().astype("datetime64[s]"),
+        {dim: np.array(["NULL" if v is None else str(v) for v in table.column(i + 1).to_pylist()]) for i, dim in enumerate(dims)},
+        table.column("records").to_numpy(),
+        np.datetime64(start.isoformat(), "s"),
+        grid_end,
+        STEPS[granularity],
+    )
+    drops = find_drops(matrix, z_threshold=DROPS_Z_THRESHOLD, min_drop=DROPS_MIN_DROP)
+
+    unit = "D" if granularity == "day" else "m"
+    lines = notes + [
+        f"-- {len(labels)} series x {len(grid)} {granularity}s, {rows} aggregated rows from one scan",
+        f"rank | series | kind | first | last | baseline/{granularity} | observed/{granularity} | change | records lost",
+    ]
+    for rank, drop in enumerate(drops[:top_k], start=1):
+        lines.append(" | ".join([
+            str(rank), labels[drop["series"]], drop["kind"],
+            str(grid[drop["start"]].astype(f"datetime64[{unit}]")), str(grid[drop["end"]].astype(f"datetime64[{unit}]")),
+            f"{drop['baseline']:.1f}", f"{drop['observed']:.1f}", f"{drop['change']:+.0%}", f"{drop['lost']:.0f}",
+        ]))
+    if not drops:
+        lines.append(f"-- no drop of {DROPS_MIN_DROP:.0%} or more found")
+    elif len(drops) > top_k:
+        lines.append(f"-- {len(drops) - top_k} smaller drops not shown")
+    return "\n".join(lines)
+
+@instrumented
+@tool
+def get_column_profile(table_name: str, column_name: str = "", start_date: str = "", end_date: str = "", isocodes: str = "") -> str:
+    """
+    Column statistics from the precomputed profile store, in milliseconds and without scanning the table:
+    records, null fraction, distinct values, min/max and the most frequent values with their record counts.
+    Use it to learn what a column contains (eg. the exact spelling of provider values) before writing filters,
+    and to answer "unique values of a column" questions over whole days.
+    Distinct counts are exact when shown as a plain number, HyperLogLog estimates when shown as ~N.
+
+    Args:
+        table_name: Table to describe, format 'catalog.db.table', eg. 'prod_catalog.adtech_db.base'
+        column_name: Column to describe. Not required. Default is every profiled column.
+        start_date: First day to include, format 'YYYY-MM-DD'. Not required. Default is the first profiled day.
+        end_date: Last day to include, format 'YYYY-MM-DD'. Not required. Default is the last profiled day.
+        isocodes: Comma separated isocodes to include, eg. 'RU' or 'RU,US'. Not required. Default is all isocodes.
+    """
+    try:
+        start = datetime.date.fromisoformat(start_date) if start_date else None
+        end = datetime.date.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        return "Error: start_date and end_date must be formatted as 'YYYY-MM-DD'."
+    state = column_profiles.state(table_name)
+    if state is None:
+        return f"Error: {table_name} has no column profile. Use get_table_columns_and_types_as_list and sql_query_to_str instead."
+    types = {name.lower(): data_type for name, data_type in state["columns"]}
+    if column_name and column_name.lower() not in types:
+        return f"Error: column {column_name} is not profiled. Profiled columns: {', '.join(types)}"
+    codes = [code.strip().upper() for code in isocodes.split(",") if code.strip()]
+
+    columns = [column_name.lower()] if column_name else list(types)
+    shown = column_profiles.top_k if column_name else 5
+    snapshot = get_table_snapshot_id(table_name)
+    scope = f"{start or 'first day'} to {end or 'last day'}" + (f", isocode in ({', '.join(codes)})" if codes else "")
+    lines = [f"-- column profile of {table_name}, {scope}, refreshed {state['refreshed_at']}"]
+    if snapshot is not None and state["snapshot"] != str(snapshot):
+        lines.append(f"-- the table has changed since (snapshot {snapshot}), the latest data may be missing")
+    lines.append("column | type | records | nulls | distinct | min | max | top values (records)")
+    for column in columns:
+        profile = column_profiles.profile(table_name, column, start, end, {"isocode": codes} if codes else None)
+        if profile is None:
+            return "\n".join(lines[:1] + ["No profiled partitions in that range."])
+        # an exact value list when every partition's values fit in the store, else an HLL estimate
+        if profile["exact"]:
+            distinct = str(profile["distinct"])
+        else:
+            distinct = f"~{profile['distinct']} (±{1.04 / np.sqrt(2**column_profiles.hll_precision):.0%})"
+        top = ", ".join(f"{value} ({count})" for value, count in profile["top"][:shown])
+        if len(profile["top"]) > shown:
+            top += f", ... {len(profile['top']) - shown} more"
+        lines.append(" | ".join([
+            column, types[column], str(profile["rows"]),
+            f"{profile['nulls'] / profile['rows']:.1%}" if profile["rows"] else "-",
+            distinct, str(profile["min"]), str(profile["max"]), top or "-",
+        ]))
+    return "\n".join(lines)
+
+@instrumented
+@tool
+def estimate_query_cost(query: str) -> str:
+    """
+    Estimate how much data a SQL SELECT query would scan, without running it.
+    Use it before running queries over several days of a .base table.
+    sql_query_to_str refuses queries that are over the scan budget.
+
+    Args:
+        query: The SQL SELECT query to estimate
+    """
+    try:
+        query, _ = prepare_query(query, 20)
+        record(sql=query)
+        return describe_estimate(estimate_scan(query), MAX_SCAN_BYTES)
+    except (QueryRejected, CostEstimationError) as e:
+        return f"Error: {e}"
+
+@instrumented
 @tool
 def sql_query_to_pandas_df(query: str, max_rows: int = 20) -> pd.DataFrame | str:
     """
@@ -152,18 +839,19 @@ def sql_query_to_pandas_df(query: str, max_rows: int = 20) -> pd.DataFrame | str
         query: The SQL query to execute
         max_rows: Maximum number of rows to return. Not required. Default is 20.
     """
-    query_upper = query.strip().upper()
-    
-    if not query_upper.startswith('SELECT'):
-        return "Error: Only SELECT queries are allowed for security reasons."
-    
-    if "LIMIT" not in query_upper:
-        max_rows = 20 if max_rows > 20 else max_rows
-        query = query.replace(";", "") + f" LIMIT {max_rows}"
+    max_rows = 20 if max_rows > 20 else max_rows
+    try:
+        query, _ = prepare_query(query, max_rows)
+    except QueryRejected as e:
+        return f"Error: {e}"
+    record(sql=query)
 
-    result = spark.sql(query).toPandas()
+    with spark_session() as spark:
+        result = spark.sql(query).toPandas()
+    record(rows=len(result))
     return result
 
+@instrumented
 @tool
 def get_column_sample_as_list(table_name: str, column_name: str, limit: int = 20) -> list[str]:
     """
@@ -175,16 +863,22 @@ def get_column_sample_as_list(table_name: str, column_name: str, limit: int = 20
         limit: Maximum number of unique values to return. Not required. Default is 20.
     """
     limit = 20 if limit > 20 else limit
+    if column_profiles.state(table_name) is not None:
+        profile = column_profiles.profile(table_name, column_name)
+        if profile is not None and profile["top"]:
+            return [value for value, _ in profile["top"][:limit]]
     query = f"""
         select {column_name} 
         from {table_name} 
         where {column_name} is not null 
         limit {limit}
     """
-    result = spark.sql(query).collect()
+    with spark_session() as spark:
+        result = spark.sql(query).collect()
     column_sample = [row[column_name] for row in result]
     return column_sample
     
+@instrumented
 @tool
 def get_table_row_count(table_name: str) -> int:
     """
@@ -194,9 +888,11 @@ def get_table_row_count(table_name: str) -> int:
         table_name: Name of the table to count rows
     """
     query = f"select count(*) from {table_name}"
-    result = spark.sql(query).collect()
+    with spark_session() as spark:
+        result = spark.sql(query).collect()
     return result[0][0]
 
+@instrumented
 @tool
 def get_table_history(table_name: str, limit: int = 10) -> str:
     """
@@ -217,8 +913,8 @@ def get_table_history(table_name: str, limit: int = 10) -> str:
         join {table_name}.snapshots s
         on h.snapshot_id = s.snapshot_id
         order by made_current_at
-        limit 10
+        limit {limit}
     """
-    result = spark.sql(query).toPandas()
-    return result.to_string()
+    with spark_session() as spark:
+        return render_df(spark.sql(query), max_rows=limit)
     
\ No newline at end of file
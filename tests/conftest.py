@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the agent modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent"))
+os.environ.setdefault("ORACLE_TELEMETRY_MODE", "off")
+# keep the tests' stores out of the user's ~/.oracle
+_STORES = tempfile.mkdtemp(prefix="oracle-tests-")
+os.environ.setdefault("ORACLE_PROFILE_STORE_PATH", os.path.join(_STORES, "column_profiles.sqlite"))
+os.environ.setdefault("ORACLE_SCHEMA_INDEX_PATH", os.path.join(_STORES, "schema_index.sqlite"))
+os.environ.setdefault("ORACLE_CURSOR_DIR", os.path.join(_STORES, "cursors"))
+
+
+@pytest.fixture(scope="session")
+def spark(tmp_path_factory):
+    """Local spark session with the bench fixture table, also behind the tools' session pool."""
+    from pyspark.sql import SparkSession
+
+    from bench import BENCH_TABLE, build_fixture
+    from spark_session import configure_spark
+
+    warehouse = str(tmp_path_factory.mktemp("warehouse"))
+    session = (
+        SparkSession.builder.master("local[2]")
+        .appName("oracle-tests")
+        .config("spark.ui.enabled", "false")
+        .config("spark.sql.shuffle.partitions", "4")
+        .config("spark.sql.warehouse.dir", warehouse)
+        .config("spark.driver.extraJavaOptions", f"-Dderby.system.home={warehouse}")
+        .enableHiveSupport()
+        .getOrCreate()
+    )
+    session.sparkContext.setLogLevel("ERROR")
+    build_fixture(session, BENCH_TABLE)
+    configure_spark(factory=session.newSession)
+    yield session
+    session.stop()
@@ -0,0 +1,46 @@
+from approx import approximate_query, exact_reason
+from sql_utils import DIALECT, parse_sql
+
+TABLE = "prod_catalog.adtech_db.base"
+WHERE = "where isocode = 'RU' and eventtimeunix >= '2025-01-01' and eventtimeunix < '2025-02-01'"
+
+
+def approximate(query: str, sample_percent: float = 0.0):
+    expression = parse_sql(query)
+    notes = approximate_query(expression, sample_percent=sample_percent, rsd=0.05)
+    return expression, notes
+
+
+def test_count_distinct_gets_an_error_bound():
+    expression, notes = approximate(f"select count(distinct provider) as providers from {TABLE} {WHERE}")
+    sql = expression.sql(dialect=DIALECT)
+    assert "APPROX_COUNT_DISTINCT(provider, 0.05) AS providers" in sql
+    assert "AS providers_err95" in sql
+    assert notes == ["providers: approx_count_distinct, relative standard error 0.05"]
+
+
+def test_select_distinct_is_left_exact_and_says_so():
+    query = f"select distinct provider from {TABLE} {WHERE}"
+    expression, notes = approximate(query)
+    assert notes == []
+    assert expression.sql(dialect=DIALECT) == parse_sql(query).sql(dialect=DIALECT)
+    assert "nothing was approximated" in exact_reason(expression)
+    assert "COUNT(DISTINCT" in exact_reason(expression)
+
+
+def test_sampled_select_distinct_warns_about_missing_values():
+    _, notes = approximate(f"select distinct provider from {TABLE} {WHERE}", sample_percent=10)
+    assert any("values missing from the sample" in note for note in notes)
+
+
+def test_plain_query_is_exact():
+    expression, notes = approximate(f"select provider, count(*) as records from {TABLE} {WHERE} group by provider")
+    assert notes == []
+    assert exact_reason(expression) == "nothing in this query could be approximated, the result is exact"
+
+
+def test_nested_rewrite_is_still_reported():
+    _, notes = approximate(
+        f"select provider from {TABLE} {WHERE} group by provider having count(distinct EntityId) > 10"
+    )
+    assert notes == ["approx_count_distinct / percentile_approx inside the query, no error bound available"]
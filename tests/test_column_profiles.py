@@ -0,0 +1,38 @@
+import datetime
+
+import pytest
+
+from column_profiles import ColumnProfileStore
+
+TABLE = "spark_catalog.default.profile_null_days"
+SPEC = {"time_column": "eventtimeunix", "partition_columns": ["isocode"], "columns": []}
+
+
+@pytest.fixture(scope="module")
+def table(spark):
+    rows = [
+        ("A", datetime.datetime(2025, 1, 1, 3), "RU", "acme"),
+        ("B", datetime.datetime(2025, 1, 1, 9), "RU", "zed"),
+        ("C", datetime.datetime(2025, 1, 2, 5), "RU", None),
+        ("C", datetime.datetime(2025, 1, 2, 6), "RU", "acme"),
+        ("D", None, "RU", "acme"),
+        ("E", None, "US", "acme"),
+    ]
+    spark.createDataFrame(rows, "EntityId string, eventtimeunix timestamp, isocode string, provider string") \
+        .write.mode("overwrite").saveAsTable(TABLE)
+    return TABLE
+
+
+def test_null_days_are_skipped(spark, table, tmp_path):
+    store = ColumnProfileStore(str(tmp_path / "profiles.sqlite"))
+    result = store.refresh(spark, table, SPEC, rebuild=True)
+    assert result["action"] == "rebuilt"
+    assert result["null_time_rows"] == 2
+    assert result["days"] == 2
+
+    provider = store.profile(table, "provider")
+    assert (provider["partitions"], provider["rows"], provider["nulls"]) == (2, 4, 1)
+    assert provider["exact"] and dict(provider["top"]) == {"acme": 2, "zed": 1}
+
+    first_day = store.profile(table, "EntityId", datetime.date(2025, 1, 1), datetime.date(2025, 1, 1))
+    assert (first_day["rows"], first_day["distinct"]) == (2, 2)
@@ -0,0 +1,64 @@
+from conversation import ConversationMemory, extractive_summary, query_filters
+
+SQL = "select count(*) from prod_catalog.adtech_db.base where isocode = 'RU' and date(eventtimeunix) = '2025-01-31'"
+
+
+class CountingSummarizer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, summary: str, turn: dict) -> str:
+        self.calls += 1
+        return extractive_summary(summary, turn)
+
+
+def test_recent_turns_are_verbatim_and_older_ones_summarized():
+    summarize = CountingSummarizer()
+    memory = ConversationMemory(budget_tokens=2000, recent_turns=2, summarize=summarize)
+    for i in range(4):
+        memory.add_turn(f"question {i}", f"answer {i}")
+    assert summarize.calls == 2
+    context = memory.context()
+    assert "- question 0 -> answer 0\n- question 1 -> answer 1" in context
+    assert "User: question 2\nAgent: answer 2" in context and "User: question 3" in context
+
+
+def test_context_and_stats_do_not_change_the_memory():
+    summarize = CountingSummarizer()
+    memory = ConversationMemory(budget_tokens=200, recent_turns=3, summarize=summarize)
+    memory.add_turn("first question", "short answer")
+    # a pin added after the turn pushes the context over the budget
+    memory.pin("table", "x" * 1000)
+    before = (memory.summary, list(memory.turns), memory.summarized_turns)
+    context = memory.context()
+    stats = memory.stats()
+    assert memory.context() == context
+    assert (memory.summary, memory.turns, memory.summarized_turns) == before
+    assert summarize.calls == 0
+    assert stats["context_tokens"] <= 200 and stats["verbatim_turns"] == 1
+
+
+def test_adding_a_turn_enforces_the_budget():
+    memory = ConversationMemory(budget_tokens=150, recent_turns=5)
+    for i in range(5):
+        memory.add_turn(f"question {i} " + "word " * 40, "answer " * 40)
+    assert memory.stats()["context_tokens"] <= 150
+    assert memory.summarized_turns > 0
+
+
+def test_failing_summarizer_keeps_the_turn():
+    def failing(summary: str, turn: dict) -> str:
+        raise RuntimeError("model down")
+
+    memory = ConversationMemory(recent_turns=1, summarize=failing)
+    memory.add_turn("old question", "old answer")
+    memory.add_turn("new question", "new answer")
+    assert memory.summary == "- old question -> old answer"
+
+
+def test_last_query_is_pinned():
+    memory = ConversationMemory()
+    memory.add_turn("how many records?", "12", SQL)
+    assert memory.pins["tables queried"] == "prod_catalog.adtech_db.base"
+    assert memory.pins["filters in effect"] == " AND ".join(query_filters(SQL))
+    assert len(query_filters(SQL)) == 2
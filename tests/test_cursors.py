@@ -0,0 +1,67 @@
+import pyarrow as pa
+import pytest
+
+from cursors import CursorNotFound, CursorStore
+
+SCHEMA = pa.schema([("id", pa.int64()), ("payload", pa.string())])
+
+
+def batches(count: int, rows: int, payload_chars: int = 100, consumed: list | None = None):
+    for index in range(count):
+        if consumed is not None:
+            consumed.append(index)
+        start = index * rows
+        yield pa.record_batch(
+            [pa.array(range(start, start + rows), pa.int64()), pa.array(["x" * payload_chars] * rows)], schema=SCHEMA
+        )
+
+
+def test_whole_result_is_stored(tmp_path):
+    store = CursorStore(str(tmp_path))
+    cursor_id, cut = store.open(batches(3, 10), SCHEMA)
+    assert not cut
+    page, matching, total = store.read(cursor_id, order_by="id desc", limit=2)
+    assert total == matching == 30
+    assert page.column("id").to_pylist() == [29, 28]
+
+
+def test_row_limit_cuts_the_result(tmp_path):
+    store = CursorStore(str(tmp_path))
+    cursor_id, cut = store.open(batches(3, 10), SCHEMA, max_rows=25)
+    assert cut
+    assert store.table(cursor_id).num_rows == 25
+
+
+def test_exactly_max_rows_is_not_cut(tmp_path):
+    store = CursorStore(str(tmp_path))
+    _, cut = store.open(batches(3, 10), SCHEMA, max_rows=30)
+    assert not cut
+
+
+def test_byte_limit_stops_reading_the_batches(tmp_path):
+    store = CursorStore(str(tmp_path))
+    consumed = []
+    one_batch = next(batches(1, 1000)).nbytes
+    cursor_id, cut = store.open(batches(100, 1000, consumed=consumed), SCHEMA, max_bytes=int(2.5 * one_batch))
+    assert cut
+    assert len(consumed) == 3
+    assert 2000 <= store.table(cursor_id).num_rows < 3000
+
+
+def test_results_over_the_memory_budget_are_read_back_from_disk(tmp_path):
+    store = CursorStore(str(tmp_path), max_memory_bytes=1024)
+    cursor_id, _ = store.open(batches(5, 100), SCHEMA)
+    assert store.stats()["in_memory"] == 0
+    assert store.table(cursor_id).num_rows == 500
+
+
+def test_empty_result_keeps_its_schema(tmp_path):
+    store = CursorStore(str(tmp_path))
+    cursor_id, cut = store.open(iter([]), SCHEMA)
+    assert not cut
+    assert store.table(cursor_id).schema.names == ["id", "payload"]
+
+
+def test_unknown_cursor(tmp_path):
+    with pytest.raises(CursorNotFound):
+        CursorStore(str(tmp_path)).table("cdeadbeef")
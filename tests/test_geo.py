@@ -0,0 +1,39 @@
+import math
+
+import pytest
+
+from geo import EARTH_RADIUS_KM, bounding_box
+
+
+def destination(lat: float, lon: float, bearing_deg: float, distance_km: float) -> tuple[float, float]:
+    """Point `distance_km` from (lat, lon) along the great circle starting at `bearing_deg`."""
+    angle = distance_km / EARTH_RADIUS_KM
+    lat1, lon1, bearing = math.radians(lat), math.radians(lon), math.radians(bearing_deg)
+    lat2 = math.asin(math.sin(lat1) * math.cos(angle) + math.cos(lat1) * math.sin(angle) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(
+        math.sin(bearing) * math.sin(angle) * math.cos(lat1), math.cos(angle) - math.sin(lat1) * math.sin(lat2)
+    )
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+
+def in_box(box, lat: float, lon: float) -> bool:
+    min_lat, max_lat, lon_ranges = box
+    return min_lat <= lat <= max_lat and any(lo <= lon <= hi for lo, hi in lon_ranges)
+
+
+@pytest.mark.parametrize("center", [(0.0, 0.0), (55.75, 37.62), (-33.87, 151.21), (64.0, 179.95), (89.5, 10.0)])
+@pytest.mark.parametrize("bearing", [0, 90, 180, 270])
+@pytest.mark.parametrize("radius_km", [0.5, 10.0, 250.0])
+def test_points_just_inside_the_radius_are_in_the_box(center, bearing, radius_km):
+    lat, lon = destination(*center, bearing, radius_km * 0.9995)
+    assert in_box(bounding_box(*center, radius_km), lat, lon)
+
+
+def test_ten_km_due_north():
+    # 9.994 km north was outside the box when a degree of latitude was taken as 111.32 km
+    assert in_box(bounding_box(0.0, 0.0, 10.0), *destination(0.0, 0.0, 0, 9.994))
+
+
+def test_box_crossing_the_antimeridian_is_split():
+    _, _, lon_ranges = bounding_box(0.0, 179.99, 10.0)
+    assert len(lon_ranges) == 2
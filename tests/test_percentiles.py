@@ -0,0 +1,20 @@
+from percentiles import percentile
+
+
+def test_nearest_rank():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 95) == 5.0
+    assert percentile(values, 20) == 1.0
+    assert percentile(values, 21) == 2.0
+
+
+def test_same_answer_in_any_order():
+    samples = [0.3, 0.1, 0.9, 0.5, 0.7, 0.2, 0.8, 0.4, 0.6, 1.0]
+    assert percentile(samples, 95) == percentile(sorted(samples), 95) == 1.0
+    assert percentile(samples, 90) == 0.9
+
+
+def test_empty_and_single():
+    assert percentile([], 95) == 0.0
+    assert percentile([2.5], 50) == percentile([2.5], 95) == 2.5
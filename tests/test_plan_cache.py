@@ -0,0 +1,44 @@
+from plan_cache import PlanCache, question_template
+
+EQUALS_QUESTION = "How many records for EntityId = 'AB12' on Jan 31st 2025?"
+EQUALS_SQL = "SELECT COUNT(*) FROM base WHERE EntityId = 'AB12' AND event_date = '2025-01-31'"
+
+
+def learned_cache() -> PlanCache:
+    cache = PlanCache()
+    assert cache.learn(EQUALS_QUESTION, EQUALS_SQL)
+    return cache
+
+
+def test_same_template_gets_the_stored_sql_with_new_literals():
+    plan = learned_cache().lookup("How many records for EntityId = 'ZZ99' on Feb 2nd 2025?")
+    assert plan is not None
+    assert "'ZZ99'" in plan["sql"] and "'2025-02-02'" in plan["sql"]
+
+
+def test_negated_comparison_does_not_match():
+    cache = learned_cache()
+    assert cache.lookup("How many records for EntityId != 'AB12' on Jan 31st 2025?") is None
+    assert cache.stats()["hits"] == 0
+
+
+def test_other_comparison_word_does_not_match():
+    cache = learned_cache()
+    assert cache.lookup("How many records for EntityId = 'AB12' before Jan 31st 2025?") is None
+
+
+def test_template_is_case_and_whitespace_insensitive():
+    assert learned_cache().lookup("how many  records for EntityId = 'AB12' on Jan 31st 2025?") is not None
+
+
+def test_unproven_template_is_not_used():
+    cache = PlanCache(min_successes=2)
+    cache.learn(EQUALS_QUESTION, EQUALS_SQL)
+    assert cache.lookup(EQUALS_QUESTION) is None
+    assert cache.stats()["unproven"] == 1
+
+
+def test_question_template_slots():
+    template, values = question_template("records for EntityId='AB12' on Jan 31st 2025 in isocode RU")
+    assert template == "records for entityid=<str> on <date> in isocode <iso>"
+    assert values == [("str", "AB12"), ("date", "2025-01-31"), ("iso", "RU")]
@@ -0,0 +1,36 @@
+import pyarrow as pa
+from pyspark.sql import DataFrame
+
+from render import iter_arrow_batches, render_arrow, render_df
+
+QUERY = (
+    "select EntityId, eventtimeunix, provider, latitude from spark_catalog.adtech_db.base "
+    "where event_date = date'2025-01-31' and isocode = 'RU' order by eventtimeunix, EntityId"
+)
+
+
+def test_batches_have_one_row_over_the_limit(spark):
+    table = pa.Table.from_batches(list(iter_arrow_batches(spark.sql(QUERY), 5)))
+    assert table.num_rows == 6
+    assert table.column_names == ["EntityId", "eventtimeunix", "provider", "latitude"]
+
+
+def test_public_row_fallback_gives_the_same_batches(spark, monkeypatch):
+    arrow = pa.Table.from_batches(list(iter_arrow_batches(spark.sql(QUERY), 50)))
+    owner = next(cls for cls in DataFrame.__mro__ if "_collect_as_arrow" in vars(cls))
+    monkeypatch.delattr(owner, "_collect_as_arrow")
+    rows = pa.Table.from_batches(list(iter_arrow_batches(spark.sql(QUERY), 50)))
+    assert rows.equals(arrow.cast(rows.schema))
+
+
+def test_render_df_cuts_at_the_row_limit(spark):
+    rendered = render_df(spark.sql(QUERY), max_rows=3)
+    lines = rendered.splitlines()
+    assert lines[0] == "EntityId:string | eventtimeunix:timestamp | provider:string | latitude:double"
+    assert len(lines) == 5
+    assert lines[-1].startswith("-- showing 3 rows, more rows available (row limit 3)")
+
+
+def test_render_arrow_matches_render_df(spark):
+    table = pa.Table.from_batches(list(iter_arrow_batches(spark.sql(QUERY), 10)))
+    assert render_arrow(table, max_rows=10) == render_df(spark.sql(QUERY), max_rows=10)
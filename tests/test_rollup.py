@@ -0,0 +1,90 @@
+import pytest
+
+from bench import BENCH_ROLLUP, BENCH_TABLE
+from rollup import refresh_rollup, rewrite_for_rollup
+from sql_utils import DIALECT, parse_sql
+
+ROLLUPS = {BENCH_TABLE: BENCH_ROLLUP}
+WEEK = "eventtimeunix >= '2025-01-15' and eventtimeunix < '2025-01-22'"
+
+EQUIVALENT = {
+    "count": f"select count(*) from {BENCH_TABLE} where date(eventtimeunix) = '2025-01-31' and isocode = 'RU'",
+    "count_by_dimensions": f"""
+        select isocode, lower(provider) as provider, count(*) as records from {BENCH_TABLE}
+        where {WEEK} group by 1, 2
+    """,
+    "count_by_day": f"""
+        select to_date(eventtimeunix) as day, count(*) as records from {BENCH_TABLE}
+        where {WEEK} and provider = 'pickwell' group by 1
+    """,
+    "count_by_month": f"""
+        select month(eventtimeunix) as month, count(*) as records from {BENCH_TABLE}
+        where eventtimeunix >= '2025-01-01' and eventtimeunix < '2025-04-01' and isocode = 'US' group by 1
+    """,
+    "no_rows": f"select count(*) as records from {BENCH_TABLE} where {WEEK} and isocode = 'FR'",
+    "distinct": f"select distinct provider from {BENCH_TABLE} where {WEEK} and isocode = 'RU'",
+    "distinct_days": f"select distinct event_date, isocode from {BENCH_TABLE} where {WEEK}",
+}
+APPROX = f"""
+    select isocode, approx_count_distinct(EntityId) as entities from {BENCH_TABLE}
+    where eventtimeunix >= '2025-01-01' and eventtimeunix < '2025-02-01' group by isocode
+"""
+EXACT_DISTINCT = f"""
+    select isocode, count(distinct EntityId) as entities from {BENCH_TABLE}
+    where eventtimeunix >= '2025-01-01' and eventtimeunix < '2025-02-01' group by isocode
+"""
+
+REJECTED = {
+    "partial_day_start": f"select count(*) from {BENCH_TABLE} where eventtimeunix >= '2025-01-15 12:00:00' and isocode = 'RU'",
+    "partial_day_end": f"select count(*) from {BENCH_TABLE} where eventtimeunix < '2025-01-22 06:30' and isocode = 'RU'",
+    "inclusive_day_end": f"select count(*) from {BENCH_TABLE} where eventtimeunix <= '2025-01-22' and isocode = 'RU'",
+    "hour_function": f"select hour(eventtimeunix), count(*) from {BENCH_TABLE} where {WEEK} group by 1",
+    "entity_filter": f"select count(*) from {BENCH_TABLE} where {WEEK} and EntityId = 'AB12'",
+    "coordinate_filter": f"select count(*) from {BENCH_TABLE} where {WEEK} and latitude > 52",
+    "grouped_by_entity": f"select EntityId, count(*) from {BENCH_TABLE} where {WEEK} group by 1",
+    "exact_count_distinct": EXACT_DISTINCT,
+    "approx_of_other_column": f"select approx_count_distinct(provider) from {BENCH_TABLE} where {WEEK}",
+    "plain_rows": f"select isocode, provider from {BENCH_TABLE} where {WEEK}",
+}
+
+
+def rewrite(query: str):
+    return rewrite_for_rollup(parse_sql(query), ROLLUPS)
+
+
+def rows(spark, query: str) -> tuple[list[str], list[tuple]]:
+    df = spark.sql(query)
+    return df.columns, sorted(tuple(row) for row in df.collect())
+
+
+@pytest.fixture(scope="module")
+def rollup(spark):
+    refresh_rollup(spark, BENCH_TABLE, BENCH_ROLLUP, rebuild=True)
+    return spark
+
+
+@pytest.mark.parametrize("name", sorted(REJECTED))
+def test_rewrite_is_rejected(name):
+    assert rewrite(REJECTED[name]) is None
+
+
+@pytest.mark.parametrize("name", sorted(EQUIVALENT))
+def test_rollup_answers_match_the_source(rollup, name):
+    rewritten = rewrite(EQUIVALENT[name])
+    assert rewritten is not None
+    expression, source, table = rewritten
+    assert (source, table) == (BENCH_TABLE, BENCH_ROLLUP)
+    assert rows(rollup, expression.sql(dialect=DIALECT)) == rows(rollup, EQUIVALENT[name])
+
+
+def test_rollup_entity_estimate_matches_the_source(rollup):
+    expression, _, _ = rewrite(APPROX)
+    columns, from_rollup = rows(rollup, expression.sql(dialect=DIALECT))
+    source_columns, from_source = rows(rollup, APPROX)
+    _, exact = rows(rollup, EXACT_DISTINCT)
+    assert columns == source_columns
+    assert [row[0] for row in from_rollup] == [row[0] for row in from_source] == [row[0] for row in exact]
+    # both are HLL estimates of the same days, within their error of the exact count
+    for (_, sketched), (_, approximated), (_, counted) in zip(from_rollup, from_source, exact):
+        assert sketched == pytest.approx(counted, rel=0.05)
+        assert approximated == pytest.approx(counted, rel=0.05)
@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+from schema_index import SchemaIndex
+
+Table = namedtuple("Table", "namespace tableName isTemporary")
+
+
+class FakeSpark:
+    """Answers the statements SchemaIndex.refresh runs; statements in `failing` raise."""
+
+    def __init__(self, databases: dict[str, list[str]]):
+        self.databases = databases
+        self.failing: set[str] = set()
+
+    def sql(self, statement: str):
+        if statement in self.failing:
+            raise RuntimeError(f"transient failure: {statement}")
+        if statement.startswith("show databases in "):
+            return FakeResult([(database,) for database in self.databases])
+        if statement.startswith("show tables in "):
+            database = statement.rsplit(".", 1)[1]
+            return FakeResult([Table(database, table, False) for table in self.databases[database]])
+        if statement.startswith("describe table extended "):
+            return FakeResult([("id", "bigint", None), ("name", "string", "a name")])
+        # snapshot history: not an iceberg table
+        raise RuntimeError(f"unsupported: {statement}")
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def collect(self):
+        return self.rows
+
+
+def test_tables_of_a_failed_database_listing_are_kept(tmp_path):
+    index = SchemaIndex(str(tmp_path / "index.sqlite"))
+    spark = FakeSpark({"db1": ["t1"], "db2": ["t2"]})
+    assert index.refresh(spark, ["cat"])["tables"] == 2
+
+    spark.failing.add("show tables in cat.db2")
+    result = index.refresh(spark, ["cat"], rebuild=True)
+    assert (result["removed"], result["failed"]) == (0, ["cat.db2"])
+    assert index.tables("cat", "db2") == ["t2"]
+    assert index.table("cat.db2.t2") is not None
+
+
+def test_tables_of_a_failed_catalog_listing_are_kept(tmp_path):
+    index = SchemaIndex(str(tmp_path / "index.sqlite"))
+    spark = FakeSpark({"db1": ["t1"], "db2": ["t2"]})
+    index.refresh(spark, ["cat"])
+
+    spark.failing.add("show databases in cat")
+    result = index.refresh(spark, ["cat"])
+    assert (result["removed"], result["failed"]) == (0, ["cat"])
+    assert index.tables("cat", "db1") == ["t1"] and index.tables("cat", "db2") == ["t2"]
+
+
+def test_dropped_tables_are_removed(tmp_path):
+    index = SchemaIndex(str(tmp_path / "index.sqlite"))
+    spark = FakeSpark({"db1": ["t1", "t3"], "db2": ["t2"]})
+    index.refresh(spark, ["cat"])
+
+    spark.databases["db1"] = ["t1"]
+    assert index.refresh(spark, ["cat"])["removed"] == 1
+    assert index.tables("cat", "db1") == ["t1"]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+from tools import is_cancellation
+
+
+class FakeSparkError(Exception):
+    def __init__(self, message: str, error_class: str | None = None):
+        super().__init__(message)
+        self.error_class = error_class
+
+    def getErrorClass(self):
+        return self.error_class
+
+
+def run_with_waiter(flights: SingleFlight, first_error: BaseException) -> dict:
+    """The leader fails with `first_error` once a waiter has joined; what the waiter got back."""
+    waiting = threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        if len(calls) == 1:
+            assert waiting.wait(5)
+            raise first_error
+        return "rerun"
+
+    outcome = {}
+
+    def waiter():
+        while not flights.stats()["in_flight"]:
+            time.sleep(0.01)
+        threading.Timer(0.1, waiting.set).start()
+        try:
+            outcome["result"] = flights.do("q", query, timeout=5)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    with pytest.raises(BaseException):
+        flights.do("q", query)
+    thread.join(5)
+    outcome["calls"] = len(calls)
+    return outcome
+
+
+def test_error_mentioning_cancel_is_shared_with_waiters():
+    flights = SingleFlight(is_cancellation=is_cancellation)
+    error = FakeSparkError("[UNRESOLVED_COLUMN] A column `cancelled_at` cannot be resolved.", "UNRESOLVED_COLUMN")
+    outcome = run_with_waiter(flights, error)
+    assert outcome["error"] is error
+    assert outcome["calls"] == 1
+    assert flights.stats()["shared_errors"] == 1
+
+
+@pytest.mark.parametrize("error", [
+    FakeSparkError("An error occurred while calling o42.collectToPython.\n"
+                   ": org.apache.spark.SparkException: Job 3 cancelled part of cancelled job group 7"),
+    FakeSparkError("[OPERATION_CANCELED] Operation has been cancelled.", "OPERATION_CANCELED"),
+    KeyboardInterrupt(),
+])
+def test_cancelled_leader_makes_waiters_run_again(error):
+    flights = SingleFlight(is_cancellation=is_cancellation)
+    outcome = run_with_waiter(flights, error)
+    assert outcome["result"] == ("rerun", False)
+    assert outcome["calls"] == 2
+    assert flights.stats()["cancelled"] == 1
+
+
+def test_is_cancellation_signals():
+    assert is_cancellation(SystemExit())
+    assert not is_cancellation(ValueError("cancel"))
+    assert not is_cancellation(FakeSparkError("Job 3 failed: the cancel_reason column is null"))
@@ -0,0 +1,70 @@
+import pytest
+import sqlglot
+
+from sql_guard import QueryRejected, guard_partitions
+from sql_utils import DIALECT
+
+PARTITIONS = {"base": ["event_date", "isocode"]}
+DEFAULTS = {"event_date": "event_date = current_date()", "isocode": "isocode = 'RU'"}
+
+
+def guard(query: str, mode: str = "reject") -> tuple[str, list[str]]:
+    expression = sqlglot.parse_one(query, read=DIALECT)
+    notes = guard_partitions(expression, PARTITIONS, mode, DEFAULTS)
+    return expression.sql(dialect=DIALECT), notes
+
+
+def test_filters_in_the_scan_pass():
+    assert guard("SELECT COUNT(*) FROM base WHERE event_date = '2025-01-31' AND isocode = 'RU'")[1] == []
+
+
+def test_unfiltered_scan_is_rejected():
+    with pytest.raises(QueryRejected, match="without a filter on event_date, isocode"):
+        guard("SELECT COUNT(*) FROM base")
+
+
+def test_cte_filtered_by_its_reader_passes():
+    query = (
+        "WITH daily AS (SELECT event_date, isocode, EntityId FROM base) "
+        "SELECT COUNT(*) FROM daily WHERE event_date = '2025-01-31' AND isocode = 'RU'"
+    )
+    assert guard(query) == (sqlglot.parse_one(query, read=DIALECT).sql(dialect=DIALECT), [])
+
+
+def test_star_cte_filtered_by_every_reader_passes():
+    guard(
+        "WITH b AS (SELECT * FROM base) "
+        "SELECT * FROM b x JOIN b y ON x.EntityId = y.EntityId AND y.event_date = '2025-01-30' AND y.isocode = 'RU' "
+        "WHERE x.event_date = '2025-01-31' AND x.isocode = 'RU'"
+    )
+
+
+def test_subquery_filtered_through_a_cte_reading_it_passes():
+    guard(
+        "WITH b AS (SELECT * FROM (SELECT event_date, isocode FROM base) AS t) "
+        "SELECT COUNT(*) FROM b WHERE event_date = '2025-01-31' AND isocode = 'RU'"
+    )
+
+
+def test_cte_with_an_unfiltered_reader_is_rejected():
+    with pytest.raises(QueryRejected, match="inside the CTE/subquery"):
+        guard(
+            "WITH b AS (SELECT * FROM base) "
+            "SELECT * FROM b WHERE event_date = '2025-01-31' AND isocode = 'RU' UNION ALL SELECT * FROM b"
+        )
+
+
+def test_cte_renaming_or_limiting_the_column_is_rejected():
+    with pytest.raises(QueryRejected, match="inside the CTE/subquery"):
+        guard("WITH b AS (SELECT event_date AS day, isocode FROM base) SELECT * FROM b WHERE day = '2025-01-31' AND isocode = 'RU'")
+    with pytest.raises(QueryRejected, match="inside the CTE/subquery"):
+        guard("WITH b AS (SELECT * FROM base LIMIT 10) SELECT * FROM b WHERE event_date = '2025-01-31' AND isocode = 'RU'")
+
+
+def test_inject_mode_leaves_a_cte_filtered_by_its_reader_alone():
+    sql, notes = guard(
+        "WITH b AS (SELECT * FROM base WHERE isocode = 'RU') SELECT * FROM b WHERE event_date = '2025-01-31'",
+        mode="inject",
+    )
+    assert notes == []
+    assert "current_date" not in sql.lower()
@@ -0,0 +1,37 @@
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
+
+from telemetry import TailSamplingProcessor
+
+RUNS = 40_000
+
+
+def test_tail_sampling_is_independent_of_head_sampling():
+    exporter = InMemorySpanExporter()
+    tail = TailSamplingProcessor(SimpleSpanProcessor(exporter), 0.05, slow_seconds=3600, max_pending_traces=16)
+    provider = TracerProvider(sampler=TraceIdRatioBased(0.1))
+    provider.add_span_processor(tail)
+    tracer = provider.get_tracer("test")
+    for _ in range(RUNS):
+        with tracer.start_as_current_span("run"):
+            pass
+
+    head_kept = tail.stats()["kept"] + tail.stats()["dropped"]
+    assert 0.08 * RUNS < head_kept < 0.12 * RUNS
+    # head 0.1 x tail 0.05 = 0.5% of the runs, not min(0.1, 0.05) = 5%
+    assert 0.0025 * RUNS < len(exporter.get_finished_spans()) < 0.0075 * RUNS
+
+
+def test_errors_are_always_kept():
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(TailSamplingProcessor(SimpleSpanProcessor(exporter), 0.0, 3600, 16))
+    tracer = provider.get_tracer("test")
+    with tracer.start_as_current_span("run"):
+        with tracer.start_as_current_span("oracle.tool.sql_query_to_str") as span:
+            span.set_attribute("oracle.tool.error", True)
+    with tracer.start_as_current_span("run"):
+        pass
+    assert sorted(span.name for span in exporter.get_finished_spans()) == ["oracle.tool.sql_query_to_str", "run"]
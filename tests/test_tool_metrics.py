@@ -0,0 +1,98 @@
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from smolagents import tool
+
+from tool_metrics import add, instrumented, record, tool_metrics
+
+QUERY = (
+    "select isocode, count(*) as records from spark_catalog.adtech_db.base "
+    "where date(eventtimeunix) = '2025-01-31' and isocode = 'RU' group by isocode"
+)
+
+_exporter = InMemorySpanExporter()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tracer_provider():
+    # the global provider can only be set once per process
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(_exporter))
+    trace.set_tracer_provider(provider)
+
+
+@pytest.fixture
+def spans():
+    _exporter.clear()
+    tool_metrics.reset()
+    return _exporter
+
+
+@instrumented
+@tool
+def lookup_records(entity: str) -> str:
+    """
+    Test tool reporting its metrics like the real ones.
+
+    Args:
+        entity: EntityId to look up
+    """
+    record(sql=f"select * from base where EntityId = '{entity}'", rows=3)
+    add(cache_hits=1)
+    add(cache_hits=1, bytes_scanned=2048)
+    if not entity:
+        return "Error: no entity"
+    return "3 rows"
+
+
+def attributes(span) -> dict:
+    return {key[len("oracle."):]: value for key, value in span.attributes.items() if key.startswith("oracle.")}
+
+
+def test_span_carries_the_recorded_metrics(spans):
+    lookup_records("AB12")
+    [span] = spans.get_finished_spans()
+    assert span.name == "oracle.tool.lookup_records"
+    assert attributes(span) == {
+        "tool.name": "lookup_records",
+        "tool.error": False,
+        "spark_seconds": pytest.approx(0.0, abs=0.01),
+        "sql": "select * from base where EntityId = 'AB12'",
+        "rows": 3,
+        "cache_hits": 2,
+        "bytes_scanned": 2048,
+        "output_tokens": 2,
+    }
+
+
+def test_summary_sums_the_calls(spans):
+    lookup_records("AB12")
+    lookup_records("")
+    totals = tool_metrics.summary()["lookup_records"]
+    assert (totals["calls"], totals["errors"]) == (2, 1)
+    assert (totals["rows"], totals["cache_hits"], totals["bytes_scanned"]) == (6, 4, 4096)
+    assert [attributes(span)["tool.error"] for span in spans.get_finished_spans()] == [False, True]
+
+
+def test_sql_query_spans_on_the_fixture(spark, spans):
+    from tools import result_cache, sql_query_to_str
+
+    result_cache.clear()
+    first = sql_query_to_str(QUERY)
+    second = sql_query_to_str(QUERY)
+    assert first == second and not first.startswith("Error:")
+
+    ran, cached = [attributes(span) for span in spans.get_finished_spans()]
+    assert "eventtimeunix" in ran["sql"] and ran["rows"] == 1
+    assert ran["rows_scanned"] > 0 and ran["bytes_scanned"] > 0 and ran["files_scanned"] > 0
+    assert ran["spark_seconds"] > 0
+    assert cached.get("cache_hits", 0) >= 1 and "rows_scanned" not in cached
+
+    totals = tool_metrics.summary()["sql_query_to_str"]
+    assert totals["calls"] == 2 and totals["errors"] == 0
+    assert totals["rows"] == 1
+    assert totals["rows_scanned"] == ran["rows_scanned"]
+    assert totals["bytes_scanned"] == ran["bytes_scanned"]
+    assert totals["cache_hits"] == ran.get("cache_hits", 0) + cached["cache_hits"]
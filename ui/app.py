@@ -1,7 +1,28 @@
 import streamlit as st
-import openai
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 import os
+import sys
+import threading
+import time
+
+# timed from here to the end of the script: how long the page takes to answer a click
+page_start = time.perf_counter()
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent"))
+from config import (
+    CONVERSATION_RECENT_TURNS,
+    CONVERSATION_TOKEN_BUDGET,
+    METADATA_CACHE_TTL_SECONDS,
+    MODEL_TIER,
+    MODEL_TIERS,
+    SCHEMA_INDEX_CATALOGS,
+    UI_PREFETCH_WORKERS,
+)
+from conversation import ConversationMemory
+from percentiles import percentile
+from render import estimate_tokens
+from schema_index import SchemaIndex
 
 # Configure page
 st.set_page_config(
@@ -10,67 +31,122 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize OpenAI client
+# The agent module (tools, spark pool, model clients), loaded once per server process
+@st.cache_resource(show_spinner="Loading the agent...")
+def load_agent():
+    import agent
+    return agent
+
+# The tools module: spark session pool and the metadata cache shared by every browser session
+@st.cache_resource(show_spinner="Connecting to spark...")
+def load_tools():
+    import tools
+    return tools
+
+# Fallback for the dropdowns when spark can't be reached (python agent/schema_index.py)
 @st.cache_resource
-def get_openai_client():
-    # Make sure to set your OPENAI_API_KEY environment variable
-    return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def get_schema_index() -> SchemaIndex:
+    return SchemaIndex()
+
+class CatalogPrefetcher:
+    """
+    Lists the tables of every database of a catalog in background threads,
+    into the tools' metadata cache, so the database and table dropdowns
+    are answered from memory by the time they are opened. A catalog is
+    prefetched again once its entries could have expired from the cache.
+    """
+
+    def __init__(self, tools, workers: int):
+        self.tools = tools
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catalog-prefetch")
+        self._lock = threading.Lock()
+        self._started: Dict[str, float] = {}
+        self._progress: Dict[str, List[int]] = {}
+
+    def prefetch(self, catalog: str) -> None:
+        with self._lock:
+            if time.time() - self._started.get(catalog, 0.0) < METADATA_CACHE_TTL_SECONDS:
+                return
+            self._started[catalog] = time.time()
+            self._progress[catalog] = [0, 0]
+        self._executor.submit(self._catalog, catalog)
+
+    def progress(self, catalog: str) -> tuple[int, int]:
+        """(databases listed, databases in the catalog) of the last prefetch."""
+        with self._lock:
+            return tuple(self._progress.get(catalog, (0, 0)))
+
+    def _catalog(self, catalog: str) -> None:
+        try:
+            databases = self.tools.list_databases(catalog)
+        except Exception:
+            # try again on the next page run
+            with self._lock:
+                self._started.pop(catalog, None)
+            return
+        with self._lock:
+            self._progress[catalog] = [0, len(databases)]
+        for database in databases:
+            self._executor.submit(self._tables, catalog, database)
+
+    def _tables(self, catalog: str, database: str) -> None:
+        try:
+            self.tools.list_tables(catalog, database)
+        except Exception:
+            pass
+        with self._lock:
+            self._progress[catalog][0] += 1
+
+@st.cache_resource
+def get_prefetcher() -> CatalogPrefetcher:
+    return CatalogPrefetcher(load_tools(), UI_PREFETCH_WORKERS)
+
+def get_catalogs() -> List[str]:
+    return get_schema_index().catalogs() or SCHEMA_INDEX_CATALOGS
 
-# Fetch available OpenAI models
-@st.cache_data
-def get_available_models():
-    try:
-        client = get_openai_client()
-        models = client.models.list()
-        # Filter for chat models (GPT models)
-        chat_models = [
-            model.id for model in models.data 
-            if any(x in model.id.lower() for x in ['gpt-4', 'gpt-3.5', 'gpt-4o'])
-        ]
-        return sorted(chat_models)
-    except Exception as e:
-        # Fallback models if API call fails
-        return ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
-
-# Mock functions for database queries (replace with actual Spark queries)
-@st.cache_data
 def get_databases_for_catalog(catalog: str) -> List[str]:
-    # Replace with actual Spark query
-    mock_databases = {
-        "test_catalog": ["test_db1", "test_db2", "analytics_test"],
-        "prod_catalog": ["prod_db1", "prod_db2", "analytics_prod", "sales_db"],
-        "legacy_catalog": ["legacy_db1", "legacy_db2", "old_analytics"]
-    }
-    return mock_databases.get(catalog, [])
+    if not catalog:
+        return []
+    try:
+        return sorted(load_tools().list_databases(catalog))
+    except Exception:
+        return get_schema_index().databases(catalog)
 
-@st.cache_data
 def get_tables_for_database(catalog: str, database: str) -> List[str]:
-    # Replace with actual Spark query
-    mock_tables = [
-        "users", "orders", "products", "transactions", 
-        "customer_data", "sales_metrics", "inventory"
-    ]
-    return mock_tables
-
-# Initialize session state for chat history and model settings
+    if not catalog or not database or database == "Select database...":
+        return []
+    try:
+        return sorted(load_tools().list_tables(catalog, database))
+    except Exception:
+        return get_schema_index().tables(catalog, database)
+
+def reset_database() -> None:
+    st.session_state.database_select = "Select database..."
+    st.session_state.table_select = "Select table..."
+
+def reset_table() -> None:
+    st.session_state.table_select = "Select table..."
+
+# Initialize session state for chat history and agent settings
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+# per answer timings: time to first byte, total and time spent updating the page
+if "latencies" not in st.session_state:
+    st.session_state.latencies = []
+# what follow-up questions are told about the earlier turns (agent/conversation.py)
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory(
+        CONVERSATION_TOKEN_BUDGET,
+        CONVERSATION_RECENT_TURNS,
+        summarize=lambda summary, turn: load_agent().summarize_turn(summary, turn),
+    )
+# per page run: total time and time spent filling the dropdowns
+if "interactions" not in st.session_state:
+    st.session_state.interactions = []
 
-# Initialize model settings in session state
-if "selected_model" not in st.session_state:
-    st.session_state.selected_model = "gpt-3.5-turbo"
-if "system_message" not in st.session_state:
-    st.session_state.system_message = "You are a helpful data analyst assistant. Help users analyze and understand their data with clear, accurate insights."
-if "temperature" not in st.session_state:
-    st.session_state.temperature = 0.7
-if "max_tokens" not in st.session_state:
-    st.session_state.max_tokens = 500
-if "top_p" not in st.session_state:
-    st.session_state.top_p = 1.0
-if "frequency_penalty" not in st.session_state:
-    st.session_state.frequency_penalty = 0.0
-if "presence_penalty" not in st.session_state:
-    st.session_state.presence_penalty = 0.0
+# Initialize agent settings in session state
+if "selected_tier" not in st.session_state:
+    st.session_state.selected_tier = "auto"
 
 # Custom CSS for styling
 st.markdown("""
@@ -89,114 +165,68 @@ st.markdown("""
 # Main header
 st.markdown('<div class="main-header">Data Investigation UI</div>', unsafe_allow_html=True)
 
-# Sidebar for model settings
+# Sidebar for agent settings
 with st.sidebar:
-    st.markdown("## 🤖 Model Settings")
-    
-    # Model selection
-    available_models = get_available_models()
-    st.session_state.selected_model = st.selectbox(
-        "Select Model",
-        options=available_models,
-        index=available_models.index(st.session_state.selected_model) if st.session_state.selected_model in available_models else 0,
-        key="model_selector"
-    )
-    
-    # System message
-    with st.expander("System Message", expanded=False):
-        st.session_state.system_message = st.text_area(
-            "Custom System Message",
-            value=st.session_state.system_message,
-            height=100,
-            help="Define the AI's role and behavior",
-            key="system_message_input"
-        )
-    
-    st.markdown("### Model Parameters")
-    
-    # Temperature
-    st.session_state.temperature = st.slider(
-        "Temperature",
-        min_value=0.0,
-        max_value=2.0,
-        value=st.session_state.temperature,
-        step=0.1,
-        help="Controls randomness: 0.0 = deterministic, 2.0 = very creative",
-        key="temperature_slider"
-    )
-    
-    # Max tokens
-    st.session_state.max_tokens = st.slider(
-        "Max Tokens",
-        min_value=50,
-        max_value=4000,
-        value=st.session_state.max_tokens,
-        step=50,
-        help="Maximum length of the response",
-        key="max_tokens_slider"
-    )
-    
-    # Top P
-    st.session_state.top_p = st.slider(
-        "Top P",
-        min_value=0.0,
-        max_value=1.0,
-        value=st.session_state.top_p,
-        step=0.05,
-        help="Nucleus sampling: consider top P% of tokens",
-        key="top_p_slider"
-    )
-    
-    # Frequency penalty
-    st.session_state.frequency_penalty = st.slider(
-        "Frequency Penalty",
-        min_value=-2.0,
-        max_value=2.0,
-        value=st.session_state.frequency_penalty,
-        step=0.1,
-        help="Reduces repetition of tokens",
-        key="frequency_penalty_slider"
-    )
-    
-    # Presence penalty
-    st.session_state.presence_penalty = st.slider(
-        "Presence Penalty",
-        min_value=-2.0,
-        max_value=2.0,
-        value=st.session_state.presence_penalty,
-        step=0.1,
-        help="Encourages talking about new topics",
-        key="presence_penalty_slider"
+    st.markdown("## 🤖 Agent Settings")
+
+    # Model tier selection; 'auto' lets the router pick by question complexity
+    tier_options = ["auto"] + [tier["name"] for tier in MODEL_TIERS]
+    st.session_state.selected_tier = st.selectbox(
+        "Model Tier",
+        options=tier_options,
+        index=tier_options.index(st.session_state.selected_tier),
+        help=", ".join(f"{tier['name']}: {tier['model_id']}" for tier in MODEL_TIERS),
+        key="tier_selector"
     )
-    
+
+    # Answer latency, measured in the browser session
+    with st.expander("Latency", expanded=False):
+        latencies = st.session_state.latencies
+        if latencies:
+            st.json({
+                "answers": len(latencies),
+                "first_byte_p50_s": percentile([l["first_byte_s"] for l in latencies], 50),
+                "first_byte_p95_s": percentile([l["first_byte_s"] for l in latencies], 95),
+                "total_p50_s": percentile([l["total_s"] for l in latencies], 50),
+                "total_p95_s": percentile([l["total_s"] for l in latencies], 95),
+                "render_p95_s": percentile([l["render_s"] for l in latencies], 95),
+                "prompt_tokens_p50": percentile([l.get("prompt_tokens", 0) for l in latencies], 50),
+                "prompt_tokens_p95": percentile([l.get("prompt_tokens", 0) for l in latencies], 95),
+                "conversation_tokens_sent": sum(l.get("context_tokens", 0) for l in latencies),
+                "full_history_tokens": sum(l.get("history_tokens", 0) for l in latencies),
+            })
+        else:
+            st.caption("No answers yet.")
+        interactions = st.session_state.interactions
+        if interactions:
+            st.json({
+                "page_runs": len(interactions),
+                "page_p50_s": percentile([i["page_s"] for i in interactions], 50),
+                "page_p95_s": percentile([i["page_s"] for i in interactions], 95),
+                "dropdowns_p95_s": percentile([i["dropdowns_s"] for i in interactions], 95),
+            })
+
     # Show current settings
     with st.expander("Current Settings", expanded=False):
         st.json({
-            "model": st.session_state.selected_model,
-            "temperature": st.session_state.temperature,
-            "max_tokens": st.session_state.max_tokens,
-            "top_p": st.session_state.top_p,
-            "frequency_penalty": st.session_state.frequency_penalty,
-            "presence_penalty": st.session_state.presence_penalty
+            "tier": st.session_state.selected_tier,
+            "default_tier": MODEL_TIER,
         })
 
 # Control section
-# Top row with dropdowns and toggle
+# Top row with dropdowns and toggle; filled catalog -> database -> table so each list
+# is built from the selection above it in the same run, no extra rerun needed
 col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    selected_table = st.selectbox(
-        "Table",
-        options=["Select table..."] + get_tables_for_database("", ""),
-        key="table_select"
-    )
+dropdowns_start = time.perf_counter()
 
 with col2:
     selected_catalog = st.selectbox(
         "Catalog",
-        options=["test_catalog", "prod_catalog", "legacy_catalog"],
-        key="catalog_select"
+        options=get_catalogs(),
+        key="catalog_select",
+        on_change=reset_database
     )
+    get_prefetcher().prefetch(selected_catalog)
 
 with col3:
     # Get databases based on selected catalog
@@ -204,99 +234,183 @@ with col3:
     selected_database = st.selectbox(
         "Database",
         options=["Select database..."] + databases,
-        key="database_select"
+        key="database_select",
+        on_change=reset_table
+    )
+
+with col1:
+    selected_table = st.selectbox(
+        "Table",
+        options=["Select table..."] + get_tables_for_database(selected_catalog, selected_database),
+        key="table_select"
     )
+    listed, total = get_prefetcher().progress(selected_catalog)
+    if listed < total:
+        st.caption(f"Listing tables in the background: {listed}/{total} databases")
 
 with col4:
-    metadata_enabled = st.toggle("Metadata", value=False)
+    metadata_enabled = st.toggle("Metadata", value=False, help="Show the agent's steps, tool calls and SQL while it works")
 
-# Update table options when database changes
-if selected_database and selected_database != "Select database...":
-    tables = get_tables_for_database(selected_catalog, selected_database)
-    # Force refresh of table selectbox
-    st.rerun()
+dropdowns_seconds = time.perf_counter() - dropdowns_start
 
 # Horizontal rule separator
 st.markdown("<hr>", unsafe_allow_html=True)
 
+def render_step(step: Dict[str, Any]) -> None:
+    """One agent step: its code, the tool calls it made with their SQL, and any error."""
+    st.markdown(f"**Step {step['step']}**")
+    if step["code"]:
+        st.code(step["code"], language="python")
+    for call in step["tools"]:
+        st.caption(f"{call['tool']}" + (f" · {call['rows']} rows" if "rows" in call else "") + (" · error" if call["error"] else ""))
+        if call.get("sql"):
+            st.code(call["sql"], language="sql")
+    if step["error"]:
+        st.error(step["error"])
+
+def answer(question: str) -> Dict[str, Any]:
+    """Stream the agent's answer into the page as it is produced; returns the chat history entry."""
+    start = time.perf_counter()
+    first_byte = None
+    render_seconds = 0.0
+    steps = []
+    output, tier, final = None, None, {}
+    # earlier turns, within the token budget, instead of the whole chat history
+    memory = st.session_state.memory
+    context = memory.context()
+
+    status = st.status("Thinking...", expanded=metadata_enabled)
+    live = st.empty()
+    text, shown_at = "", 0.0
+    tier_name = None if st.session_state.selected_tier == "auto" else st.session_state.selected_tier
+    for event in load_agent().stream_answer(question, tier_name, context):
+        now = time.perf_counter()
+        if first_byte is None:
+            first_byte = now - start
+        if event["type"] == "token":
+            text += event["text"]
+            # redrawing on every token costs more than the tokens; ~10 updates a second is enough
+            if now - shown_at < 0.1:
+                continue
+            shown_at = now
+            live.markdown(text)
+        elif event["type"] == "plan":
+            with status:
+                st.markdown(event["text"])
+        elif event["type"] == "step":
+            steps.append(event)
+            text = ""
+            live.empty()
+            with status:
+                render_step(event)
+            tools = ", ".join(call["tool"] for call in event["tools"]) or "no tool calls"
+            status.update(label=f"Step {event['step']}: {tools}")
+        elif event["type"] == "final":
+            output, tier, final = event["output"], event["tier"], event
+            live.empty()
+            status.update(
+                label=f"{'Answered from a cached plan' if event['cached'] else f'{len(steps)} steps on the {tier} tier'}",
+                state="complete" if event["succeeded"] else "error",
+                expanded=False,
+            )
+        render_seconds += time.perf_counter() - now
+
+    st.write(output)
+    total = time.perf_counter() - start
+    latency = {
+        "first_byte_s": round(first_byte or total, 3),
+        "total_s": round(total, 3),
+        "render_s": round(render_seconds, 3),
+        "prompt_tokens": final.get("prompt_tokens", 0),
+        "context_tokens": estimate_tokens(context),
+        # what sending the whole chat history instead would have added
+        "history_tokens": memory.history_tokens,
+    }
+    st.caption(
+        f"first byte {latency['first_byte_s']}s · total {latency['total_s']}s · page updates {latency['render_s']}s · "
+        f"{latency['prompt_tokens']} prompt tokens, {latency['context_tokens']} of them conversation "
+        f"(full history: {latency['history_tokens']})"
+    )
+    memory.add_turn(question, str(output), final.get("sql"))
+    st.session_state.latencies.append(latency)
+    return {"role": "assistant", "content": str(output), "steps": steps, "latency": latency}
+
 # Conversation section with ChatGPT-like interface
 st.markdown("### Conversation")
 
-# Create main chat container
-chat_container = st.container(height=500)
-
-# Display chat history using native Streamlit chat components
-with chat_container:
-    for message in st.session_state.chat_history:
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
-
-# Chat input and clear button on same row
-input_col, clear_col = st.columns([0.85, 0.15])
-
-with input_col:
-    query_input = st.chat_input("Ask a question about your data...")
-
-with clear_col:
-    if st.session_state.chat_history:
-        if st.button("Clear", type="secondary", use_container_width=True):
-            st.session_state.chat_history = []
-            st.rerun()
-
-# Handle new query submission
-if query_input:
-    # Add user message to chat history
-    st.session_state.chat_history.append({
-        "role": "user",
-        "content": query_input
-    })
-    
-    # Display user message immediately
+# A fragment: sending a message or clearing the chat reruns only this section, not the whole page
+@st.fragment
+def conversation() -> None:
+    # Create main chat container
+    chat_container = st.container(height=500)
+
+    # Display chat history using native Streamlit chat components
     with chat_container:
-        with st.chat_message("user"):
-            st.write(query_input)
-    
-    # Get AI response
-    try:
-        client = get_openai_client()
-        
-        # Create context message with selected database info
-        database_context = f"You are helping analyze data from {selected_catalog}.{selected_database}.{selected_table if selected_table != 'Select table...' else 'unspecified table'}. "
-        database_context += f"Metadata access is {'enabled' if metadata_enabled else 'disabled'}."
-        
-        # Combine custom system message with database context
-        full_system_message = f"{st.session_state.system_message}\n\nDatabase Context: {database_context}"
-        
-        # Build messages with proper typing
-        messages: List[Dict[str, str]] = [
-            {"role": "system", "content": full_system_message}
-        ]
-        messages.extend(st.session_state.chat_history)
-        
-        response = client.chat.completions.create(
-            model=st.session_state.selected_model,
-            messages=messages,  # type: ignore
-            max_tokens=st.session_state.max_tokens,
-            temperature=st.session_state.temperature,
-            top_p=st.session_state.top_p,
-            frequency_penalty=st.session_state.frequency_penalty,
-            presence_penalty=st.session_state.presence_penalty
+        for message in st.session_state.chat_history:
+            with st.chat_message(message["role"]):
+                if message.get("steps"):
+                    with st.expander(f"{len(message['steps'])} agent steps", expanded=False):
+                        for step in message["steps"]:
+                            render_step(step)
+                st.write(message["content"])
+                if message.get("latency"):
+                    latency = message["latency"]
+                    st.caption(
+                        f"first byte {latency['first_byte_s']}s · total {latency['total_s']}s · "
+                        f"{latency['prompt_tokens']} prompt tokens, {latency['context_tokens']} of them conversation"
+                    )
+
+    # Chat input and clear button on same row
+    input_col, clear_col = st.columns([0.85, 0.15])
+
+    with input_col:
+        query_input = st.chat_input("Ask a question about your data...")
+
+    with clear_col:
+        if st.session_state.chat_history:
+            if st.button("Clear", type="secondary", use_container_width=True):
+                st.session_state.chat_history = []
+                st.session_state.memory.clear()
+                st.rerun(scope="fragment")
+
+    # Handle new query submission
+    if query_input:
+        # Add user message to chat history
+        st.session_state.chat_history.append({
+            "role": "user",
+            "content": query_input
+        })
+
+        # Display user message immediately
+        with chat_container:
+            with st.chat_message("user"):
+                st.write(query_input)
+
+        # Point the agent at the selected table, if any
+        question = query_input
+        st.session_state.memory.pin(
+            "selected table",
+            f"{selected_catalog}.{selected_database}.{selected_table}"
+            if selected_table != "Select table..." and selected_database != "Select database..." else None,
         )
-        
-        assistant_response = response.choices[0].message.content
-        
-    except Exception as e:
-        assistant_response = f"Mock Response: I understand you're asking about '{query_input}'. In a real implementation, I would query the {selected_catalog}.{selected_database} database and provide insights about your data. (Using {st.session_state.selected_model} with temp={st.session_state.temperature})"
-    
-    # Add assistant response to chat history
-    st.session_state.chat_history.append({
-        "role": "assistant", 
-        "content": assistant_response
-    })
-    
-    # Display assistant message immediately
-    with chat_container:
-        with st.chat_message("assistant"):
-            st.write(assistant_response)
-    
-    st.rerun()
+
+        # Stream the agent's steps and answer in place
+        with chat_container:
+            with st.chat_message("assistant"):
+                try:
+                    message = answer(question)
+                except Exception as e:
+                    st.error(f"The agent failed: {e}")
+                    message = {"role": "assistant", "content": f"The agent failed: {e}"}
+
+        # Add assistant response to chat history
+        st.session_state.chat_history.append(message)
+
+conversation()
+
+st.session_state.interactions.append({
+    "page_s": round(time.perf_counter() - page_start, 3),
+    "dropdowns_s": round(dropdowns_seconds, 3),
+})
+# only the recent runs matter for the percentiles
+st.session_state.interactions = st.session_state.interactions[-500:]